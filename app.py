@@ -1,96 +1,352 @@
-from flask import Flask, render_template, request, jsonify, Response
-from openai import OpenAI
+from flask import Flask, render_template, request, jsonify, Response, g
 from dotenv import load_dotenv
-import os
+import atexit
 import json
-from queue import Queue
-from threading import Event
-import time
-from asgiref.sync import async_to_sync
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
 
 from core import StoryOrchestrator
+from core.agents.asset_store import AssetStore
+from core.agents.model_router import ModelRouter, parse_routes
+from core.llm import (
+    BackgroundEventLoop, FakeLLMBackend, LLMDispatchError, RateLimitedBackend, ResponseCache,
+    as_backend, create_async_client
+)
+from core.services import ChatHub, Metrics, SessionRegistry, StoryStore
 
 # Cargar variables de entorno
 load_dotenv()
 
 # Inicializar Flask y OpenAI
 app = Flask(__name__)
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-orchestrator = StoryOrchestrator(client)
+# Métricas de latencia, tokens y costo, expuestas en /metrics
+metrics = Metrics()
+metrics.describe("agent_request_seconds", "Duración de cada llamada de un agente al LLM")
+metrics.describe("agent_tokens_total", "Tokens consumidos por rol de agente")
+metrics.describe("agent_cost_usd_total", "Costo estimado en USD por rol de agente y modelo")
+metrics.describe("agent_truncated_total", "Respuestas cortadas por max_tokens, por rol y modelo")
+metrics.describe("stage_seconds", "Duración de cada etapa del desarrollo de una historia")
+metrics.describe("chat_delivery_seconds", "Tiempo entre la publicación de un mensaje y su envío por SSE")
+metrics.describe("llm_retries_total", "Reintentos de llamadas al LLM por tipo de error")
+metrics.describe("llm_coalesced_total", "Llamadas idénticas servidas por una petición ya en vuelo")
+metrics.describe("model_fallback_total", "Llamadas desviadas a un modelo más rápido por incumplir el SLO")
+metrics.describe("llm_rate_limit_wait_seconds", "Espera por el límite de tasa antes de cada llamada")
+metrics.describe("asset_reuse_total", "Ubicaciones reutilizadas de capítulos o historias anteriores")
+metrics.describe("asset_calls_saved_total", "Llamadas al Geógrafo evitadas por tener ya todas las ubicaciones")
+metrics.describe("narrator_candidates_total", "Versiones del capítulo generadas para el Árbitro")
+metrics.describe("narrator_candidates_cancelled_total", "Versiones canceladas porque otra ya superó el umbral")
+metrics.describe("narrator_wasted_tokens_total", "Tokens de versiones terminadas que no se usaron")
+metrics.describe("quality_gate_total", "Capítulos aceptados por el Árbitro o elegidos por mejor puntuación")
+metrics.describe("quality_gate_score", "Puntuación del Árbitro a la versión elegida")
+
+if os.getenv('LLM_BACKEND') == 'fake':
+    # Backend local sin red, para desarrollo y pruebas de la interfaz
+    client = FakeLLMBackend(latency=float(os.getenv('FAKE_LLM_LATENCY', '0.5')),
+                            tokens_per_second=float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', '200')))
+else:
+    client = create_async_client(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+    )
+# Límites de tasa, reintentos y plazos compartidos por todas las sesiones; los límites
+# en 0 se aprenden de las cabeceras del proveedor
+llm_backend = RateLimitedBackend(
+    as_backend(client),
+    requests_per_minute=float(os.getenv('LLM_REQUESTS_PER_MINUTE', '0')),
+    tokens_per_minute=float(os.getenv('LLM_TOKENS_PER_MINUTE', '0')),
+    max_retries=int(os.getenv('LLM_MAX_RETRIES', '5')),
+    deadline=float(os.getenv('LLM_DEADLINE_SECONDS', '120')),
+    # Espera máxima entre fragmentos de un stream y, si se indica, por respuesta completa
+    attempt_timeout=float(os.getenv('LLM_ATTEMPT_TIMEOUT_SECONDS', '60')),
+    completion_timeout=float(os.getenv('LLM_COMPLETION_TIMEOUT_SECONDS', '0')) or None,
+    metrics=metrics
+)
+# Caché de respuestas del LLM; LLM_CACHE_REPLAY=1 sirve todo desde caché sin red. Apagada
+# por defecto (LLM_CACHE_ENABLED=1 la activa): con ella, regenerar una historia con la misma
+# idea devolvería el mismo texto
+cache_enabled = os.getenv('LLM_CACHE_ENABLED', '0') == '1' or os.getenv('LLM_CACHE_REPLAY', '0') == '1'
+response_cache = ResponseCache(
+    max_memory_bytes=int(os.getenv('LLM_CACHE_MEMORY_BYTES', str(32 * 1024 * 1024))),
+    disk_path=os.getenv('LLM_CACHE_PATH') or None,
+    max_disk_bytes=int(os.getenv('LLM_CACHE_DISK_BYTES', str(512 * 1024 * 1024))),
+    replay=os.getenv('LLM_CACHE_REPLAY', '0') == '1'
+)
+
+# Modelo por rol; MODEL_ROUTES (JSON) ajusta la tabla, p. ej. {"narrador": {"model": "gpt-4o-mini"}}
+model_router = ModelRouter(parse_routes(json.loads(os.getenv('MODEL_ROUTES', '{}'))), metrics=metrics)
+
+def create_orchestrator():
+    # Todas las sesiones comparten el mismo cliente LLM y su pool de conexiones
+    return StoryOrchestrator(
+        llm_backend,
+        max_concurrent_agents=int(os.getenv('MAX_CONCURRENT_AGENTS', '4')),
+        prefetch_depth=int(os.getenv('PREFETCH_DEPTH', '1')),
+        # Capítulos más largos se narran en segmentos paralelos (0 = siempre de una vez)
+        segment_chars=int(os.getenv('NARRATION_SEGMENT_CHARS', '0')),
+        # Versiones paralelas de cada capítulo que puntúa el Árbitro (1 = sin control de calidad).
+        # Con más de una, un capítulo no precalculado no se ve en streaming: llega entero
+        # después de la puntuación
+        narrator_candidates=int(os.getenv('NARRATOR_CANDIDATES', '1')),
+        quality_threshold=float(os.getenv('QUALITY_THRESHOLD', '7')),
+        # Textos del chat y los capítulos en un archivo mapeado en lugar de la memoria del proceso
+        history_spill_dir=os.getenv('HISTORY_SPILL_DIR') or None,
+        cache=response_cache if cache_enabled else None,
+        metrics=metrics,
+        router=model_router
+    )
+
+# Descripciones compartidas por las historias de un mismo mundo ("world" en /generate_story).
+# Cada mundo pertenece a la sesión que lo nombra: otra sesión con el mismo nombre tiene el
+# suyo. Se descartan los menos usados al superar MAX_WORLDS.
+MAX_WORLDS = int(os.getenv('MAX_WORLDS', '200'))
+world_assets: "OrderedDict[Tuple[str, str], AssetStore]" = OrderedDict()
+world_assets_lock = threading.Lock()
+
+def world_asset_store(session_id: str, world: Optional[str]) -> Optional[AssetStore]:
+    if not world:
+        return None
+    key = (session_id, world)
+    with world_assets_lock:
+        store = world_assets.get(key)
+        if store is None:
+            store = world_assets[key] = AssetStore()
+            while len(world_assets) > MAX_WORLDS:
+                world_assets.popitem(last=False)
+        else:
+            world_assets.move_to_end(key)
+        return store
+
+def drop_worlds(session_id: str):
+    with world_assets_lock:
+        for key in [key for key in world_assets if key[0] == session_id]:
+            del world_assets[key]
+
+# Journal de cada historia en disco: una sesión se rehidrata en su siguiente petición
+story_store = StoryStore(
+    os.getenv('STORY_STORE_DIR', 'data/stories'),
+    snapshot_every=int(os.getenv('STORY_SNAPSHOT_EVERY', '200')),
+    # Historias sin cambios en este tiempo se borran (0 = guardarlas siempre)
+    retention_seconds=float(os.getenv('STORY_RETENTION_SECONDS', str(7 * 24 * 3600)))
+)
+# Al arrancar se borran las historias vencidas; después, al expulsar sesiones
+story_store.sweep()
+# El journal se escribe en un hilo aparte: terminar de escribirlo al salir
+atexit.register(story_store.close)
+
+def open_session(session):
+    chat_hub.open_session(session.session_id)
+    orchestrator = session.orchestrator
+    state = story_store.load(session.session_id)
+    if state:
+        orchestrator.restore_state(state)
+    orchestrator.set_journal(story_store.journal(session.session_id))
+    # Mensajes del chat y texto del Narrador hacia las pestañas de la sesión
+    orchestrator.set_chat_callback(
+        lambda message: chat_hub.publish(session.session_id, {"chat_history": [message]})
+    )
+    orchestrator.set_stream_callback(lambda update: chat_hub.publish(session.session_id, update))
+
+# Un único event loop para todos los orquestadores: el cliente asíncrono y su pool de
+# conexiones viven en él. Con Flask es un BackgroundEventLoop propio; con asgi.py, el del
+# servidor ASGI (ver use_event_loop).
+orchestrator_loop = None
+_llm_loop = None
+_llm_loop_lock = threading.Lock()
 
-# Cola para mensajes del chat
-chat_updates = Queue()
-chat_event = Event()
+def get_llm_loop():
+    global _llm_loop, orchestrator_loop
+    with _llm_loop_lock:
+        if _llm_loop is None:
+            _llm_loop = BackgroundEventLoop()
+            orchestrator_loop = _llm_loop.loop
+    return _llm_loop
+
+def use_event_loop(loop):
+    global orchestrator_loop
+    orchestrator_loop = loop
+
+def close_session(session):
+    # Los capítulos precalculados viven en el event loop: cancelarlos desde su propio hilo
+    if orchestrator_loop is not None:
+        orchestrator_loop.call_soon_threadsafe(session.orchestrator.close)
+    chat_hub.close_session(session.session_id)
+    story_store.release(session.session_id)
+    drop_worlds(session.session_id)
+
+# Un orquestador por sesión de navegador
+SESSION_COOKIE = 'story_session'
+sessions = SessionRegistry(
+    create_orchestrator,
+    max_sessions=int(os.getenv('MAX_SESSIONS', '100')),
+    ttl_seconds=float(os.getenv('SESSION_TTL_SECONDS', '3600')),
+    max_memory_bytes=int(os.getenv('SESSION_MAX_MEMORY_BYTES', str(256 * 1024 * 1024))),
+    on_evict=close_session,
+    on_create=open_session
+)
+
+# Difusión de los mensajes del chat a todas las pestañas de cada sesión
+chat_hub = ChatHub(
+    buffer_size=int(os.getenv('CHAT_BUFFER_SIZE', '256')),
+    max_pending=int(os.getenv('CHAT_MAX_PENDING', '512')),
+    metrics=metrics
+)
+metrics.register_gauge("active_sessions", lambda: len(sessions), "Sesiones con orquestador en memoria")
+metrics.register_gauge("sse_subscribers", chat_hub.subscriber_count, "Conexiones SSE abiertas")
+metrics.register_gauge("cache_hits", lambda: response_cache.stats.hits, "Aciertos de la caché de respuestas")
+metrics.register_gauge("cache_misses", lambda: response_cache.stats.misses, "Fallos de la caché de respuestas")
+HEARTBEAT_SECONDS = 15.0
+
+def current_session_id():
+    """Identificador de la sesión del cliente; se crea uno nuevo si no trae la cookie."""
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if not session_id:
+        session_id = g.get('new_session_id') or uuid.uuid4().hex
+        g.new_session_id = session_id
+    return session_id
+
+@app.after_request
+def set_session_cookie(response):
+    if g.get('new_session_id'):
+        response.set_cookie(SESSION_COOKIE, g.new_session_id, httponly=True, samesite='Lax')
+    return response
+
+@app.errorhandler(LLMDispatchError)
+def llm_unavailable(error):
+    # El proveedor sigue limitando o no responde: el cliente puede reintentar más tarde
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    if error.retry_after:
+        response.headers['Retry-After'] = str(max(1, round(error.retry_after)))
+    return response
 
 @app.route('/')
 def index():
+    current_session_id()
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/trace')
+def story_trace():
+    """Traza de la historia de la sesión actual: spans y totales por rol de agente."""
+    session = sessions.peek(current_session_id())
+    if session is None:
+        return jsonify({"error": "No hay una historia en curso para esta sesión"}), 404
+    return jsonify(session.orchestrator.trace.to_dict())
+
+@app.route('/story_state')
+def story_state():
+    """Capítulos ya desarrollados de la sesión, p. ej. para retomar la historia tras recargar."""
+    orchestrator = sessions.get(current_session_id()).orchestrator
+    state = orchestrator.story_state
+    return jsonify({
+        "chapters": [
+            {"chapter_number": c.number, "chapter_title": c.title, "content": c.content,
+             "character_count": c.character_count}
+            for c in state.chapters
+        ],
+        "total_chapters": state.total_chapters,
+        "total_chars": state.total_chars,
+        "is_complete": orchestrator.pending_chapter_count == 0 and bool(state.chapters)
+    })
+
 @app.route('/chat_updates')
 def chat_updates_stream():
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    # Registrar la sesión (y su canal) si aún no existe, p. ej. antes de /generate_story
+    session = sessions.get(current_session_id())
+    subscription = chat_hub.subscribe(session.session_id, last_event_id)
+    
     def generate():
-        while True:
-            # Esperar hasta que haya nuevos mensajes o timeout después de 1 segundo
-            if chat_event.wait(timeout=1.0):
-                chat_event.clear()
-                while not chat_updates.empty():
-                    update = chat_updates.get()
-                    yield f"data: {json.dumps(update)}\n\n"
-            else:
-                # Enviar un heartbeat para mantener la conexión viva
-                yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-            time.sleep(0.1)  # Pequeña pausa para no sobrecargar el CPU
+        try:
+            yield "retry: 1000\n\n"
+            while not subscription.closed:
+                # Se despierta en cuanto se publica un mensaje, sin sondeo
+                events = subscription.get(timeout=HEARTBEAT_SECONDS)
+                if events:
+                    for event in events:
+                        yield event.to_sse()
+                elif not subscription.closed:
+                    # Comentario SSE para mantener la conexión viva
+                    yield ": heartbeat\n\n"
+        finally:
+            chat_hub.unsubscribe(subscription)
     
-    return Response(generate(), mimetype='text/event-stream')
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+async def advance_story(session, data):
+    """Cuerpo de /next_chapter, compartido por Flask y asgi.py."""
+    feedback = data.get('feedback', '')
+    orchestrator = session.orchestrator
+    async with session.lock:
+        revision = {}
+        if feedback:
+            # Regenerar solo lo que el feedback afecta; los mensajes de los agentes ya
+            # llegan a los clientes a través del callback del chat
+            revision = await orchestrator.process_chapter_feedback(feedback)
+        
+        # Obtener el siguiente capítulo
+        result = await orchestrator.get_next_chapter(
+            feedback, since_message=data.get('since_message'),
+            feedback_applied='revised_chapter' in revision
+        )
+        if 'revised_chapter' in revision:
+            # El capítulo actual reescrito según el feedback, para reemplazarlo en la página
+            result['revised_chapter'] = revision['revised_chapter']
+        return result
+
+async def start_story(session, data):
+    """Cuerpo de /generate_story, compartido por Flask y asgi.py."""
+    character_names = data.get('character_names', [])
+    model_overrides = data.get('model_overrides')
+    orchestrator = session.orchestrator
+    # Validar antes de descartar la historia anterior
+    orchestrator.router.validate_overrides(model_overrides)
+    async with session.lock:
+        # Limpiar el estado anterior
+        orchestrator.set_asset_store(world_asset_store(session.session_id, data.get('world')))
+        orchestrator.reset_state()
+        
+        # Agregar agentes de personaje para cada nombre proporcionado
+        for name in character_names:
+            orchestrator.add_character_agent(name)
+        
+        return await orchestrator.generate_story(
+            data.get('initial_idea'), data.get('character_count'), data.get('narration_style'), character_names,
+            model_overrides=model_overrides, since_message=data.get('since_message')
+        )
 
 @app.route('/next_chapter', methods=['POST'])
 def next_chapter():
-    data = request.json
-    feedback = data.get('feedback', '')
-    
-    if feedback:
-        # Procesar el feedback a través de los agentes de manera síncrona
-        feedback_analysis = async_to_sync(orchestrator.process_chapter_feedback)(feedback)
+    session = sessions.get(current_session_id())
+    try:
+        next_chapter_data = get_llm_loop().run(advance_story(session, request.json))
+        sessions.enforce_limits(keep=session.session_id)
         
-        # Notificar a los clientes sobre la actualización del chat
-        chat_updates.put({"chat_history": feedback_analysis["chat_history"]})
-        chat_event.set()
+        return jsonify(next_chapter_data)
     
-    # Obtener el siguiente capítulo
-    next_chapter_data = orchestrator.get_next_chapter(feedback)
-    return jsonify(next_chapter_data)
+    except LLMDispatchError:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/generate_story', methods=['POST'])
 def generate_story():
-    data = request.json
-    initial_idea = data.get('initial_idea')
-    character_count = data.get('character_count')
-    narration_style = data.get('narration_style')
-    character_names = data.get('character_names', [])
-    
-    # Limpiar el estado anterior
-    orchestrator.reset_state()
-    
-    # Agregar agentes de personaje para cada nombre proporcionado
-    for name in character_names:
-        orchestrator.add_character_agent(name)
-    
+    session = sessions.get(current_session_id())
     try:
-        # Configurar un callback para manejar las actualizaciones del chat en tiempo real
-        def chat_update_callback(message):
-            chat_updates.put({"chat_history": [message]})
-            chat_event.set()
-        
-        # Asignar el callback al orquestador
-        orchestrator.set_chat_callback(chat_update_callback)
-        
-        # Generar la historia de manera síncrona
-        result = async_to_sync(orchestrator.generate_story)(
-            initial_idea, character_count, narration_style, character_names
-        )
+        # Generar la historia en el event loop compartido
+        result = get_llm_loop().run(start_story(session, request.json))
+        sessions.enforce_limits(keep=session.session_id)
         
         return jsonify(result)
     
+    except LLMDispatchError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -0,0 +1,192 @@
+"""
+Punto de entrada ASGI: todas las historias y conexiones SSE en un único event loop.
+
+``/generate_story``, ``/next_chapter`` y ``/chat_updates`` se atienden aquí sin ocupar un
+hilo por petición; si el cliente se desconecta, su corrutina se cancela. El resto de
+rutas (página, estáticos, /metrics, /trace, /story_state) se delegan en la app Flask.
+
+    uvicorn asgi:application --workers 1
+"""
+import asyncio
+import json
+import uuid
+from http.cookies import SimpleCookie
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as story_app
+from core.llm import LLMDispatchError
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def read_body(receive: Callable) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def run_until_disconnect(receive: Callable, coro: Awaitable):
+    """Ejecuta ``coro`` y la cancela si el cliente se desconecta antes de que termine."""
+    task = asyncio.ensure_future(coro)
+
+    async def wait_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(wait_disconnect())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        raise ClientDisconnected()
+    finally:
+        watcher.cancel()
+        task.cancel()
+
+
+class StoryASGIApp:
+    def __init__(self, flask_app):
+        self.fallback = WsgiToAsgi(flask_app)
+        self.routes: Dict[Tuple[str, str], Callable] = {
+            ("POST", "/generate_story"): self.generate_story,
+            ("POST", "/next_chapter"): self.next_chapter,
+            ("GET", "/chat_updates"): self.chat_updates,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        handler = self.routes.get((scope.get("method"), scope.get("path")))
+        if handler is None:
+            return await self.fallback(scope, receive, send)
+        session_id, new_session = self._session_id(scope)
+        headers: Headers = []
+        if new_session:
+            cookie = f"{story_app.SESSION_COOKIE}={session_id}; HttpOnly; SameSite=Lax; Path=/"
+            headers.append((b"set-cookie", cookie.encode()))
+        try:
+            await handler(scope, receive, send, session_id, headers)
+        except ClientDisconnected:
+            # Nadie espera la respuesta: la corrutina de la historia ya se canceló
+            pass
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Los orquestadores se ejecutan en el loop del servidor
+                story_app.use_event_loop(asyncio.get_running_loop())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                story_app.response_cache.close()
+                await asyncio.to_thread(story_app.story_store.close)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def generate_story(self, scope, receive, send, session_id: str, headers: Headers):
+        data = json.loads(await read_body(receive) or b"{}")
+        session = await asyncio.to_thread(story_app.sessions.get, session_id)
+        try:
+            result = await run_until_disconnect(receive, story_app.start_story(session, data))
+        except LLMDispatchError as e:
+            return await self._llm_unavailable(send, headers, e)
+        except ClientDisconnected:
+            raise
+        except Exception as e:
+            return await send_json(send, {"error": str(e)}, 500, headers)
+        story_app.sessions.enforce_limits(keep=session_id)
+        await send_json(send, result, 200, headers)
+
+    async def next_chapter(self, scope, receive, send, session_id: str, headers: Headers):
+        data = json.loads(await read_body(receive) or b"{}")
+        session = await asyncio.to_thread(story_app.sessions.get, session_id)
+        try:
+            result = await run_until_disconnect(receive, story_app.advance_story(session, data))
+        except LLMDispatchError as e:
+            return await self._llm_unavailable(send, headers, e)
+        except ClientDisconnected:
+            raise
+        except Exception as e:
+            return await send_json(send, {"error": str(e)}, 500, headers)
+        story_app.sessions.enforce_limits(keep=session_id)
+        await send_json(send, result, 200, headers)
+
+    async def chat_updates(self, scope, receive, send, session_id: str, headers: Headers):
+        last_event_id = _last_event_id(scope)
+        # Registrar la sesión (y su canal) si aún no existe, p. ej. antes de /generate_story
+        await asyncio.to_thread(story_app.sessions.get, session_id)
+        subscription = story_app.chat_hub.subscribe(session_id, last_event_id)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": headers + [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+            })
+            await run_until_disconnect(receive, self._stream_events(send, subscription))
+        finally:
+            story_app.chat_hub.unsubscribe(subscription)
+
+    async def _stream_events(self, send, subscription):
+        await send_chunk(send, "retry: 1000\n\n")
+        while not subscription.closed:
+            # Se despierta en cuanto se publica un mensaje, sin ocupar un hilo
+            events = await subscription.get_async(timeout=story_app.HEARTBEAT_SECONDS)
+            if events:
+                await send_chunk(send, "".join(event.to_sse() for event in events))
+            elif not subscription.closed:
+                await send_chunk(send, ": heartbeat\n\n")
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _llm_unavailable(self, send, headers: Headers, error: LLMDispatchError):
+        if error.retry_after:
+            headers = headers + [(b"retry-after", str(max(1, round(error.retry_after))).encode())]
+        await send_json(send, {"error": str(error)}, 503, headers)
+
+    @staticmethod
+    def _session_id(scope) -> Tuple[str, bool]:
+        cookie = SimpleCookie()
+        for name, value in scope.get("headers", []):
+            if name == b"cookie":
+                cookie.load(value.decode("latin-1"))
+        morsel = cookie.get(story_app.SESSION_COOKIE)
+        if morsel and morsel.value:
+            return morsel.value, False
+        return uuid.uuid4().hex, True
+
+
+def _last_event_id(scope) -> Optional[int]:
+    for name, value in scope.get("headers", []):
+        if name == b"last-event-id":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def send_json(send, data, status: int, headers: Headers):
+    body = json.dumps(data).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": headers + [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_chunk(send, text: str):
+    await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+
+application = StoryASGIApp(story_app.app)
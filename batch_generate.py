@@ -0,0 +1,300 @@
+"""
+Generación de historias por lotes, sin servidor web.
+
+Lee especificaciones desde un JSONL (una historia por línea) y las desarrolla en paralelo
+con un límite global de peticiones al LLM en vuelo. Cada historia terminada se anexa al
+JSONL de salida; al relanzar el comando se omiten las que ya están en la salida y las que
+quedaron a medias continúan desde su journal. Ejemplo de especificación:
+
+    {"id": "cueva", "idea": "Una expedición a una cueva", "character_names": ["Ana", "Luis"],
+     "style": "descriptivo", "length": 5000, "models": {"narrador": {"model": "gpt-4o-mini"}},
+     "world": "montaña"}
+
+``models`` es opcional y cambia el modelo, max_tokens o temperatura de algunos roles.
+``world`` también: las historias del mismo mundo reutilizan las ubicaciones y perfiles ya descritos.
+
+Uso:
+
+    python batch_generate.py historias.jsonl resultados.jsonl --max-in-flight 32 --max-stories 16
+
+Con ``--staged DIR`` no se llama al modelo: cada ejecución rehace lo ya resuelto a partir de
+los ``DIR/results-*.jsonl`` y escribe en ``DIR/requests-NNNN.jsonl`` las peticiones de la
+siguiente etapa de todas las historias, para enviarlas a la Batch API del proveedor. El
+resultado se guarda como ``DIR/results-NNNN.jsonl`` y se vuelve a lanzar el comando, hasta
+que no quedan etapas. ``--fulfill-with fake`` resuelve cada lote en el momento con el
+backend local (para pruebas).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from core.agents.asset_store import AssetStore
+from core.agents.model_router import ModelRouter
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm import (
+    ConcurrencyLimitedBackend, FakeLLMBackend, LLMBackend, OpenAIBackend, RateLimitedBackend,
+    ResponseCache, StagedBatchBackend, create_async_client, fulfill_batch
+)
+from core.llm.batch import next_stage_paths
+from core.services import StoryStore
+
+
+def load_specs(path: str) -> List[Dict]:
+    specs = []
+    with open(path, encoding="utf-8") as source:
+        for line_number, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            spec = json.loads(line)
+            spec.setdefault("id", f"linea-{line_number}")
+            spec["id"] = str(spec["id"])
+            specs.append(spec)
+    return specs
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Historias que ya figuran como terminadas en la salida de una ejecución anterior."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as output:
+        for line in output:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Última línea incompleta si la ejecución anterior se interrumpió
+                continue
+            if result.get("status") == "ok":
+                done.add(str(result["id"]))
+    return done
+
+
+class BatchRunner:
+    """Desarrolla las historias con ``max_stories`` orquestadores a la vez sobre un backend compartido."""
+
+    def __init__(self, backend: LLMBackend, store: StoryStore, output_path: str,
+                 max_stories: int = 8, max_concurrent_agents: int = 4, prefetch_depth: int = 1,
+                 cache: Optional[ResponseCache] = None, segment_chars: int = 0, resume: bool = True,
+                 narrator_candidates: int = 1, quality_threshold: float = 7.0,
+                 history_spill_dir: Optional[str] = None):
+        self.backend = backend
+        self.store = store
+        self.output_path = output_path
+        self.max_stories = max(1, max_stories)
+        self.max_concurrent_agents = max_concurrent_agents
+        self.prefetch_depth = prefetch_depth
+        self.cache = cache
+        self.segment_chars = segment_chars
+        # Sin resume no se lee ni se escribe el journal: cada historia empieza de cero (modo por etapas)
+        self.resume = resume
+        self.narrator_candidates = narrator_candidates
+        self.quality_threshold = quality_threshold
+        self.history_spill_dir = history_spill_dir
+        # Un único router: todas las historias comparten las mediciones de latencia por modelo
+        self.router = ModelRouter()
+        self.worlds: Dict[str, AssetStore] = {}
+        self.counts = {"ok": 0, "error": 0}
+
+    async def run(self, specs: List[Dict]):
+        queue: asyncio.Queue = asyncio.Queue()
+        for spec in specs:
+            queue.put_nowait(spec)
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            workers = [asyncio.create_task(self._worker(queue, output))
+                       for _ in range(min(self.max_stories, len(specs)))]
+            await asyncio.gather(*workers)
+
+    async def run_staged(self, specs: List[Dict], staging: StagedBatchBackend, batch_dir: str,
+                         fulfill: Optional[LLMBackend] = None) -> Optional[str]:
+        """
+        Avanza todas las historias hasta que cada una espera la siguiente etapa. Devuelve la
+        ruta del lote pendiente, o None si terminaron. Con ``fulfill`` los lotes se resuelven
+        en el momento y se sigue hasta el final.
+        """
+        os.makedirs(batch_dir, exist_ok=True)
+        staging.load_results(batch_dir)
+        task = asyncio.create_task(self.run(specs))
+        while True:
+            await staging.wait_until_blocked(task)
+            if task.done():
+                task.result()
+                return None
+            requests_path, results_path = next_stage_paths(batch_dir)
+            count = staging.export(requests_path)
+            print(f"etapa {os.path.basename(requests_path)}: {count} peticiones", file=sys.stderr)
+            if fulfill is None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return requests_path
+            await fulfill_batch(requests_path, results_path, fulfill)
+            staging.ingest(results_path)
+
+    async def _worker(self, queue: asyncio.Queue, output):
+        while not queue.empty():
+            spec = queue.get_nowait()
+            result = await self._run_story(spec)
+            self.counts[result["status"]] += 1
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            if result["status"] == "ok" and self.resume:
+                await asyncio.to_thread(self.store.delete, spec["id"])
+
+    async def _run_story(self, spec: Dict) -> Dict:
+        orchestrator = StoryOrchestrator(
+            self.backend, max_concurrent_agents=self.max_concurrent_agents,
+            prefetch_depth=self.prefetch_depth, cache=self.cache, router=self.router,
+            segment_chars=self.segment_chars,
+            narrator_candidates=self.narrator_candidates, quality_threshold=self.quality_threshold,
+            history_spill_dir=self.history_spill_dir,
+            asset_store=self.worlds.setdefault(spec["world"], AssetStore()) if spec.get("world") else None
+        )
+        start = time.perf_counter()
+        # En modo por etapas, el backend distingue qué historias esperan su próximo lote
+        staged = isinstance(self.backend, StagedBatchBackend)
+        scope = self.backend.job(spec["id"]) if staged else contextlib.nullcontext()
+        with scope:
+            try:
+                state = await asyncio.to_thread(self.store.load, spec["id"]) if self.resume else None
+                resumed = bool(state and state["chapters"])
+                if resumed:
+                    # Continuar desde el último capítulo guardado
+                    orchestrator.restore_state(state)
+                if self.resume:
+                    orchestrator.set_journal(self.store.journal(spec["id"]))
+                if not resumed:
+                    names = spec.get("character_names", [])
+                    for name in names:
+                        orchestrator.add_character_agent(name)
+                    await orchestrator.generate_story(
+                        spec["idea"], spec.get("length", 5000), spec.get("style", "descriptivo"), names,
+                        model_overrides=spec.get("models")
+                    )
+                while not (await orchestrator.get_next_chapter())["is_complete"]:
+                    pass
+            except Exception as e:
+                return {"id": spec["id"], "status": "error", "error": str(e)}
+            finally:
+                orchestrator.close()
+
+        state = orchestrator.story_state
+        return {
+            "id": spec["id"],
+            "status": "ok",
+            "resumed": resumed,
+            "chapters": [
+                {"number": c.number, "title": c.title, "content": c.content} for c in state.chapters
+            ],
+            "total_chars": state.total_chars,
+            "elapsed_seconds": time.perf_counter() - start,
+            "usage": orchestrator.trace.roles,
+            "counters": orchestrator.trace.counters
+        }
+
+
+def create_backend(args):
+    if args.backend == "fake":
+        return FakeLLMBackend(latency=args.fake_latency)
+    # Un pool de conexiones del tamaño del límite de peticiones en vuelo
+    return OpenAIBackend(create_async_client(api_key=os.getenv('OPENAI_API_KEY'),
+                                             max_connections=args.max_in_flight))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Genera historias por lotes desde un archivo JSONL")
+    parser.add_argument("specs", help="JSONL con una especificación de historia por línea")
+    parser.add_argument("output", help="JSONL donde se anexan las historias terminadas")
+    parser.add_argument("--max-in-flight", type=int, default=32, help="peticiones al LLM en vuelo en total")
+    parser.add_argument("--rpm", type=float, default=0.0, help="peticiones por minuto (0 = según el proveedor)")
+    parser.add_argument("--tpm", type=float, default=0.0, help="tokens por minuto (0 = según el proveedor)")
+    parser.add_argument("--deadline", type=float, default=300.0, help="plazo por llamada con reintentos (s)")
+    parser.add_argument("--attempt-timeout", type=float, default=60.0,
+                        help="espera máxima entre fragmentos de un stream antes de reintentar (s)")
+    parser.add_argument("--completion-timeout", type=float, default=0.0,
+                        help="espera máxima por intento de una respuesta completa (s, 0 = solo el plazo)")
+    parser.add_argument("--max-stories", type=int, default=16, help="historias desarrollándose a la vez")
+    parser.add_argument("--max-concurrent-agents", type=int, default=4)
+    parser.add_argument("--prefetch-depth", type=int, default=1)
+    parser.add_argument("--segment-chars", type=int, default=0,
+                        help="narrar en segmentos paralelos los capítulos más largos que esto (0 = nunca)")
+    parser.add_argument("--narrator-candidates", type=int, default=1,
+                        help="versiones paralelas de cada capítulo que puntúa el Árbitro (1 = desactivado)")
+    parser.add_argument("--quality-threshold", type=float, default=7.0,
+                        help="puntuación (0-10) con la que se acepta una versión y se cancelan las demás")
+    parser.add_argument("--history-spill-dir", default=None,
+                        help="guardar el texto del chat y los capítulos en archivos mapeados de este directorio")
+    parser.add_argument("--state-dir", default=None,
+                        help="journal de las historias a medias (por defecto <output>.state)")
+    parser.add_argument("--cache-path", default=None, help="caché SQLite de respuestas del LLM")
+    parser.add_argument("--backend", choices=["openai", "fake"], default="openai")
+    parser.add_argument("--fake-latency", type=float, default=0.05)
+    parser.add_argument("--staged", metavar="DIR", default=None,
+                        help="exportar las llamadas por etapas a lotes JSONL de la Batch API en DIR")
+    parser.add_argument("--fulfill-with", choices=["fake"], default=None,
+                        help="resolver cada lote en el momento con el backend local (solo con --staged)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    args = parse_args(argv)
+    specs = load_specs(args.specs)
+    done = completed_ids(args.output)
+    pending = [spec for spec in specs if spec["id"] not in done]
+    print(f"{len(specs)} historias, {len(done & {s['id'] for s in specs})} ya terminadas, "
+          f"{len(pending)} pendientes", file=sys.stderr)
+
+    if args.staged:
+        return run_staged(args, pending)
+
+    # Las peticiones que esperan cupo de tasa no ocupan plaza en vuelo
+    limited = ConcurrencyLimitedBackend(create_backend(args), args.max_in_flight)
+    backend = RateLimitedBackend(limited, args.rpm, args.tpm, deadline=args.deadline,
+                                 attempt_timeout=args.attempt_timeout,
+                                 completion_timeout=args.completion_timeout or None)
+    store = StoryStore(args.state_dir or args.output + ".state")
+    cache = ResponseCache(disk_path=args.cache_path) if args.cache_path else None
+    runner = BatchRunner(backend, store, args.output, args.max_stories,
+                         args.max_concurrent_agents, args.prefetch_depth, cache, args.segment_chars,
+                         narrator_candidates=args.narrator_candidates, quality_threshold=args.quality_threshold,
+                         history_spill_dir=args.history_spill_dir)
+    start = time.perf_counter()
+    try:
+        asyncio.run(runner.run(pending))
+    finally:
+        store.close()
+        if cache:
+            cache.close()
+    wall = time.perf_counter() - start
+    print(f"ok={runner.counts['ok']} error={runner.counts['error']} wall={wall:.1f}s "
+          f"pico_en_vuelo={limited.peak_in_flight}/{limited.max_in_flight}", file=sys.stderr)
+    return 1 if runner.counts["error"] else 0
+
+
+def run_staged(args, pending: List[Dict]) -> int:
+    staging = StagedBatchBackend()
+    fulfill = FakeLLMBackend(latency=args.fake_latency) if args.fulfill_with == "fake" else None
+    # Todas las historias a la vez, para que cada lote reúna la misma etapa de todas; sin
+    # precarga ni journal, así cada ejecución repite exactamente las peticiones ya resueltas
+    runner = BatchRunner(staging, StoryStore(args.state_dir or args.output + ".state"), args.output,
+                         max_stories=len(pending), max_concurrent_agents=args.max_concurrent_agents,
+                         prefetch_depth=0, segment_chars=args.segment_chars, resume=False,
+                         narrator_candidates=args.narrator_candidates, quality_threshold=args.quality_threshold)
+    requests_path = asyncio.run(runner.run_staged(pending, staging, args.staged, fulfill))
+    if requests_path:
+        results_name = os.path.basename(requests_path).replace("requests-", "results-")
+        print(f"Envía {requests_path} a la Batch API, guarda la salida como {results_name} "
+              f"en {args.staged} y vuelve a ejecutar el comando", file=sys.stderr)
+    unfinished = len(pending) - sum(runner.counts.values())
+    print(f"ok={runner.counts['ok']} error={runner.counts['error']} pendientes={unfinished}", file=sys.stderr)
+    return 1 if runner.counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
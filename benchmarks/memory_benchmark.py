@@ -0,0 +1,136 @@
+"""
+Benchmark de la memoria que ocupan el historial del chat y los capítulos de una historia larga.
+
+Desarrolla una historia con el backend local y mide con tracemalloc cuánto ocupa el mismo
+contenido como listas de Message/Chapter (la representación anterior, con el texto de cada
+capítulo compartido entre el chat y la lista de capítulos) y como ChatHistory/ChapterList
+sobre un TextStore, sin compresión, con compresión y con los textos en un archivo mapeado.
+El texto del backend local es muy repetitivo: la fila con compresión es optimista. Ejemplo:
+
+    python -m benchmarks.memory_benchmark --chapters 50 --chapter-words 1500
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+if __package__ in (None, ""):
+    # Ejecutado por ruta (python benchmarks/x.py): la raíz del repo no está en sys.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+from core.models.data_models import Chapter, Message
+from core.models.history import ChapterList, ChatHistory, TextStore
+
+
+async def build_story(args) -> StoryOrchestrator:
+    backend = FakeLLMBackend(latency=0.0, chapters=args.chapters, chapter_words=args.chapter_words)
+    orchestrator = StoryOrchestrator(backend, prefetch_depth=0)
+    names = [f"Personaje{i}" for i in range(1, args.characters + 1)]
+    for name in names:
+        orchestrator.add_character_agent(name)
+    character_count = args.chapter_words * 6 * args.chapters
+    await orchestrator.generate_story("Una expedición a una cueva", character_count, "descriptivo", names)
+    for _ in range(args.chapters - 1):
+        await orchestrator.get_next_chapter()
+    orchestrator.close()
+    return orchestrator
+
+
+def as_lists(orchestrator: StoryOrchestrator) -> Tuple[List[Message], List[Chapter]]:
+    # Como en un orquestador sin compactar: el capítulo y el mensaje del Narrador son el mismo str
+    pool: Dict[str, str] = {}
+    messages = [Message(m.agent_name, pool.setdefault(m.content, m.content), m.timestamp, m.speaking_to)
+                for m in orchestrator.chat_history]
+    chapters = [Chapter(c.number, c.title, pool.setdefault(c.content, c.content), c.character_count, c.feedback)
+                for c in orchestrator.story_state.chapters]
+    return messages, chapters
+
+
+def measure(build: Callable[[], object]) -> Tuple[int, object]:
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before, value
+
+
+def time_recent_reads(history, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        history[-5:]
+    return (time.perf_counter() - start) / repeats
+
+
+def run_benchmark(args) -> Dict:
+    orchestrator = asyncio.run(build_story(args))
+    rows = []
+    with tempfile.TemporaryDirectory() as spill_dir:
+        variants = [
+            ("compacto", lambda: TextStore(compress_min_chars=10 ** 9)),
+            ("compacto+zlib", lambda: TextStore()),
+            ("compacto+mmap", lambda: TextStore(spill_dir=spill_dir, compress_min_chars=10 ** 9)),
+        ]
+        histories = []
+        tracemalloc.start()
+        try:
+            list_bytes, (messages, chapters) = measure(lambda: as_lists(orchestrator))
+            rows.append({"representation": "listas", "bytes": list_bytes})
+            histories.append(messages)
+            for name, make_store in variants:
+                def build():
+                    texts = make_store()
+                    history = ChatHistory(texts)
+                    history.extend(messages)
+                    return history, ChapterList(texts, chapters)
+                size, (history, _) = measure(build)
+                rows.append({"representation": name, "bytes": size})
+                histories.append(history)
+        finally:
+            tracemalloc.stop()
+        # Fuera de tracemalloc, que encarece cada asignación
+        for row, history in zip(rows, histories):
+            row["recent_read_seconds"] = time_recent_reads(history, args.repeats)
+        for history in histories[1:]:
+            history.texts.close()
+    return {
+        "config": vars(args),
+        "messages": len(messages),
+        "chapter_chars": sum(len(c.content) for c in chapters),
+        "results": rows
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Memoria del historial y los capítulos de una historia larga")
+    parser.add_argument("--chapters", type=int, default=50)
+    parser.add_argument("--characters", type=int, default=2)
+    parser.add_argument("--chapter-words", type=int, default=1500)
+    parser.add_argument("--repeats", type=int, default=200, help="lecturas de los últimos mensajes a promediar")
+    parser.add_argument("--json", action="store_true", help="imprimir el resultado como JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = run_benchmark(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"mensajes={result['messages']} texto de capítulos={result['chapter_chars'] / 1024:.1f}KiB")
+        baseline = result["results"][0]["bytes"]
+        for row in result["results"]:
+            print(f"{row['representation']:<14} {row['bytes'] / 1024:9.1f}KiB "
+                  f"({row['bytes'] / baseline:6.1%})  últimos 5 mensajes={row['recent_read_seconds'] * 1e6:7.1f}µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Benchmark del tiempo de reanudación de una historia persistida con StoryStore.
+
+Genera historias de distinta longitud con el backend local, las guarda en un journal y
+mide cuánto cuesta rehidratar un orquestador nuevo solo desde el journal y desde una
+instantánea compactada. Ejemplo:
+
+    python -m benchmarks.resume_benchmark --lengths 5 10 25 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+if __package__ in (None, ""):
+    # Ejecutado por ruta (python benchmarks/x.py): la raíz del repo no está en sys.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.story_benchmark import percentile
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+from core.services.story_store import StoryStore
+
+
+async def build_story(store: StoryStore, session_id: str, chapters: int, args):
+    backend = FakeLLMBackend(latency=0.0, chapters=chapters, chapter_words=args.chapter_words)
+    orchestrator = StoryOrchestrator(backend, prefetch_depth=0)
+    names = [f"Personaje{i}" for i in range(1, args.characters + 1)]
+    for name in names:
+        orchestrator.add_character_agent(name)
+    orchestrator.set_journal(store.journal(session_id))
+    await orchestrator.generate_story("Una expedición a una cueva", 5000, "descriptivo", names)
+    for _ in range(chapters - 1):
+        await orchestrator.get_next_chapter()
+    orchestrator.close()
+
+
+def time_resume(store: StoryStore, session_id: str, repeats: int) -> List[float]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        orchestrator = StoryOrchestrator(FakeLLMBackend(latency=0.0), prefetch_depth=0)
+        orchestrator.restore_state(store.load(session_id))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def journal_bytes(store: StoryStore, session_id: str) -> Dict[str, int]:
+    sizes = {}
+    for kind, path in (("journal", store._journal_path(session_id)), ("snapshot", store._snapshot_path(session_id))):
+        sizes[kind] = os.path.getsize(path) if os.path.exists(path) else 0
+    return sizes
+
+
+def run_benchmark(args) -> Dict:
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        # Sin compactación automática para medir el peor caso del journal
+        store = StoryStore(root, snapshot_every=10 ** 9)
+        for chapters in args.lengths:
+            session_id = f"historia-{chapters}"
+            asyncio.run(build_story(store, session_id, chapters, args))
+            from_journal = time_resume(store, session_id, args.repeats)
+            journal_size = journal_bytes(store, session_id)
+            store.compact(session_id)
+            from_snapshot = time_resume(store, session_id, args.repeats)
+            results.append({
+                "chapters": chapters,
+                "journal_bytes": journal_size["journal"],
+                "snapshot_bytes": journal_bytes(store, session_id)["snapshot"],
+                "journal_p50": percentile(from_journal, 50),
+                "snapshot_p50": percentile(from_snapshot, 50)
+            })
+    return {"config": vars(args), "results": results}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo de reanudación de historias persistidas")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[5, 10, 25, 50])
+    parser.add_argument("--characters", type=int, default=2)
+    parser.add_argument("--chapter-words", type=int, default=300)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="imprimir el resultado como JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = run_benchmark(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for row in result["results"]:
+            print(f"capítulos={row['chapters']:<4} journal={row['journal_bytes'] / 1024:8.1f}KiB "
+                  f"p50={row['journal_p50'] * 1000:7.2f}ms  snapshot={row['snapshot_bytes'] / 1024:8.1f}KiB "
+                  f"p50={row['snapshot_p50'] * 1000:7.2f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Benchmark de extremo a extremo del orquestador sobre el backend local (sin red).
+
+Ejecuta K sesiones concurrentes que generan una historia de N capítulos con M personajes
+y reporta percentiles de latencia y throughput. Ejemplo:
+
+    python -m benchmarks.story_benchmark --chapters 5 --characters 3 --sessions 8 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from typing import Dict, List
+
+if __package__ in (None, ""):
+    # Ejecutado por ruta (python benchmarks/x.py): la raíz del repo no está en sys.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+from core.llm.rate_limit import RateLimitedBackend
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Percentil por rango más cercano
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0
+    }
+
+
+async def run_session(backend, args, timings: Dict[str, List[float]], index: int = 0):
+    orchestrator = StoryOrchestrator(
+        backend, max_concurrent_agents=args.max_concurrent_agents, prefetch_depth=args.prefetch_depth,
+        segment_chars=args.segment_chars
+    )
+    # Nombres distintos por sesión para que sus peticiones no se unan en una sola
+    names = [f"Personaje{index}_{i}" for i in range(1, args.characters + 1)]
+    for name in names:
+        orchestrator.add_character_agent(name)
+
+    start = time.perf_counter()
+    # Extensión pedida equivalente a chapter_words por capítulo (~6 caracteres por palabra)
+    character_count = args.chapter_words * 6 * args.chapters
+    await orchestrator.generate_story("Una expedición a una cueva", character_count, "descriptivo", names)
+    timings["generate_story"].append(time.perf_counter() - start)
+
+    for _ in range(args.chapters - 1):
+        if args.think_time:
+            await asyncio.sleep(args.think_time)
+        start = time.perf_counter()
+        await orchestrator.get_next_chapter()
+        timings["next_chapter"].append(time.perf_counter() - start)
+    orchestrator.close()
+
+
+async def run_benchmark(args) -> Dict:
+    backend = FakeLLMBackend(
+        latency=args.latency, tokens_per_second=args.tokens_per_second, chapters=args.chapters,
+        chapter_words=args.chapter_words, requests_per_minute=args.provider_rpm
+    )
+    # Los reintentos y el límite de tasa aprendido de las cabeceras absorben los 429 simulados
+    dispatcher = RateLimitedBackend(backend, requests_per_minute=args.rpm, base_delay=0.1)
+    timings: Dict[str, List[float]] = {"generate_story": [], "next_chapter": []}
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(dispatcher, args, timings, index) for index in range(args.sessions)))
+    wall = time.perf_counter() - start
+    chapters = args.sessions * args.chapters
+    return {
+        "config": {k: v for k, v in vars(args).items() if not k.startswith("max_p95")},
+        "generate_story": summarize(timings["generate_story"]),
+        "next_chapter": summarize(timings["next_chapter"]),
+        "wall_seconds": wall,
+        "chapters_per_second": chapters / wall if wall else 0.0,
+        "llm_calls": backend.calls,
+        "llm_calls_per_second": backend.calls / wall if wall else 0.0,
+        "rate_limited_calls": backend.rate_limited_calls
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del orquestador de historias con backend local")
+    parser.add_argument("--chapters", type=int, default=3)
+    parser.add_argument("--characters", type=int, default=2)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05, help="latencia inicial simulada por llamada (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 = generación instantánea")
+    parser.add_argument("--chapter-words", type=int, default=300)
+    parser.add_argument("--provider-rpm", type=float, default=0.0,
+                        help="límite de peticiones por minuto simulado del proveedor (0 = sin límite)")
+    parser.add_argument("--rpm", type=float, default=0.0, help="límite propio de peticiones por minuto")
+    parser.add_argument("--segment-chars", type=int, default=0,
+                        help="narrar en segmentos paralelos los capítulos más largos que esto (0 = nunca)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pausa del lector entre capítulos (s)")
+    parser.add_argument("--max-concurrent-agents", type=int, default=4)
+    parser.add_argument("--prefetch-depth", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="imprimir el resultado como JSON")
+    parser.add_argument("--max-p95-generate", type=float, default=None,
+                        help="falla (código 1) si el p95 de generate_story supera este valor")
+    parser.add_argument("--max-p95-next", type=float, default=None,
+                        help="falla (código 1) si el p95 de get_next_chapter supera este valor")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(run_benchmark(args))
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for name in ("generate_story", "next_chapter"):
+            stats = result[name]
+            print(f"{name:15} n={stats['count']:<4} p50={stats['p50'] * 1000:8.1f}ms "
+                  f"p95={stats['p95'] * 1000:8.1f}ms p99={stats['p99'] * 1000:8.1f}ms")
+        print(f"wall={result['wall_seconds']:.2f}s chapters/s={result['chapters_per_second']:.2f} "
+              f"llm_calls={result['llm_calls']} llm_calls/s={result['llm_calls_per_second']:.1f} "
+              f"429={result['rate_limited_calls']}")
+
+    failed = False
+    if args.max_p95_generate is not None and result["generate_story"]["p95"] > args.max_p95_generate:
+        print(f"REGRESIÓN: p95 generate_story {result['generate_story']['p95']:.3f}s > {args.max_p95_generate}s",
+              file=sys.stderr)
+        failed = True
+    if args.max_p95_next is not None and result["next_chapter"]["p95"] > args.max_p95_next:
+        print(f"REGRESIÓN: p95 get_next_chapter {result['next_chapter']['p95']:.3f}s > {args.max_p95_next}s",
+              file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
+from core.agents.asset_store import AssetDraft, AssetStore
 from core.agents.base_agent import StoryAgent
 from core.agents.orchestrator import StoryOrchestrator
+from core.agents.model_router import ModelRoute, ModelRouter
 
-__all__ = ['StoryAgent', 'StoryOrchestrator'] 
\ No newline at end of file
+__all__ = ['AssetDraft', 'AssetStore', 'StoryAgent', 'StoryOrchestrator', 'ModelRoute', 'ModelRouter']
@@ -0,0 +1,148 @@
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from core.agents.dependency_graph import normalize
+
+LOCATION = "location"
+CHARACTER = "character"
+
+
+@dataclass
+class Asset:
+    kind: str
+    name: str
+    description: str
+    # Capítulos en los que se usó; el primero es donde se describió
+    chapters: List[int] = field(default_factory=list)
+
+
+class AssetStore:
+    """
+    Descripciones ya generadas de ubicaciones (Geógrafo) y perfiles de personajes, por nombre
+    normalizado, para reutilizarlas en los capítulos siguientes en lugar de regenerarlas.
+
+    Cada historia tiene la suya; varias historias de un mismo mundo pueden compartir una.
+    Se descartan las menos usadas al superar ``max_assets``.
+    """
+
+    def __init__(self, max_assets: int = 2000):
+        self.max_assets = max_assets
+        self._assets: "OrderedDict[Tuple[str, str], Asset]" = OrderedDict()
+
+    def get(self, kind: str, name: str) -> Optional[Asset]:
+        asset = self._assets.get(_key(kind, name))
+        if asset is not None:
+            self._assets.move_to_end(_key(kind, name))
+        return asset
+
+    def split(self, kind: str, names: List[str]) -> Tuple[List[str], List[str]]:
+        """Separa ``names`` en (ya descritos, nuevos)."""
+        known = [name for name in names if _key(kind, name) in self._assets]
+        return known, [name for name in names if name not in known]
+
+    def put(self, kind: str, name: str, description: str, chapter: Optional[int] = None) -> Asset:
+        key = _key(kind, name)
+        asset = self._assets.get(key)
+        if asset is None:
+            asset = self._assets[key] = Asset(kind, name, description)
+        else:
+            asset.description = description
+            self._assets.move_to_end(key)
+        if chapter is not None:
+            self.touch(asset, chapter)
+        while len(self._assets) > self.max_assets:
+            self._assets.popitem(last=False)
+        return asset
+
+    @staticmethod
+    def touch(asset: Asset, chapter: int):
+        if chapter not in asset.chapters:
+            asset.chapters.append(chapter)
+
+    def reset(self):
+        self._assets.clear()
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+
+class AssetDraft:
+    """
+    Cambios de un capítulo precalculado sobre un AssetStore. Los ven ese capítulo y los
+    borradores posteriores (``parents``), pero solo pasan al almacén con ``commit``, cuando
+    el capítulo se entrega; si se descarta, el almacén no cambia.
+    """
+
+    def __init__(self, base: AssetStore, parents: List["AssetDraft"] = ()):
+        self.base = base
+        self.parents = list(parents)
+        self._assets: Dict[Tuple[str, str], Asset] = {}
+        self._touches: List[Tuple[Asset, int]] = []
+
+    def _lookup(self, key: Tuple[str, str]) -> Optional[Asset]:
+        for draft in [self] + self.parents[::-1]:
+            if key in draft._assets:
+                return draft._assets[key]
+        return self.base._assets.get(key)
+
+    def get(self, kind: str, name: str) -> Optional[Asset]:
+        return self._lookup(_key(kind, name))
+
+    def split(self, kind: str, names: List[str]) -> Tuple[List[str], List[str]]:
+        known = [name for name in names if self._lookup(_key(kind, name)) is not None]
+        return known, [name for name in names if name not in known]
+
+    def put(self, kind: str, name: str, description: str, chapter: Optional[int] = None) -> Asset:
+        asset = self._assets[_key(kind, name)] = Asset(kind, name, description)
+        if chapter is not None:
+            asset.chapters.append(chapter)
+        return asset
+
+    def touch(self, asset: Asset, chapter: int):
+        # Los assets ajenos al borrador se marcan al confirmarlo
+        self._touches.append((asset, chapter))
+
+    def commit(self):
+        for asset in self._assets.values():
+            stored = self.base.put(asset.kind, asset.name, asset.description)
+            for chapter in asset.chapters:
+                self.base.touch(stored, chapter)
+        for asset, chapter in self._touches:
+            stored = self.base.get(asset.kind, asset.name)
+            if stored is not None:
+                self.base.touch(stored, chapter)
+
+
+def _key(kind: str, name: str) -> Tuple[str, str]:
+    return kind, normalize(name).strip()
+
+
+def split_descriptions(text: str, names: List[str]) -> Dict[str, str]:
+    """
+    Reparte una respuesta del Geógrafo entre las ubicaciones pedidas, usando los
+    encabezados "Nombre:" de cada una. Las que no aparecen se omiten.
+    """
+    if not names:
+        return {}
+    by_key = {normalize(name).strip(): name for name in names}
+    header = re.compile(r"^\W*(.+?)\W*:\s*(.*)$")
+    sections: Dict[str, List[str]] = {}
+    current = None
+    for line in text.splitlines():
+        match = header.match(line)
+        key = normalize(match.group(1)).strip() if match else None
+        if key in by_key:
+            current = by_key[key]
+            sections[current] = [match.group(2)] if match.group(2) else []
+        elif current is not None:
+            sections[current].append(line.strip())
+    return {name: "\n".join(part for part in parts if part).strip() for name, parts in sections.items()}
+
+
+def extract_profile(text: str, max_chars: int = 400) -> str:
+    """Perfil de un personaje: la línea "Perfil:" si está, si no el inicio de la respuesta."""
+    match = re.search(r"perfil\W*:\s*(.+)", text, re.IGNORECASE)
+    profile = match.group(1) if match else text
+    return profile.strip()[:max_chars]
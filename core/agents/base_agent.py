@@ -1,12 +1,33 @@
-from openai import OpenAI
-from typing import List
+import time
+from contextlib import aclosing
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Tuple, Union
 from core.models.data_models import Message
+from core.llm.backends import LLMBackend, as_backend
+from core.llm.cache import ResponseCache, make_cache_key
+from core.llm.client import LLMClient
+from core.llm.tokens import count_tokens
+from core.services.metrics import StoryTrace
+
+if TYPE_CHECKING:
+    from core.agents.context_builder import ContextBuilder
+    from core.agents.model_router import ModelRouter
 
 class StoryAgent:
-    def __init__(self, name: str, role: str, client: OpenAI):
+    def __init__(self, name: str, role: str, client: Union[LLMBackend, LLMClient], model: str = "gpt-3.5-turbo",
+                 cache: Optional[ResponseCache] = None, trace: Optional[StoryTrace] = None,
+                 context_builder: Optional["ContextBuilder"] = None, router: Optional["ModelRouter"] = None):
         self.name = name
         self.role = role
         self.client = client
+        # Un cliente de OpenAI se envuelve en OpenAIBackend; también se acepta cualquier LLMBackend
+        self.backend = as_backend(client)
+        self.model = model
+        self.cache = cache
+        self.trace = trace
+        # Sin context_builder se usan los últimos 5 mensajes completos
+        self.context_builder = context_builder
+        # Con router, el modelo y sus parámetros se eligen por rol en cada llamada
+        self.router = router
         self.system_prompt = self._get_system_prompt()
         self.emoji = self._get_emoji()
 
@@ -86,7 +107,10 @@ class StoryAgent:
         }
         return prompts.get(self.role, "Eres un agente colaborativo en la creación de una historia.")
 
-    async def generate_response(self, context: str, chat_history: List[Message], speaking_to: str = "todos") -> str:
+    def _build_messages(self, context: str, chat_history: List[Message]) -> List[Dict[str, str]]:
+        if self.context_builder is not None:
+            return self.context_builder.build(self, context, chat_history)
+        
         messages = [{"role": "system", "content": self.system_prompt}]
         
         # Agregar historial del chat relevante
@@ -98,10 +122,87 @@ class StoryAgent:
         
         # Agregar el contexto actual
         messages.append({"role": "user", "content": context})
+        return messages
+
+    async def generate_response(self, context: str, chat_history: List[Message], speaking_to: str = "todos") -> str:
+        messages = self._build_messages(context, chat_history)
+        model, params = self._route(stream=False)
+        start = time.perf_counter()
+        
+        cache_key = self._cache_key(model, messages, params)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._record_call(start, model, cached=True)
+                return cached
         
-        response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages
-        )
+        completion = await self.backend.complete(model, messages, **params)
+        content = completion.content
+        if self.router:
+            self.router.record_latency(model, time.perf_counter() - start)
+        self._record_call(start, model, completion.prompt_tokens, completion.completion_tokens)
+        if completion.finish_reason == "length" and self.trace is not None:
+            # Respuesta cortada por max_tokens: p. ej. un esquema al que le faltan capítulos
+            self.trace.count("agent_truncated_total", role=self.role, model=model)
         
-        return response.choices[0].message.content 
\ No newline at end of file
+        if cache_key and content is not None:
+            self.cache.put(cache_key, content)
+        return content
+
+    async def stream_response(self, context: str, chat_history: List[Message],
+                              speaking_to: str = "todos") -> AsyncIterator[str]:
+        """Igual que generate_response, pero entrega el texto en fragmentos a medida que llega."""
+        messages = self._build_messages(context, chat_history)
+        model, params = self._route(stream=True)
+        start = time.perf_counter()
+        
+        # La respuesta en streaming comparte entrada de caché con la llamada normal
+        cache_key = self._cache_key(model, messages, params)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._record_call(start, model, cached=True)
+                yield cached
+                return
+        
+        parts = []
+        try:
+            async with aclosing(self.backend.stream(model, messages, **params)) as deltas:
+                async for delta in deltas:
+                    if not parts:
+                        first_token = time.perf_counter() - start
+                        # En streaming el SLO se mide hasta el primer fragmento
+                        if self.router:
+                            self.router.record_latency(model, first_token, stream=True)
+                        if self.trace and self.trace.metrics:
+                            self.trace.metrics.observe("agent_first_token_seconds", first_token, role=self.role)
+                    parts.append(delta)
+                    yield delta
+        finally:
+            if parts:
+                # La API no informa el uso en streaming: se estima con el tokenizador. Un
+                # stream cortado (p. ej. por el control de calidad) cuenta lo ya recibido
+                prompt_tokens = sum(count_tokens(message["content"], model) for message in messages)
+                self._record_call(start, model, prompt_tokens, count_tokens(''.join(parts), model))
+        
+        if cache_key:
+            self.cache.put(cache_key, ''.join(parts))
+
+    def _route(self, stream: bool) -> Tuple[str, Dict]:
+        if self.router is None:
+            return self.model, {}
+        return self.router.select(self.role, stream)
+
+    def _record_call(self, start: float, model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+                     cached: bool = False):
+        if self.trace is None:
+            return
+        duration = time.perf_counter() - start
+        self.trace.record_call(self.role, model, duration, prompt_tokens, completion_tokens, cached)
+        if self.trace.metrics:
+            self.trace.metrics.observe("agent_request_seconds", duration, role=self.role, cached=str(cached).lower())
+
+    def _cache_key(self, model: str, messages: List[Dict[str, str]], params: Dict) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return make_cache_key(model, messages, **params)
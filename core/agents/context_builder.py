@@ -0,0 +1,118 @@
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from core.llm.tokens import count_tokens, truncate_to_tokens
+from core.models.data_models import ChapterOutline, Message
+
+if TYPE_CHECKING:
+    from core.agents.base_agent import StoryAgent
+
+# Tokens de historial (resúmenes + mensajes recientes) que recibe cada rol en su prompt
+ROLE_CONTEXT_BUDGETS: Dict[str, int] = {
+    "narrador": 2000,
+    "planeador": 1200,
+    "arbitro": 1500,
+    "geografo": 900,
+    "personaje": 900,
+}
+DEFAULT_CONTEXT_BUDGET = 1000
+
+
+class ContextBuilder:
+    """
+    Arma el historial que acompaña a cada llamada de un agente dentro de un presupuesto de tokens.
+
+    Los capítulos anteriores se resumen de forma compacta (uno por número de capítulo, se
+    actualiza al cerrarse cada capítulo) y del chat reciente se eligen los mensajes más
+    relevantes para el agente, recortando los que son demasiado largos.
+
+    Los presupuestos se cuentan con core.llm.tokens: exactos con tiktoken y aproximados
+    por caracteres si no está disponible.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, summary_share: float = 0.35,
+                 max_message_tokens: int = 500, recent_window: int = 12, summary_tokens: int = 120):
+        self.budgets = dict(ROLE_CONTEXT_BUDGETS, **(budgets or {}))
+        self.summary_share = summary_share
+        self.max_message_tokens = max_message_tokens
+        self.recent_window = recent_window
+        self.summary_tokens = summary_tokens
+        self.chapter_summaries: Dict[int, str] = {}
+
+    def reset(self):
+        self.chapter_summaries = {}
+
+    def update_chapter_summary(self, outline: ChapterOutline, content: str):
+        """Resume un capítulo terminado: su esquema y el cierre del texto para dar continuidad."""
+        ending = content.strip()[-200:]
+        if len(content.strip()) > 200 and ' ' in ending:
+            ending = ending.split(' ', 1)[1]
+        summary = f"{outline.title}. {outline.summary} Eventos: {'; '.join(outline.key_events)}. Cierre: {ending}"
+        self.chapter_summaries[outline.number] = truncate_to_tokens(summary, self.summary_tokens)
+
+    def build(self, agent: "StoryAgent", context: str, chat_history: List[Message]) -> List[Dict[str, str]]:
+        budget = self.budgets.get(agent.role, DEFAULT_CONTEXT_BUDGET)
+        messages = [{"role": "system", "content": agent.system_prompt}]
+        
+        summary = self._summary_block(int(budget * self.summary_share), agent.model)
+        if summary:
+            messages.append({"role": "system", "content": summary})
+            budget -= count_tokens(summary, agent.model)
+        
+        messages.extend(self._select_recent(agent, chat_history, budget))
+        
+        # Agregar el contexto actual
+        messages.append({"role": "user", "content": context})
+        return messages
+
+    def _summary_block(self, budget: int, model: str) -> str:
+        if not self.chapter_summaries or budget <= 0:
+            return ""
+        # Los capítulos más recientes tienen prioridad si no entran todos
+        lines = []
+        used = count_tokens("Resumen de capítulos anteriores:", model)
+        for number in sorted(self.chapter_summaries, reverse=True):
+            line = f"Capítulo {number}: {self.chapter_summaries[number]}"
+            cost = count_tokens(line, model)
+            if used + cost > budget:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return ""
+        return "Resumen de capítulos anteriores:\n" + "\n".join(reversed(lines))
+
+    def _select_recent(self, agent: "StoryAgent", chat_history: List[Message], budget: int) -> List[Dict[str, str]]:
+        window = chat_history[-self.recent_window:]
+        candidates = []
+        for age, msg in enumerate(reversed(window)):
+            candidates.append((self._relevance(agent, msg, age), -age, msg))
+        
+        chosen = []
+        for _, neg_age, msg in sorted(candidates, key=lambda c: (c[0], c[1]), reverse=True):
+            content = truncate_to_tokens(msg.content, self.max_message_tokens, agent.model)
+            text = f"{msg.agent_name} {msg.speaking_to}: {content}"
+            cost = count_tokens(text, agent.model)
+            if cost > budget:
+                continue
+            budget -= cost
+            chosen.append((neg_age, {
+                "role": "assistant" if msg.agent_name.endswith(agent.name) else "user",
+                "content": text
+            }))
+        
+        # Devolver en orden cronológico
+        return [message for _, message in sorted(chosen, key=lambda c: c[0])]
+
+    @staticmethod
+    def _relevance(agent: "StoryAgent", msg: Message, age: int) -> float:
+        score = 1.0 / (1 + age)
+        own_name = agent.name.split('_', 1)[-1].lower()
+        if msg.agent_name.endswith(agent.name):
+            score += 1.0
+        if own_name and own_name in msg.content.lower():
+            score += 0.5
+        if "Narrador" in msg.agent_name:
+            score += 0.5
+        if "Planeador" in msg.agent_name and agent.role == "planeador":
+            score += 0.5
+        return score
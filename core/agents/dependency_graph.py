@@ -0,0 +1,96 @@
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+
+from core.models.data_models import ChapterOutline
+
+# Palabras demasiado comunes para identificar una entidad dentro de un feedback
+_STOPWORDS = {"para", "como", "pero", "entre", "sobre", "desde", "hasta", "donde", "cuando",
+              "principal", "secundario", "secundaria", "personaje", "ubicación", "ubicacion"}
+
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin tildes, para comparar nombres de forma tolerante."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _keywords(name: str, min_length: int = 4) -> Set[str]:
+    words = set(re.findall(r"\w+", normalize(name)))
+    return {w for w in words if len(w) >= min_length and w not in _STOPWORDS}
+
+
+@dataclass
+class ChapterRecord:
+    outline: ChapterOutline
+    # Aportes de los agentes del fan-out: clave del agente -> respuesta
+    contributions: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class FeedbackImpact:
+    characters: Set[str]
+    locations: Set[str]
+    events: Set[str]
+    # Agentes a volver a consultar en el capítulo del feedback (el Narrador siempre se incluye)
+    agents: Set[str]
+    # Capítulos pendientes cuyo desarrollo debe tener en cuenta el feedback
+    dependent_chapters: List[int]
+
+    @property
+    def is_general(self) -> bool:
+        return not (self.characters or self.locations or self.events)
+
+
+class StoryDependencyGraph:
+    """
+    Grafo de dependencias entre los capítulos, sus entidades (personajes, ubicaciones y eventos)
+    y los aportes de cada agente, para regenerar solo lo que un feedback afecta.
+    """
+
+    def __init__(self):
+        self.records: Dict[int, ChapterRecord] = {}
+
+    def reset(self):
+        self.records = {}
+
+    def record(self, outline: ChapterOutline, contributions: Dict[str, str]):
+        self.records[outline.number] = ChapterRecord(outline, dict(contributions))
+
+    def contributions(self, chapter_number: int) -> Dict[str, str]:
+        record = self.records.get(chapter_number)
+        return dict(record.contributions) if record else {}
+
+    def analyze(self, chapter_number: int, feedback: str, pending: List[ChapterOutline]) -> FeedbackImpact:
+        record = self.records.get(chapter_number)
+        words = set(re.findall(r"\w+", normalize(feedback)))
+        
+        def mentioned(names: List[str], min_length: int = 4) -> Set[str]:
+            return {name for name in names if _keywords(name, min_length) & words}
+        
+        outline = record.outline if record else None
+        # Los nombres propios suelen ser cortos ("Ana", "Eva")
+        characters = mentioned(outline.characters_involved, 3) if outline else set()
+        locations = mentioned(outline.locations) if outline else set()
+        events = mentioned(outline.key_events) if outline else set()
+        
+        agents = {"narrador"}
+        if locations:
+            agents.add("geografo")
+        for name in characters:
+            agents.add(f"personaje_{name.lower()}")
+        
+        # Un feedback general (estilo, ritmo...) afecta a todos los capítulos pendientes;
+        # uno concreto solo a los que comparten personajes o ubicaciones mencionados
+        if characters or locations or events:
+            dependent = [
+                o.number for o in pending
+                if mentioned(o.characters_involved, 3) or mentioned(o.locations)
+                or {normalize(c) for c in o.characters_involved} & {normalize(c) for c in characters}
+                or {normalize(l) for l in o.locations} & {normalize(l) for l in locations}
+            ]
+        else:
+            dependent = [o.number for o in pending]
+        
+        return FeedbackImpact(characters, locations, events, agents, dependent)
@@ -0,0 +1,155 @@
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, fields, replace
+from typing import Deque, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    model: str
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    # Modelo más rápido al que se cambia mientras el p90 de latencia supera el SLO:
+    # latency_slo mide el primer fragmento de las llamadas en streaming y completion_slo
+    # la respuesta completa de las demás (None = sin SLO para ese tipo de llamada)
+    fallback_model: Optional[str] = None
+    latency_slo: Optional[float] = None
+    completion_slo: Optional[float] = None
+
+    def params(self) -> Dict:
+        params = {}
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        return params
+
+
+# Los roles de formato simple no necesitan el modelo del Narrador. Ningún rol tiene
+# max_tokens: el esquema crece con los capítulos y los aportes con los personajes y
+# ubicaciones, y un tope fijo los cortaría (las respuestas cortadas se cuentan en
+# agent_truncated_total).
+ROLE_MODEL_ROUTES: Dict[str, ModelRoute] = {
+    "narrador": ModelRoute("gpt-3.5-turbo", temperature=0.9,
+                           fallback_model="gpt-4o-mini", latency_slo=8.0),
+    "planeador": ModelRoute("gpt-4o-mini", temperature=0.4),
+    "arbitro": ModelRoute("gpt-4o-mini", temperature=0.3),
+    "geografo": ModelRoute("gpt-4o-mini", temperature=0.8),
+    "personaje": ModelRoute("gpt-4o-mini", temperature=0.9),
+}
+DEFAULT_MODEL_ROUTE = ModelRoute("gpt-3.5-turbo")
+
+
+class LatencyTracker:
+    """
+    Latencias recientes por modelo, compartidas por todas las historias. El primer
+    fragmento de un streaming y una respuesta completa se miden por separado.
+    """
+
+    def __init__(self, window: int = 20, min_samples: int = 5, cooldown: float = 60.0):
+        self.window = window
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._samples: Dict[Tuple[str, bool], Deque[float]] = {}
+        self._degraded_until: Dict[Tuple[str, bool], float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float, stream: bool = False):
+        with self._lock:
+            self._samples.setdefault((model, stream), deque(maxlen=self.window)).append(seconds)
+
+    def breached(self, model: str, slo: float, stream: bool = False) -> bool:
+        """True si el p90 reciente supera el SLO; tras ``cooldown`` se vuelve a probar el modelo."""
+        now = time.monotonic()
+        key = (model, stream)
+        with self._lock:
+            until = self._degraded_until.get(key)
+            if until is not None:
+                if now < until:
+                    return True
+                # Fin del enfriamiento: se descartan las muestras viejas y se reintenta
+                del self._degraded_until[key]
+                self._samples.pop(key, None)
+                return False
+            samples = self._samples.get(key)
+            if not samples or len(samples) < self.min_samples:
+                return False
+            ordered = sorted(samples)
+            p90 = ordered[min(len(ordered) - 1, math.ceil(0.9 * len(ordered)) - 1)]
+            if p90 > slo:
+                self._degraded_until[key] = now + self.cooldown
+                return True
+            return False
+
+
+class ModelRouter:
+    """
+    Tabla rol -> modelo, max_tokens y temperatura, con cambio automático a un modelo más
+    rápido cuando se incumple el SLO de latencia.
+
+    ``for_story`` crea una vista con overrides propios de una historia que comparte las
+    mediciones de latencia con el router original.
+    """
+
+    def __init__(self, routes: Optional[Dict[str, ModelRoute]] = None,
+                 tracker: Optional[LatencyTracker] = None, metrics=None):
+        self.base_routes = dict(ROLE_MODEL_ROUTES, **(routes or {}))
+        self.routes = dict(self.base_routes)
+        self.tracker = tracker or LatencyTracker()
+        self.metrics = metrics
+
+    def for_story(self) -> "ModelRouter":
+        return ModelRouter(self.base_routes, self.tracker, self.metrics)
+
+    def set_overrides(self, overrides: Optional[Dict[str, Dict]] = None):
+        """Overrides por rol, p. ej. {"narrador": {"model": "gpt-4o-mini", "temperature": 0.7}}."""
+        self.validate_overrides(overrides)
+        self.routes = dict(self.base_routes)
+        for role, values in (overrides or {}).items():
+            self.routes[role] = replace(self.routes.get(role, DEFAULT_MODEL_ROUTE), **route_fields(values))
+
+    def validate_overrides(self, overrides: Optional[Dict[str, Dict]]):
+        """ValueError si los overrides nombran un rol sin ruta o un campo desconocido."""
+        if not overrides:
+            return
+        if not isinstance(overrides, dict):
+            raise ValueError("Los overrides de modelo deben ser un objeto rol -> campos")
+        unknown = set(overrides) - set(self.base_routes)
+        if unknown:
+            raise ValueError(f"Roles desconocidos: {', '.join(sorted(unknown))}")
+        for values in overrides.values():
+            route_fields(values)
+
+    def select(self, role: str, stream: bool = False) -> Tuple[str, Dict]:
+        """Modelo y parámetros para la próxima llamada del rol, en streaming o no."""
+        route = self.routes.get(role, DEFAULT_MODEL_ROUTE)
+        model = route.model
+        slo = route.latency_slo if stream else route.completion_slo
+        if route.fallback_model and slo and self.tracker.breached(model, slo, stream):
+            model = route.fallback_model
+            if self.metrics:
+                self.metrics.inc("model_fallback_total", role=role, model=route.model)
+        return model, route.params()
+
+    def record_latency(self, model: str, seconds: float, stream: bool = False):
+        """Latencia de una llamada: hasta el primer fragmento si ``stream``, completa si no."""
+        self.tracker.record(model, seconds, stream)
+
+
+def route_fields(values: Dict) -> Dict:
+    """Filtra un dict (p. ej. de JSON) a los campos válidos de ModelRoute."""
+    allowed = {f.name for f in fields(ModelRoute)}
+    unknown = set(values) - allowed
+    if unknown:
+        raise ValueError(f"Campos de ruta desconocidos: {', '.join(sorted(unknown))}")
+    return dict(values)
+
+
+def parse_routes(config: Optional[Dict[str, Dict]]) -> Dict[str, ModelRoute]:
+    """Construye rutas completas a partir de un dict rol -> campos (p. ej. la variable MODEL_ROUTES)."""
+    return {
+        role: replace(ROLE_MODEL_ROUTES.get(role, DEFAULT_MODEL_ROUTE), **route_fields(values))
+        for role, values in (config or {}).items()
+    }
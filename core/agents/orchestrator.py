@@ -1,55 +1,297 @@
-from typing import Dict, List, Optional
+import asyncio
+import math
+import re
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
 from datetime import datetime
-from openai import OpenAI
-from asgiref.sync import async_to_sync
 
 from core.models.data_models import Message, Chapter, StoryState, ChapterOutline
+from core.models.history import ChapterList, ChatHistory, TextStore
+from core.models.serialization import (
+    message_to_dict, message_from_dict, chapter_to_dict, chapter_from_dict,
+    outline_to_dict, outline_from_dict
+)
+from core.agents.asset_store import (
+    CHARACTER, LOCATION, AssetDraft, AssetStore, extract_profile, split_descriptions
+)
 from core.agents.base_agent import StoryAgent
+from core.agents.context_builder import ContextBuilder
+from core.agents.dependency_graph import StoryDependencyGraph
+from core.agents.model_router import DEFAULT_MODEL_ROUTE, ModelRouter
+from core.agents.outline_parser import OutlineParser
+from core.agents.prefetch import ChapterPrefetcher
+from core.llm.backends import LLMBackend, as_backend
+from core.llm.cache import ResponseCache
+from core.llm.client import LLMClient
+from core.llm.tokens import count_tokens
+from core.services.metrics import Metrics, StoryTrace
+
+class _DeferredHistory(list):
+    """
+    Historial privado de un capítulo que arranca antes de poder publicar sus mensajes.
+    Tras ``released`` los mensajes nuevos se publican en el momento.
+    """
+    released = False
+
+
+# Capítulos supuestos mientras el esquema del Planeador todavía se está recibiendo
+EXPECTED_CHAPTERS = 5
+
 
 class StoryOrchestrator:
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: Union[LLMBackend, LLMClient], max_concurrent_agents: int = 4, prefetch_depth: int = 1,
+                 cache: Optional[ResponseCache] = None, metrics: Optional[Metrics] = None,
+                 context_budgets: Optional[Dict[str, int]] = None, router: Optional[ModelRouter] = None,
+                 segment_chars: int = 0, max_segments: int = 12, asset_store: Optional[AssetStore] = None,
+                 narrator_candidates: int = 1, quality_threshold: float = 7.0,
+                 history_spill_dir: Optional[str] = None):
         self.client = client
+        # Todos los agentes comparten el mismo backend (cliente de OpenAI o backend local)
+        self.backend = as_backend(client)
+        # Caché de respuestas compartida por todos los agentes (opcional)
+        self.cache = cache
+        # Traza de la historia en curso; también alimenta las métricas globales si se proporcionan
+        self.trace = StoryTrace(metrics)
+        # Historial acotado por tokens y resúmenes de los capítulos anteriores
+        self.context_builder = ContextBuilder(context_budgets)
+        # Aportes de cada agente por capítulo, para regenerar solo lo afectado por un feedback
+        self.dependency_graph = StoryDependencyGraph()
+        # Ubicaciones y perfiles ya descritos; compartido si la historia pertenece a un mundo
+        self.set_asset_store(asset_store)
+        # Modelo, max_tokens y temperatura por rol; las latencias se comparten con el router global
+        self.router = (router or ModelRouter(metrics=metrics)).for_story()
+        self._model_overrides: Optional[Dict[str, Dict]] = None
+        # Feedback pendiente de aplicar: número de capítulo -> clave del agente -> notas
+        self._feedback_guidance: Dict[int, Dict[str, List[str]]] = {}
+        # Máximo de agentes consultados en paralelo durante la etapa de fan-out de un capítulo
+        self.max_concurrent_agents = max(1, max_concurrent_agents)
         self.agents: Dict[str, StoryAgent] = {}
-        self.chat_history: List[Message] = []
-        self.story_state = StoryState()
+        # Textos del chat y de los capítulos guardados una vez; con history_spill_dir, en un
+        # archivo mapeado en memoria en lugar del heap
+        self.history_spill_dir = history_spill_dir
+        self.texts: Optional[TextStore] = None
+        self._new_history()
         self._pending_chapters = []
+        self._narration_style = "descriptivo"
+        self._character_names: List[str] = []
         self._chat_callback = None
+        self._stream_callback = None
+        self._journal = None
+        # Capítulos más largos que segment_chars se narran en segmentos paralelos (0 = nunca)
+        self.segment_chars = segment_chars
+        self.max_segments = max(1, max_segments)
+        self._outline_chapters_seen = 0
+        # Con más de un candidato, el Árbitro puntúa versiones paralelas del capítulo (0-10)
+        # y se queda con la primera que alcanza quality_threshold. El capítulo elegido se emite
+        # de una vez: en un capítulo no precalculado, el primer texto llega tras la versión
+        # completa más la respuesta del Árbitro, no al primer fragmento del Narrador
+        self.narrator_candidates = max(1, narrator_candidates)
+        self.quality_threshold = quality_threshold
+        # Fragmentos del Narrador: se agrupan hasta este tamaño o intervalo antes de notificarse
+        self.stream_flush_chars = 64
+        self.stream_flush_interval = 0.1
+        # Capítulos siguientes desarrollados en segundo plano (0 desactiva la precarga)
+        self._prefetcher = ChapterPrefetcher(self._develop_speculative_chapter, prefetch_depth)
+        # Assets nuevos de cada capítulo precalculado, hasta que se entregue o se descarte
+        self._asset_drafts: Dict[int, AssetDraft] = {}
         self._initialize_agents()
 
+    def _create_agent(self, name: str, role: str) -> StoryAgent:
+        return StoryAgent(name, role, self.backend, model=self._route_model(role), cache=self.cache,
+                          trace=self.trace, context_builder=self.context_builder, router=self.router)
+
+    def _new_history(self):
+        if self.texts is not None:
+            # Cierra el archivo temporal y el mmap de la historia anterior
+            self.texts.close()
+        self.texts = TextStore(self.history_spill_dir)
+        self.chat_history = ChatHistory(self.texts)
+        self.story_state = StoryState(chapters=ChapterList(self.texts))
+
+    def set_asset_store(self, asset_store: Optional[AssetStore] = None):
+        """Usa el almacén de un mundo compartido, o uno propio de la historia si es None."""
+        self._owns_assets = asset_store is None
+        self.assets = asset_store if asset_store is not None else AssetStore()
+
+    def _route_model(self, role: str) -> str:
+        return self.router.routes.get(role, DEFAULT_MODEL_ROUTE).model
+
+    def set_model_overrides(self, overrides: Optional[Dict[str, Dict]] = None):
+        """Cambia modelo, max_tokens o temperatura de algunos roles solo para esta historia."""
+        self.router.set_overrides(overrides)
+        self._model_overrides = overrides
+        for agent in self.agents.values():
+            agent.model = self._route_model(agent.role)
+
     def _initialize_agents(self):
-        self.agents["arbitro"] = StoryAgent("Árbitro", "arbitro", self.client)
-        self.agents["planeador"] = StoryAgent("Planeador", "planeador", self.client)
-        self.agents["narrador"] = StoryAgent("Narrador", "narrador", self.client)
-        self.agents["geografo"] = StoryAgent("Geógrafo", "geografo", self.client)
+        self.agents["arbitro"] = self._create_agent("Árbitro", "arbitro")
+        self.agents["planeador"] = self._create_agent("Planeador", "planeador")
+        self.agents["narrador"] = self._create_agent("Narrador", "narrador")
+        self.agents["geografo"] = self._create_agent("Geógrafo", "geografo")
 
     def reset_state(self):
         """Reinicia el estado del orquestador para una nueva historia"""
-        self.chat_history = []
-        self.story_state = StoryState()
+        self._invalidate_prefetch()
+        self.trace.reset()
+        self.context_builder.reset()
+        self.dependency_graph.reset()
+        if self._owns_assets:
+            self.assets.reset()
+        self._feedback_guidance = {}
+        self.set_model_overrides(None)
+        self._new_history()
         self._pending_chapters = []
+        self._outline_chapters_seen = 0
+        self._narration_style = "descriptivo"
+        self._character_names = []
         # Mantener solo los agentes base, eliminar personajes
         base_agents = {name: agent for name, agent in self.agents.items() 
                       if "personaje" not in name.lower()}
         self.agents = base_agents
 
+    def close(self):
+        """
+        Libera los recursos en segundo plano (capítulos precalculados) y el archivo de los
+        textos antes de descartar el orquestador.
+        """
+        self._invalidate_prefetch()
+        self.texts.close()
+
+    @property
+    def pending_chapter_count(self) -> int:
+        """Capítulos del esquema que aún no se entregaron."""
+        return len(self._pending_chapters)
+
+    def estimate_memory_bytes(self) -> int:
+        """Estimación aproximada de la memoria ocupada por el historial y los capítulos."""
+        # Textos residentes (no los del archivo mapeado) más unos 100 bytes por registro
+        records = len(self.chat_history) + len(self.story_state.chapters)
+        return self.texts.resident_bytes() + 100 * records
+
     def add_character_agent(self, character_name: str):
         agent_name = f"Personaje_{character_name}"
-        self.agents[agent_name.lower()] = StoryAgent(agent_name, "personaje", self.client)
+        self.agents[agent_name.lower()] = self._create_agent(agent_name, "personaje")
 
     def set_chat_callback(self, callback):
         """Establece una función callback para notificar actualizaciones del chat en tiempo real."""
         self._chat_callback = callback
 
-    async def process_agent_interaction(self, message: Message) -> Dict:
-        self.chat_history.append(message)
-        
-        # Convertir el mensaje a formato JSON
-        message_data = {
+    def set_stream_callback(self, callback):
+        """
+        Establece una función callback que recibe el texto del Narrador a medida que se genera.
+
+        Recibe diccionarios con ``type`` igual a "chapter_start", "chapter_delta" o "chapter_end".
+        Si no hay callback, el capítulo se genera en una sola llamada.
+        """
+        self._stream_callback = callback
+
+    def set_journal(self, journal):
+        """
+        Establece una función que recibe cada cambio de estado como un evento (dict con "type")
+        para persistirlo; ver StoryStore. Con export_state/restore_state permite retomar la historia.
+        """
+        self._journal = journal
+
+    def _journal_event(self, event_type: str, **data):
+        if self._journal:
+            self._journal({"type": event_type, **data})
+
+    def _journal_chapter(self, index: int):
+        chapter = self.story_state.chapters[index]
+        record = self.dependency_graph.records.get(chapter.number)
+        self._journal_event(
+            "chapter",
+            index=index,
+            chapter=chapter_to_dict(chapter),
+            outline=outline_to_dict(record.outline) if record else None,
+            contributions=record.contributions if record else {}
+        )
+
+    def _progress_state(self) -> Dict:
+        return {
+            "current_chapter": self.story_state.current_chapter,
+            "total_chapters": self.story_state.total_chapters,
+            "total_chars": self.story_state.total_chars,
+            "target_chars": self.story_state.target_chars,
+            "is_complete": self.story_state.is_complete,
+            "pending": [outline_to_dict(outline) for outline in self._pending_chapters],
+            "summaries": {str(number): text for number, text in self.context_builder.chapter_summaries.items()},
+            "guidance": {str(number): notes for number, notes in self._feedback_guidance.items()}
+        }
+
+    def _journal_progress(self):
+        if self._journal:
+            self._journal_event("progress", **self._progress_state())
+
+    def export_state(self) -> Dict:
+        """Estado completo de la historia en un dict serializable a JSON."""
+        return {
+            "character_names": list(self._character_names),
+            "narration_style": self._narration_style,
+            "model_overrides": self._model_overrides,
+            "chat_history": [message_to_dict(msg) for msg in self.chat_history],
+            "chapters": [chapter_to_dict(chapter) for chapter in self.story_state.chapters],
+            "records": {
+                str(number): {"outline": outline_to_dict(record.outline), "contributions": record.contributions}
+                for number, record in self.dependency_graph.records.items()
+            },
+            **self._progress_state()
+        }
+
+    def restore_state(self, state: Dict):
+        """Reconstruye la historia a partir de export_state (o de un journal ya aplicado)."""
+        self.reset_state()
+        self._character_names = list(state.get("character_names", []))
+        self._narration_style = state.get("narration_style", "descriptivo")
+        self.set_model_overrides(state.get("model_overrides"))
+        for name in self._character_names:
+            self.add_character_agent(name)
+        self.chat_history.extend(message_from_dict(msg) for msg in state.get("chat_history", []))
+        self.story_state = StoryState(
+            current_chapter=state.get("current_chapter", 0),
+            total_chapters=state.get("total_chapters", 0),
+            chapters=ChapterList(self.texts, (chapter_from_dict(chapter) for chapter in state.get("chapters", []))),
+            is_complete=state.get("is_complete", False),
+            total_chars=state.get("total_chars", 0),
+            target_chars=state.get("target_chars", 0)
+        )
+        self._pending_chapters = [outline_from_dict(outline) for outline in state.get("pending", [])]
+        self.context_builder.chapter_summaries = {int(n): text for n, text in state.get("summaries", {}).items()}
+        self._feedback_guidance = {int(n): notes for n, notes in state.get("guidance", {}).items()}
+        for record in state.get("records", {}).values():
+            self.dependency_graph.record(outline_from_dict(record["outline"]), record["contributions"])
+
+    @staticmethod
+    def _message_to_dict(message: Message, seq: Optional[int] = None) -> Dict:
+        data = {
             "agent": message.agent_name,
             "content": message.content,
             "timestamp": message.timestamp.isoformat(),
             "speaking_to": message.speaking_to
         }
+        if seq is not None:
+            # Posición en el historial (desde 1): el cliente la usa para no repetir mensajes
+            data["seq"] = seq
+        return data
+
+    def messages_since(self, since: Optional[int]) -> List[Dict]:
+        """
+        Mensajes posteriores a la secuencia ``since`` que el cliente ya tiene. Con None no
+        se devuelve ninguno: el chat llega por SSE y las respuestas no lo repiten.
+        """
+        if since is None:
+            return []
+        since = max(0, since)
+        return [self._message_to_dict(message, seq)
+                for seq, message in enumerate(self.chat_history[since:], since + 1)]
+
+    async def process_agent_interaction(self, message: Message) -> Dict:
+        self.chat_history.append(message)
+        self._journal_event("message", message=message_to_dict(message))
+        
+        # Convertir el mensaje a formato JSON
+        message_data = self._message_to_dict(message, len(self.chat_history))
         
         # Notificar a través del callback si está configurado
         if self._chat_callback:
@@ -58,7 +300,21 @@ class StoryOrchestrator:
         return {"chat_history": [message_data]}
 
     async def generate_story(self, initial_idea: str, character_count: int, 
-                           narration_style: str, character_names: List[str]) -> Dict:
+                           narration_style: str, character_names: List[str],
+                           model_overrides: Optional[Dict[str, Dict]] = None,
+                           since_message: Optional[int] = None) -> Dict:
+        """
+        Planifica la historia y desarrolla el primer capítulo. La respuesta trae solo ese
+        capítulo y, si se indica ``since_message``, los mensajes del chat posteriores a él.
+        """
+        self._narration_style = narration_style
+        self._character_names = list(character_names)
+        self.story_state.target_chars = _to_int(character_count)
+        if model_overrides:
+            self.set_model_overrides(model_overrides)
+        self._journal_event("story_started", character_names=self._character_names, narration_style=narration_style,
+                            model_overrides=self._model_overrides)
+
         # Paso 1: El planeador crea el esquema completo de capítulos
         planner_prompt = f"""Desarrolla un esquema detallado de capítulos para esta historia siguiendo EXACTAMENTE este formato para cada capítulo:
 
@@ -97,109 +353,257 @@ REGLAS IMPORTANTES:
 9. NO agregues secciones adicionales ni modifiques los nombres de las secciones
 10. NO uses otros formatos de lista que no sean guiones (-)"""
 
-        chapter_outline = await self.agents["planeador"].generate_response(
-            planner_prompt, self.chat_history
-        )
-        
-        await self.process_agent_interaction(Message(
-            agent_name=f"{self.agents['planeador'].emoji} Planeador",
-            content=chapter_outline,
-            timestamp=datetime.now(),
-            speaking_to="todos"
-        ))
-
-        # Procesar el esquema y crear la estructura de capítulos
-        chapters_data = self._parse_chapter_outline(chapter_outline)
-        self.story_state.chapters = []
-        self.story_state.total_chapters = len(chapters_data)
+        # El esquema se recibe en streaming y se parsea a medida que llega: el primer capítulo
+        # empieza a desarrollarse en cuanto su esquema está completo, mientras el Planeador
+        # sigue escribiendo los demás.
+        parser = OutlineParser()
+        chapters_data: List[ChapterOutline] = []
+        outline_parts: List[str] = []
+        parse_seconds = 0.0
+        first_chapter_history = _DeferredHistory(self.chat_history)
+        history_start = len(first_chapter_history)
+        first_chapter_task: Optional[asyncio.Task] = None
+        try:
+            with self.trace.span("stage", stage="planning"):
+                planner = self.agents["planeador"].stream_response(planner_prompt, self.chat_history)
+                async with aclosing(planner) as deltas:
+                    async for delta in deltas:
+                        outline_parts.append(delta)
+                        parse_start = time.perf_counter()
+                        chapters_data.extend(parser.feed(delta))
+                        self._outline_chapters_seen = len(chapters_data)
+                        parse_seconds += time.perf_counter() - parse_start
+                        if chapters_data and first_chapter_task is None:
+                            first_chapter_task = asyncio.create_task(self._develop_chapter(
+                                chapters_data[0], character_names, narration_style,
+                                history=first_chapter_history, stream=True
+                            ))
+                chapters_data.extend(parser.close())
+                self._outline_chapters_seen = len(chapters_data)
+            self.trace.record_span("stage", parse_seconds, stage="outline_parse")
+            chapter_outline = ''.join(outline_parts)
+            
+            await self.process_agent_interaction(Message(
+                agent_name=f"{self.agents['planeador'].emoji} Planeador",
+                content=chapter_outline,
+                timestamp=datetime.now(),
+                speaking_to="todos"
+            ))
+            
+            # Publicar lo que el primer capítulo ya produjo, después del esquema como en serie;
+            # sus mensajes siguientes se publican en cuanto se generan
+            for message in first_chapter_history[history_start:]:
+                await self.process_agent_interaction(message)
+            first_chapter_history.released = True
+            
+            if not chapters_data:
+                raise ValueError("El Planeador no generó ningún capítulo con el formato esperado")
+            
+            # Crear la estructura de capítulos
+            self.story_state.chapters = ChapterList(self.texts)
+            self.story_state.total_chapters = len(chapters_data)
 
-        # Paso 2: Desarrollar cada capítulo secuencialmente
-        first_chapter = await self._develop_chapter(chapters_data[0], character_names, narration_style)
+            # Paso 2: Desarrollar el primer capítulo (normalmente ya en curso)
+            if first_chapter_task is None:
+                first_chapter = await self._develop_chapter(chapters_data[0], character_names, narration_style)
+            else:
+                first_chapter = await first_chapter_task
+        finally:
+            if first_chapter_task is not None and not first_chapter_task.done():
+                first_chapter_task.cancel()
         
         # Almacenar el primer capítulo y preparar el estado para los siguientes
         self.story_state.chapters.append(first_chapter)
+        self.context_builder.update_chapter_summary(chapters_data[0], first_chapter.content)
         self.story_state.current_chapter = 0
         self.story_state.total_chars = len(first_chapter.content)
         
         # Almacenar los esquemas restantes para desarrollo posterior
         self._pending_chapters = chapters_data[1:]
+        self._prefetcher.schedule(self._pending_chapters, self.chat_history)
+        self._journal_chapter(0)
+        self._journal_progress()
 
         return {
-            "final_story": f"Capítulo {first_chapter.number}: {first_chapter.title}\n\n{first_chapter.content}",
-            "chat_history": [
-                {
-                    "agent": msg.agent_name,
-                    "content": msg.content,
-                    "timestamp": msg.timestamp.isoformat(),
-                    "speaking_to": msg.speaking_to
-                }
-                for msg in self.chat_history
-            ],
+            "chapter_number": first_chapter.number,
+            "chapter_title": first_chapter.title,
+            "content": first_chapter.content,
+            "character_count": first_chapter.character_count,
+            "chat_history": self.messages_since(since_message),
+            "message_seq": len(self.chat_history),
             "has_more_chapters": len(self._pending_chapters) > 0,
             "total_chapters": self.story_state.total_chapters,
             "current_chapter": 1,
             "total_chars": self.story_state.total_chars
         }
 
-    async def _develop_chapter(self, chapter_outline: ChapterOutline, character_names: List[str], narration_style: str) -> Chapter:
-        # El geógrafo desarrolla las ubicaciones
-        geography_prompt = f"""Desarrolla descripciones detalladas para las ubicaciones de este capítulo:
-        Ubicaciones: {', '.join(chapter_outline.locations)}
-        Contexto del capítulo: {chapter_outline.summary}"""
-        
-        geography_response = await self.agents["geografo"].generate_response(
-            geography_prompt, self.chat_history
+    async def _record_message(self, message: Message, history: Optional[List[Message]]):
+        """Publica el mensaje, o lo guarda en el historial privado de un capítulo especulativo."""
+        if history is None:
+            await self.process_agent_interaction(message)
+        else:
+            history.append(message)
+            if isinstance(history, _DeferredHistory) and history.released:
+                await self.process_agent_interaction(message)
+
+    async def _run_agents_concurrently(self, calls: List[Tuple[str, str, str]],
+                                       history: Optional[List[Message]] = None) -> List[str]:
+        """
+        Ejecuta en paralelo (fan-out) las consultas independientes de un capítulo y
+        devuelve sus respuestas en el mismo orden (fan-in).
+
+        Cada llamada es una tupla (clave del agente, prompt, destinatario). Todas las consultas
+        ven la misma instantánea del historial y los mensajes se emiten a través de
+        process_agent_interaction respetando el orden de ``calls``, sin esperar a que
+        terminen las consultas posteriores.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_agents)
+        history_snapshot = (self.chat_history if history is None else history).copy()
+
+        async def run(agent_key: str, prompt: str) -> str:
+            async with semaphore:
+                return await self.agents[agent_key].generate_response(prompt, history_snapshot)
+
+        tasks = [asyncio.create_task(run(agent_key, prompt)) for agent_key, prompt, _ in calls]
+        responses = []
+        try:
+            for (agent_key, _, speaking_to), task in zip(calls, tasks):
+                response = await task
+                agent = self.agents[agent_key]
+                await self._record_message(Message(
+                    agent_name=f"{agent.emoji} {agent.name}",
+                    content=response,
+                    timestamp=datetime.now(),
+                    speaking_to=speaking_to
+                ), history)
+                responses.append(response)
+        finally:
+            # Si una consulta falla, no dejar las demás corriendo en segundo plano
+            for task in tasks:
+                task.cancel()
+        return responses
+
+    async def _develop_speculative_chapter(self, chapter_outline: ChapterOutline, history: List[Message]) -> Chapter:
+        # Ubicaciones y perfiles nuevos quedan en un borrador hasta que el capítulo se entregue
+        parents = [draft for number, draft in self._asset_drafts.items() if number < chapter_outline.number]
+        draft = self._asset_drafts[chapter_outline.number] = AssetDraft(self.assets, parents)
+        return await self._develop_chapter(
+            chapter_outline, self._character_names, self._narration_style, history, assets=draft
         )
+
+    def _invalidate_prefetch(self, from_chapter: Optional[int] = None):
+        """Descarta los capítulos precalculados (todos o desde ``from_chapter``) y sus borradores de assets."""
+        self._prefetcher.invalidate(from_chapter)
+        for number in list(self._asset_drafts):
+            if from_chapter is None or number >= from_chapter:
+                del self._asset_drafts[number]
+
+    async def _develop_chapter(self, chapter_outline: ChapterOutline, character_names: List[str], narration_style: str,
+                               history: Optional[List[Message]] = None, stream: Optional[bool] = None,
+                               reuse: Optional[Dict[str, str]] = None,
+                               assets: Optional[Union[AssetStore, AssetDraft]] = None) -> Chapter:
+        """
+        Desarrolla un capítulo. Si se pasa ``history``, el capítulo es especulativo: los agentes
+        leen ese historial privado y sus mensajes se agregan a él en lugar de publicarse.
+        ``stream`` indica si el texto del Narrador se emite en streaming (por defecto, solo
+        para capítulos no especulativos). Los aportes de ``reuse`` (clave del agente -> respuesta)
+        se usan tal cual en lugar de volver a consultar a esos agentes. ``assets`` reemplaza
+        al almacén de la historia (un borrador, para los capítulos precalculados).
+        """
+        if stream is None:
+            stream = history is None
+        reuse = reuse or {}
+        assets = assets if assets is not None else self.assets
+        guidance = self._feedback_guidance.get(chapter_outline.number, {})
         
-        await self.process_agent_interaction(Message(
-            agent_name=f"{self.agents['geografo'].emoji} Geógrafo",
-            content=geography_response,
-            timestamp=datetime.now(),
-            speaking_to="→ Narrador"
-        ))
+        # El geógrafo describe solo las ubicaciones nuevas; las ya descritas se reutilizan,
+        # salvo que el feedback pida revisarlas
+        known_locations, new_locations = assets.split(LOCATION, chapter_outline.locations)
+        if "geografo" in guidance:
+            known_locations, new_locations = [], list(chapter_outline.locations)
+        calls = []
+        if new_locations or not chapter_outline.locations:
+            geography_prompt = f"""Desarrolla descripciones detalladas para las ubicaciones de este capítulo:
+        Ubicaciones: {', '.join(new_locations)}
+        Contexto del capítulo: {chapter_outline.summary}
+        Para cada ubicación, empieza su descripción con el nombre seguido de dos puntos."""
+            if known_locations:
+                geography_prompt += f"\n        Ya descritas en capítulos anteriores (no las repitas): {', '.join(known_locations)}"
+            calls.append(("geografo", geography_prompt + self._guidance_text(guidance, "geografo"), "→ Narrador"))
 
-        # Los personajes desarrollan sus motivaciones y acciones
-        character_responses = []
+        # Los personajes desarrollan sus motivaciones y acciones; el perfil se escribe una vez
+        character_keys = []
         for name in chapter_outline.characters_involved:
-            if f"personaje_{name.lower()}" in self.agents:
+            agent_key = f"personaje_{name.lower()}"
+            if agent_key in self.agents:
+                character_keys.append(agent_key)
                 character_prompt = f"""Desarrolla las acciones y motivaciones de tu personaje para este capítulo:
                 Contexto: {chapter_outline.summary}
                 Eventos clave: {', '.join(chapter_outline.key_events)}"""
-                
-                character_response = await self.agents[f"personaje_{name.lower()}"].generate_response(
-                    character_prompt, self.chat_history
-                )
-                
-                await self.process_agent_interaction(Message(
-                    agent_name=f"{self.agents[f'personaje_{name.lower()}'].emoji} Personaje_{name}",
-                    content=character_response,
-                    timestamp=datetime.now(),
-                    speaking_to="→ Narrador"
-                ))
-                character_responses.append(character_response)
+                profile = assets.get(CHARACTER, name)
+                if profile is not None and agent_key not in guidance:
+                    character_prompt += f"\n                Tu perfil ya establecido (no lo repitas): {profile.description}"
+                else:
+                    character_prompt += "\n                Empieza con una línea \"Perfil:\" que resuma quién es tu personaje."
+                calls.append((agent_key, character_prompt + self._guidance_text(guidance, agent_key), "→ Narrador"))
+
+        # Ninguna de estas consultas depende de otra: se ejecutan en paralelo
+        speculative = str(history is not None).lower()
+        pending_calls = [call for call in calls if call[0] not in reuse]
+        with self.trace.span("stage", stage="fan_out", speculative=speculative):
+            fresh = dict(zip(
+                (call[0] for call in pending_calls),
+                await self._run_agents_concurrently(pending_calls, history)
+            ))
+        contributions = {key: reuse[key] if key in reuse else fresh[key] for key, _, _ in calls}
+        geography_response = self._update_assets(assets, chapter_outline, fresh, new_locations, known_locations)
+        # Un aporte reutilizado ya trae las descripciones completas del capítulo
+        contributions["geografo"] = geography_response = reuse.get("geografo", geography_response)
+        self.dependency_graph.record(chapter_outline, contributions)
+        character_responses = [contributions[key] for key in character_keys]
 
         # El narrador integra todo en la versión final del capítulo
-        narrator_prompt = f"""Desarrolla el capítulo completo integrando todos los elementos:
-        
-        Título: {chapter_outline.title}
+        target_chars = self._chapter_target_chars()
+        chapter_context = f"""Título: {chapter_outline.title}
         Resumen: {chapter_outline.summary}
         Eventos clave: {', '.join(chapter_outline.key_events)}
         Descripciones de ubicaciones: {geography_response}
         Desarrollo de personajes: {' | '.join(character_responses)}
-        Estilo narrativo: {narration_style}
+        Estilo narrativo: {narration_style}"""
+        narrator_guidance = self._guidance_text(guidance, "narrador")
+        length_hint = f"\n        Extensión: aproximadamente {target_chars} caracteres" if target_chars else ""
+        narrator_prompt = f"""Desarrolla el capítulo completo integrando todos los elementos:
         
-        IMPORTANTE: Comienza directamente con la narrativa, sin introducción ni explicaciones."""
+        {chapter_context}{length_hint}
         
-        chapter_content = await self.agents["narrador"].generate_response(
-            narrator_prompt, self.chat_history
-        )
+        IMPORTANTE: Comienza directamente con la narrativa, sin introducción ni explicaciones.""" + narrator_guidance
+        
+        narrator_history = self.chat_history if history is None else history
+        segments = self._segment_count(target_chars)
+        with self.trace.span("stage", stage="narration", speculative=speculative):
+            if segments > 1:
+                chapter_content = await self._narrate_in_segments(
+                    chapter_outline, chapter_context + narrator_guidance, target_chars, segments,
+                    narrator_history, stream
+                )
+            elif self.narrator_candidates > 1:
+                chapter_content = await self._narrate_with_quality_gate(chapter_outline, narrator_prompt, narrator_history)
+                if stream and self._stream_callback:
+                    # Solo se emite el candidato elegido, de una vez (ver narrator_candidates)
+                    chapter_content = await self._stream_narration(chapter_outline, _single_delta(chapter_content))
+            elif stream and self._stream_callback:
+                chapter_content = await self._stream_narration(
+                    chapter_outline, self.agents["narrador"].stream_response(narrator_prompt, narrator_history)
+                )
+            else:
+                chapter_content = await self.agents["narrador"].generate_response(narrator_prompt, narrator_history)
         
-        await self.process_agent_interaction(Message(
+        await self._record_message(Message(
             agent_name=f"{self.agents['narrador'].emoji} Narrador",
             content=chapter_content,
             timestamp=datetime.now(),
             speaking_to="todos"
-        ))
+        ), history)
         
         return Chapter(
             number=chapter_outline.number,
@@ -208,6 +612,269 @@ REGLAS IMPORTANTES:
             character_count=len(chapter_content)
         )
 
+    def _update_assets(self, assets: Union[AssetStore, AssetDraft], chapter_outline: ChapterOutline,
+                       fresh: Dict[str, str], new_locations: List[str], known_locations: List[str]) -> str:
+        """Guarda lo nuevo en ``assets`` y devuelve las descripciones de ubicaciones del capítulo."""
+        number = chapter_outline.number
+        if "geografo" in fresh:
+            descriptions = split_descriptions(fresh["geografo"], new_locations)
+            for name in new_locations:
+                # Sin encabezados reconocibles se guarda la respuesta completa
+                assets.put(LOCATION, name, descriptions.get(name) or fresh["geografo"], number)
+        for name in chapter_outline.characters_involved:
+            agent_key = f"personaje_{name.lower()}"
+            if agent_key in fresh and (assets.get(CHARACTER, name) is None or
+                                       "Perfil" in fresh[agent_key]):
+                assets.put(CHARACTER, name, extract_profile(fresh[agent_key]), number)
+
+        if not known_locations:
+            return fresh.get("geografo", "")
+        if self.trace.metrics:
+            self.trace.metrics.inc("asset_reuse_total", len(known_locations), kind=LOCATION)
+            if not new_locations:
+                self.trace.metrics.inc("asset_calls_saved_total", role="geografo")
+        parts = [fresh["geografo"]] if "geografo" in fresh else []
+        for name in known_locations:
+            asset = assets.get(LOCATION, name)
+            assets.touch(asset, number)
+            parts.append(f"{asset.name}: {asset.description}")
+        return "\n\n".join(parts)
+
+    @staticmethod
+    def _guidance_text(guidance: Dict[str, List[str]], agent_key: str) -> str:
+        notes = guidance.get(agent_key, [])
+        if not notes:
+            return ""
+        return "\n\n        Feedback del lector a tener en cuenta:\n" + "\n".join(f"        - {note}" for note in notes)
+
+    def _chapter_target_chars(self) -> int:
+        """Extensión objetivo de cada capítulo según el character_count de la historia."""
+        target = self.story_state.target_chars
+        if not target:
+            return 0
+        chapters = self.story_state.total_chapters or max(self._outline_chapters_seen, EXPECTED_CHAPTERS)
+        return target // chapters
+
+    def _segment_count(self, target_chars: int) -> int:
+        if not self.segment_chars or target_chars <= self.segment_chars:
+            return 1
+        return min(self.max_segments, math.ceil(target_chars / self.segment_chars))
+
+    async def _narrate_in_segments(self, chapter_outline: ChapterOutline, chapter_context: str, target_chars: int,
+                                   segments: int, history: List[Message], stream: bool) -> str:
+        """
+        Narra un capítulo largo en segmentos: el Narrador primero lo divide en beats y luego
+        cada segmento se escribe en paralelo con el mismo contexto; se unen en orden.
+        """
+        narrator = self.agents["narrador"]
+        beats_prompt = f"""Divide el capítulo en una lista de beats: exactamente {segments} partes consecutivas.
+        
+        {chapter_context}
+        
+        Responde solo con la lista, una parte por línea, con el formato "Parte N: descripción breve"."""
+        with self.trace.span("stage", stage="beats"):
+            beats = _parse_beats(await narrator.generate_response(beats_prompt, history), segments, chapter_outline)
+        
+        segment_chars = target_chars // segments
+        beat_list = "\n".join(f"        Parte {i}: {beat}" for i, beat in enumerate(beats, start=1))
+        prompts = []
+        for index, beat in enumerate(beats, start=1):
+            if index == 1:
+                position = "Es el comienzo del capítulo: empieza directamente con la narrativa."
+            elif index == segments:
+                position = "Es la última parte: continúa desde la anterior y cierra el capítulo."
+            else:
+                position = "Continúa desde la parte anterior sin introducción ni resumen."
+            prompts.append(f"""Desarrolla la parte {index} de {segments} del capítulo, solo esta parte: {beat}
+        
+        {chapter_context}
+        
+        Partes del capítulo:
+{beat_list}
+        
+        Extensión: aproximadamente {segment_chars} caracteres
+        IMPORTANTE: {position} No narres los hechos de las otras partes.""")
+        
+        with self.trace.span("stage", stage="segments", segments=segments):
+            if stream and self._stream_callback:
+                return await self._stream_narration(
+                    chapter_outline, self._ordered_segments(chapter_outline, prompts, history, target_chars)
+                )
+            tasks = [asyncio.create_task(narrator.generate_response(prompt, history)) for prompt in prompts]
+            try:
+                parts = await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return SEGMENT_SEPARATOR.join(part.strip() for part in parts)
+
+    async def _narrate_with_quality_gate(self, chapter_outline: ChapterOutline, narrator_prompt: str,
+                                         history: List[Message]) -> str:
+        """
+        Genera ``narrator_candidates`` versiones del capítulo a la vez. El Árbitro puntúa cada
+        una en cuanto termina; la primera que alcanza ``quality_threshold`` se usa y las demás
+        se cancelan. Si ninguna llega, se usa la mejor puntuada.
+        """
+        narrator = self.agents["narrador"]
+        count = self.narrator_candidates
+        # Prompts distintos para que la caché y la coalescencia no devuelvan el mismo texto
+        prompts = [narrator_prompt] + [
+            f"{narrator_prompt}\n\n        (Propuesta alternativa {index + 1} de {count})" for index in range(1, count)
+        ]
+        candidates = {asyncio.create_task(narrator.generate_response(prompt, history)): index
+                      for index, prompt in enumerate(prompts)}
+        scorers: Dict[asyncio.Task, str] = {}
+        scored: List[Tuple[float, str]] = []
+        errors: List[BaseException] = []
+        chosen: Optional[Tuple[float, str]] = None
+        try:
+            with self.trace.span("stage", stage="quality_gate"):
+                while (candidates or scorers) and chosen is None:
+                    done, _ = await asyncio.wait(set(candidates) | set(scorers), return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task in candidates:
+                            del candidates[task]
+                            if task.exception() is not None:
+                                errors.append(task.exception())
+                                continue
+                            text = task.result()
+                            scorers[asyncio.create_task(self._score_candidate(chapter_outline, text))] = text
+                        else:
+                            text = scorers.pop(task)
+                            score = task.result()
+                            scored.append((score, text))
+                            if score >= self.quality_threshold and chosen is None:
+                                chosen = (score, text)
+        finally:
+            cancelled = sum(1 for task in candidates if not task.done())
+            for task in list(candidates) + list(scorers):
+                task.cancel()
+        if not scored:
+            raise errors[0] if errors else RuntimeError("Ningún candidato del Narrador se completó")
+        
+        accepted = chosen is not None
+        score, content = chosen or max(scored, key=lambda item: item[0])
+        # Candidatos terminados que no se usan; los cancelados a medias no informan su consumo
+        unused = [text for _, text in scored if text is not content] + list(scorers.values())
+        wasted = sum(count_tokens(text) for text in unused)
+        self.trace.count("narrator_candidates_total", count)
+        self.trace.count("narrator_candidates_cancelled_total", cancelled)
+        self.trace.count("narrator_wasted_tokens_total", wasted)
+        self.trace.count("quality_gate_total", result="accepted" if accepted else "best_effort")
+        self.trace.observe("quality_gate_score", score)
+        return content
+
+    async def _score_candidate(self, chapter_outline: ChapterOutline, text: str) -> float:
+        prompt = f"""Evalúa la calidad de esta versión del capítulo "{chapter_outline.title}" del 0 al 10,
+        según su coherencia con el resumen, el desarrollo de los eventos clave y la calidad de la prosa.
+        Resumen: {chapter_outline.summary}
+        Eventos clave: {', '.join(chapter_outline.key_events)}
+
+        Capítulo:
+        {text}
+
+        Responde en la primera línea con "Puntuación: N" y luego justifica en una frase."""
+        try:
+            return _parse_score(await self.agents["arbitro"].generate_response(prompt, []))
+        except Exception:
+            # Un fallo del Árbitro no descarta el candidato: queda como último recurso
+            return 0.0
+
+    async def _ordered_segments(self, chapter_outline: ChapterOutline, prompts: List[str],
+                                history: List[Message], target_chars: int) -> AsyncIterator[str]:
+        """
+        Genera todos los segmentos a la vez y entrega su texto en orden: el segmento en curso
+        se transmite en vivo y los siguientes, ya avanzados, salen en cuanto le llega el turno.
+        """
+        narrator = self.agents["narrador"]
+        buffers: List[List[str]] = [[] for _ in prompts]
+        finished = [False] * len(prompts)
+        changed = asyncio.Event()
+        
+        async def run(index: int, prompt: str):
+            try:
+                async with aclosing(narrator.stream_response(prompt, history)) as deltas:
+                    async for delta in deltas:
+                        buffers[index].append(delta)
+                        changed.set()
+                finished[index] = True
+                self._report_segment_progress(chapter_outline, buffers, finished, target_chars)
+            finally:
+                finished[index] = True
+                changed.set()
+        
+        tasks = [asyncio.create_task(run(index, prompt)) for index, prompt in enumerate(prompts)]
+        try:
+            for index, task in enumerate(tasks):
+                if index:
+                    yield SEGMENT_SEPARATOR
+                sent = 0
+                while True:
+                    while sent < len(buffers[index]):
+                        yield buffers[index][sent]
+                        sent += 1
+                    if finished[index] and sent == len(buffers[index]):
+                        # Propaga el error del segmento, si lo hubo
+                        await task
+                        break
+                    changed.clear()
+                    if sent == len(buffers[index]) and not finished[index]:
+                        await changed.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _report_segment_progress(self, chapter_outline: ChapterOutline, buffers: List[List[str]],
+                                 finished: List[bool], target_chars: int):
+        if not self._stream_callback:
+            return
+        chars = sum(len(part) for buffer in buffers for part in buffer)
+        self._stream_callback({
+            "type": "chapter_progress",
+            "chapter_number": chapter_outline.number,
+            "segments_done": sum(finished),
+            "segments": len(buffers),
+            "chars": chars,
+            "target_chars": target_chars,
+            "story_chars": self.story_state.total_chars + chars,
+            "story_target_chars": self.story_state.target_chars
+        })
+
+    async def _stream_narration(self, chapter_outline: ChapterOutline, deltas: AsyncIterator[str]) -> str:
+        """Emite el capítulo en streaming, notificando fragmentos agrupados al callback."""
+        number = chapter_outline.number
+        self._stream_callback({"type": "chapter_start", "chapter_number": number, "chapter_title": chapter_outline.title})
+        
+        parts: List[str] = []
+        pending: List[str] = []
+        offset = 0
+        last_flush = None
+        
+        def flush():
+            nonlocal offset, last_flush
+            delta = ''.join(pending)
+            pending.clear()
+            last_flush = time.monotonic()
+            if delta:
+                # El offset permite al cliente descartar fragmentos repetidos tras reconectarse
+                self._stream_callback({"type": "chapter_delta", "chapter_number": number, "offset": offset, "delta": delta})
+                offset += len(delta)
+        
+        # Si la narración se cancela, el stream del Narrador se cierra en el momento
+        async with aclosing(deltas):
+            async for delta in deltas:
+                parts.append(delta)
+                pending.append(delta)
+                # El primer fragmento sale de inmediato; los siguientes se agrupan
+                if (last_flush is None or sum(len(p) for p in pending) >= self.stream_flush_chars
+                        or time.monotonic() - last_flush >= self.stream_flush_interval):
+                    flush()
+        flush()
+        
+        content = ''.join(parts)
+        self._stream_callback({"type": "chapter_end", "chapter_number": number, "character_count": len(content)})
+        return content
+
     def _parse_chapter_outline(self, outline: str) -> List[ChapterOutline]:
         """
         Parsea el esquema de capítulos generado por el planeador y lo convierte en una lista de ChapterOutline.
@@ -227,105 +894,107 @@ REGLAS IMPORTANTES:
 
         [Se repite el patrón para cada capítulo]
         """
-        chapters = []
-        current_chapter = None
-        current_section = None
-        
-        # Dividir por líneas y limpiar espacios
-        lines = [line.strip() for line in outline.split('\n') if line.strip()]
-        
-        for line in lines:
-            # Detectar inicio de nuevo capítulo
-            if line.lower().startswith('capítulo'):
-                if current_chapter:
-                    chapters.append(current_chapter)
-                
-                # Extraer número y título
-                parts = line.split(':', 1)
-                number = int(''.join(filter(str.isdigit, parts[0])))
-                title = parts[1].strip() if len(parts) > 1 else f"Capítulo {number}"
-                
-                current_chapter = ChapterOutline(
-                    number=number,
-                    title=title,
-                    summary="",
-                    key_events=[],
-                    characters_involved=[],
-                    locations=[]
-                )
-                current_section = None
-                continue
-            
-            # Detectar secciones
-            if line.lower().startswith('resumen:'):
-                current_section = 'summary'
-                current_chapter.summary = line.split(':', 1)[1].strip()
-                continue
-            
-            if line.lower().startswith('eventos clave:'):
-                current_section = 'events'
-                continue
-            
-            if line.lower().startswith('personajes involucrados:'):
-                current_section = 'characters'
-                continue
-            
-            if line.lower().startswith('ubicaciones:'):
-                current_section = 'locations'
-                continue
-            
-            # Procesar contenido según la sección actual
-            if current_chapter and line.startswith('-'):
-                content = line[1:].strip()
-                if current_section == 'events':
-                    current_chapter.key_events.append(content)
-                elif current_section == 'characters':
-                    current_chapter.characters_involved.append(content)
-                elif current_section == 'locations':
-                    current_chapter.locations.append(content)
-            elif current_section == 'summary':
-                # Agregar líneas adicionales al resumen
-                current_chapter.summary += " " + line
+        parser = OutlineParser()
+        return parser.feed(outline) + parser.close()
+
+    async def process_chapter_feedback(self, feedback: str) -> Dict:
+        """
+        Aplica el feedback del lector al capítulo actual regenerando solo lo afectado.
+
+        Se vuelven a consultar los agentes cuyas entidades (personajes o ubicaciones) menciona
+        el feedback, más el Narrador; el resto de los aportes se reutiliza. Los capítulos
+        pendientes que comparten esas entidades (todos, si el feedback es general) lo
+        recibirán como indicación. Se descarta toda la precarga: partió del texto y del
+        resumen anteriores del capítulo.
+        """
+        index = self.story_state.current_chapter
+        if not feedback or index >= len(self.story_state.chapters):
+            return {"chat_history": []}
+        chapter = self.story_state.chapters[index]
+        record = self.dependency_graph.records.get(chapter.number)
+        if record is None:
+            return {"chat_history": []}
         
-        # Agregar el último capítulo
-        if current_chapter:
-            chapters.append(current_chapter)
+        impact = self.dependency_graph.analyze(chapter.number, feedback, self._pending_chapters)
+        chapter.feedback = (chapter.feedback or []) + [feedback]
+        for number in [chapter.number] + impact.dependent_chapters:
+            notes = self._feedback_guidance.setdefault(number, {})
+            for agent_key in impact.agents:
+                notes.setdefault(agent_key, []).append(feedback)
+        # Aunque no dependan del feedback, los capítulos precalculados continúan el texto
+        # que se va a reescribir y podrían contradecir la revisión
+        self._invalidate_prefetch()
         
-        # Validar y limpiar los datos
-        for chapter in chapters:
-            chapter.summary = chapter.summary.strip()
-            chapter.key_events = [event for event in chapter.key_events if event]
-            chapter.characters_involved = [char for char in chapter.characters_involved if char]
-            chapter.locations = [loc for loc in chapter.locations if loc]
-            
-            # Asegurar que hay al menos un valor en cada lista
-            if not chapter.key_events:
-                chapter.key_events = ["Desarrollo de la trama principal"]
-            if not chapter.characters_involved:
-                chapter.characters_involved = ["Personaje principal"]
-            if not chapter.locations:
-                chapter.locations = ["Ubicación principal"]
+        reuse = {key: value for key, value in record.contributions.items() if key not in impact.agents}
+        history_start = len(self.chat_history)
+        with self.trace.span("stage", stage="feedback_revision"):
+            revised = await self._develop_chapter(
+                record.outline, self._character_names, self._narration_style, stream=False, reuse=reuse
+            )
+        revised.feedback = chapter.feedback
+        self.story_state.chapters[index] = revised
+        self.story_state.total_chars += len(revised.content) - len(chapter.content)
+        self.context_builder.update_chapter_summary(record.outline, revised.content)
+        self._journal_chapter(index)
+        self._journal_progress()
         
-        return chapters
+        return {
+            "chat_history": [self._message_to_dict(msg) for msg in self.chat_history[history_start:]],
+            "revised_chapter": {
+                "chapter_number": revised.number,
+                "chapter_title": revised.title,
+                "content": revised.content,
+                "character_count": revised.character_count
+            },
+            "rerun_agents": sorted(impact.agents),
+            "reused_agents": sorted(reuse),
+            "affected_chapters": impact.dependent_chapters
+        }
 
-    def get_next_chapter(self, feedback: Optional[str] = None) -> Dict:
+    async def get_next_chapter(self, feedback: Optional[str] = None, since_message: Optional[int] = None,
+                               feedback_applied: bool = False) -> Dict:
+        """
+        Siguiente capítulo de la historia. Con ``feedback_applied`` el feedback ya lo aplicó
+        process_chapter_feedback (y descartó la precarga).
+        """
+        if feedback_applied:
+            feedback = None
         if feedback and self.story_state.current_chapter < len(self.story_state.chapters):
             current_chapter = self.story_state.chapters[self.story_state.current_chapter]
-            if current_chapter.feedback is None:
-                current_chapter.feedback = []
-            current_chapter.feedback.append(feedback)
+            current_chapter.feedback = (current_chapter.feedback or []) + [feedback]
+            self.story_state.chapters[self.story_state.current_chapter] = current_chapter
+            self._journal_chapter(self.story_state.current_chapter)
+
+        if feedback:
+            # Los capítulos precalculados no contemplan el nuevo feedback
+            self._invalidate_prefetch()
 
         # Si hay capítulos pendientes, desarrollar el siguiente
         if self._pending_chapters:
             next_outline = self._pending_chapters.pop(0)
-            next_chapter = async_to_sync(self._develop_chapter)(
-                next_outline, 
-                [agent.name.split('_')[1] for agent in self.agents.values() if 'personaje' in agent.name.lower()],
-                "descriptivo"  # Esto debería venir del estado de la historia
-            )
+            prefetched = await self._prefetcher.take(next_outline.number)
+            draft = self._asset_drafts.pop(next_outline.number, None)
+            if prefetched and draft is not None:
+                # El capítulo se entrega: sus ubicaciones y perfiles pasan al almacén
+                draft.commit()
+            if prefetched:
+                next_chapter, messages = prefetched
+                # Publicar ahora los mensajes que los agentes generaron en segundo plano
+                for message in messages:
+                    await self.process_agent_interaction(message)
+            else:
+                next_chapter = await self._develop_chapter(
+                    next_outline, self._character_names, self._narration_style
+                )
+            if self.trace.metrics:
+                self.trace.metrics.inc("prefetch_total", result="hit" if prefetched else "miss")
+            self.context_builder.update_chapter_summary(next_outline, next_chapter.content)
+            self._prefetcher.schedule(self._pending_chapters, self.chat_history)
             self.story_state.chapters.append(next_chapter)
             self.story_state.current_chapter += 1
             self.story_state.total_chars += len(next_chapter.content)
+            self._journal_chapter(len(self.story_state.chapters) - 1)
+            self._journal_progress()
             
             return {
                 "chapter_number": next_chapter.number,
@@ -333,11 +1002,52 @@ REGLAS IMPORTANTES:
                 "content": next_chapter.content,
                 "character_count": next_chapter.character_count,
                 "is_complete": len(self._pending_chapters) == 0,
-                "total_chapters": self.story_state.total_chapters
+                "total_chapters": self.story_state.total_chapters,
+                "total_chars": self.story_state.total_chars,
+                "prefetched": prefetched is not None,
+                "chat_history": self.messages_since(since_message),
+                "message_seq": len(self.chat_history)
             }
         
         return {
             "is_complete": True,
             "total_chapters": len(self.story_state.chapters),
-            "total_chars": self.story_state.total_chars
-        } 
\ No newline at end of file
+            "total_chars": self.story_state.total_chars,
+            "chat_history": self.messages_since(since_message),
+            "message_seq": len(self.chat_history)
+        } 
+
+
+SEGMENT_SEPARATOR = "\n\n"
+
+
+async def _single_delta(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+def _parse_score(text: str) -> float:
+    """Puntuación 0-10 de la línea "Puntuación: N" del Árbitro; 0 si no la incluye."""
+    match = re.search(r"puntuaci[oó]n\W*(\d+(?:[.,]\d+)?)", text, re.IGNORECASE)
+    if not match:
+        return 0.0
+    return min(10.0, float(match.group(1).replace(",", ".")))
+
+
+def _to_int(value) -> int:
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _parse_beats(text: str, segments: int, chapter_outline: ChapterOutline) -> List[str]:
+    """Extrae la lista de beats; si faltan, se completan con los eventos clave del esquema."""
+    beats = []
+    for line in text.splitlines():
+        match = re.match(r"\s*(?:[-*]\s*)?(?:parte\s*)?\d+\s*[:.)-]\s*(.+)", line, re.IGNORECASE)
+        if match:
+            beats.append(match.group(1).strip())
+    fillers = chapter_outline.key_events or [chapter_outline.summary]
+    while len(beats) < segments:
+        beats.append(fillers[len(beats) % len(fillers)])
+    return beats[:segments]
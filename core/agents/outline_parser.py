@@ -0,0 +1,122 @@
+from typing import List, Optional
+
+from core.models.data_models import ChapterOutline
+
+
+class OutlineParser:
+    """
+    Parser incremental del esquema de capítulos del Planeador.
+
+    Se alimenta con fragmentos de texto (por ejemplo, los deltas de una respuesta en
+    streaming) y devuelve cada ChapterOutline en cuanto está completo, es decir, cuando
+    empieza el capítulo siguiente o al cerrar el parser.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._current_chapter: Optional[ChapterOutline] = None
+        self._current_section: Optional[str] = None
+        self._closed = False
+
+    def feed(self, text: str) -> List[ChapterOutline]:
+        """Agrega texto y devuelve los capítulos que quedaron completos."""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        completed = []
+        for line in lines:
+            chapter = self._process_line(line)
+            if chapter:
+                completed.append(chapter)
+        return completed
+
+    def close(self) -> List[ChapterOutline]:
+        """Procesa el texto restante y devuelve el último capítulo, si lo hay."""
+        if self._closed:
+            return []
+        self._closed = True
+        completed = self.feed('\n')
+        if self._current_chapter:
+            completed.append(self._finalize(self._current_chapter))
+            self._current_chapter = None
+        return completed
+
+    def _process_line(self, line: str) -> Optional[ChapterOutline]:
+        line = line.strip()
+        if not line:
+            return None
+        
+        # Detectar inicio de nuevo capítulo
+        if line.lower().startswith('capítulo'):
+            digits = ''.join(filter(str.isdigit, line.split(':', 1)[0]))
+            if digits:
+                previous = self._current_chapter
+                
+                # Extraer número y título
+                parts = line.split(':', 1)
+                number = int(digits)
+                title = parts[1].strip() if len(parts) > 1 else f"Capítulo {number}"
+                
+                self._current_chapter = ChapterOutline(
+                    number=number,
+                    title=title,
+                    summary="",
+                    key_events=[],
+                    characters_involved=[],
+                    locations=[]
+                )
+                self._current_section = None
+                return self._finalize(previous) if previous else None
+        
+        chapter = self._current_chapter
+        if chapter is None:
+            return None
+        
+        # Detectar secciones
+        lowered = line.lower()
+        if lowered.startswith('resumen:'):
+            self._current_section = 'summary'
+            chapter.summary = line.split(':', 1)[1].strip()
+            return None
+        
+        if lowered.startswith('eventos clave:'):
+            self._current_section = 'events'
+            return None
+        
+        if lowered.startswith('personajes involucrados:'):
+            self._current_section = 'characters'
+            return None
+        
+        if lowered.startswith('ubicaciones:'):
+            self._current_section = 'locations'
+            return None
+        
+        # Procesar contenido según la sección actual
+        if line.startswith('-'):
+            content = line[1:].strip()
+            if self._current_section == 'events':
+                chapter.key_events.append(content)
+            elif self._current_section == 'characters':
+                chapter.characters_involved.append(content)
+            elif self._current_section == 'locations':
+                chapter.locations.append(content)
+        elif self._current_section == 'summary':
+            # Agregar líneas adicionales al resumen
+            chapter.summary += " " + line
+        return None
+
+    @staticmethod
+    def _finalize(chapter: ChapterOutline) -> ChapterOutline:
+        # Validar y limpiar los datos
+        chapter.summary = chapter.summary.strip()
+        chapter.key_events = [event for event in chapter.key_events if event]
+        chapter.characters_involved = [char for char in chapter.characters_involved if char]
+        chapter.locations = [loc for loc in chapter.locations if loc]
+        
+        # Asegurar que hay al menos un valor en cada lista
+        if not chapter.key_events:
+            chapter.key_events = ["Desarrollo de la trama principal"]
+        if not chapter.characters_involved:
+            chapter.characters_involved = ["Personaje principal"]
+        if not chapter.locations:
+            chapter.locations = ["Ubicación principal"]
+        return chapter
@@ -0,0 +1,81 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core.models.data_models import Message, Chapter, ChapterOutline
+
+# Resultado de un desarrollo especulativo: el capítulo, los mensajes que generó y el historial privado final
+PrefetchResult = Tuple[Chapter, List[Message], List[Message]]
+DevelopFn = Callable[[ChapterOutline, List[Message]], Awaitable[Chapter]]
+
+
+class ChapterPrefetcher:
+    """
+    Desarrolla en segundo plano los próximos capítulos mientras el lector está en el actual.
+
+    Cada capítulo especulativo trabaja sobre una copia privada del historial: sus mensajes
+    no se publican hasta que el capítulo se entrega con ``take``. El capítulo N+2 espera al
+    N+1 y parte de su historial, de modo que el resultado es el mismo que en serie.
+    """
+
+    def __init__(self, develop: DevelopFn, depth: int = 1):
+        self._develop = develop
+        self.depth = max(0, depth)
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def schedule(self, pending: List[ChapterOutline], history: List[Message]):
+        """Lanza el desarrollo de los primeros ``depth`` capítulos pendientes que aún no estén en curso."""
+        previous: Optional[asyncio.Task] = None
+        for outline in pending[:self.depth]:
+            task = self._tasks.get(outline.number)
+            if task is None:
+                task = asyncio.create_task(self._run(outline, history.copy(), previous))
+                task.add_done_callback(_consume_exception)
+                self._tasks[outline.number] = task
+            previous = task
+
+    async def _run(self, outline: ChapterOutline, history: List[Message],
+                   previous: Optional[asyncio.Task]) -> PrefetchResult:
+        if previous is not None:
+            # Continuar a partir del historial privado del capítulo anterior
+            _, _, history = await previous
+            history = history.copy()
+        start = len(history)
+        chapter = await self._develop(outline, history)
+        return chapter, history[start:], history
+
+    async def take(self, chapter_number: int) -> Optional[Tuple[Chapter, List[Message]]]:
+        """
+        Devuelve el capítulo precalculado y sus mensajes, esperando si aún está en curso.
+        Devuelve None si no había nada programado o si el desarrollo especulativo falló.
+        """
+        task = self._tasks.pop(chapter_number, None)
+        if task is None:
+            return None
+        try:
+            chapter, messages, _ = await task
+        except asyncio.CancelledError:
+            if task.cancelled():
+                return None
+            raise
+        except Exception:
+            return None
+        return chapter, messages
+
+    def is_ready(self, chapter_number: int) -> bool:
+        task = self._tasks.get(chapter_number)
+        return task is not None and task.done() and not task.cancelled() and task.exception() is None
+
+    def invalidate(self, from_chapter: Optional[int] = None):
+        """
+        Cancela y descarta los capítulos precalculados (p. ej. al recibir feedback). Con
+        ``from_chapter`` solo se descartan ese capítulo y los siguientes, que dependen de él.
+        """
+        for number in list(self._tasks):
+            if from_chapter is None or number >= from_chapter:
+                self._tasks.pop(number).cancel()
+
+
+def _consume_exception(task: asyncio.Task):
+    # Evita avisos de "exception was never retrieved" para capítulos que nunca se piden
+    if not task.cancelled():
+        task.exception()
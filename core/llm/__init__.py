@@ -0,0 +1,32 @@
+from core.llm.client import LLMClient, create_async_client, create_sync_client, is_async_client
+from core.llm.event_loop import BackgroundEventLoop
+from core.llm.backends import (
+    LLMBackend, OpenAIBackend, FakeLLMBackend, Completion, as_backend,
+    ConcurrencyLimitedBackend
+)
+from core.llm.cache import ResponseCache, CacheMissError, CacheStats, make_cache_key
+from core.llm.rate_limit import RateLimitedBackend, TokenBucket, LLMDispatchError
+from core.llm.batch import StagedBatchBackend, fulfill_batch
+
+__all__ = [
+    'LLMClient',
+    'create_async_client',
+    'create_sync_client',
+    'is_async_client',
+    'BackgroundEventLoop',
+    'LLMBackend',
+    'OpenAIBackend',
+    'FakeLLMBackend',
+    'Completion',
+    'as_backend',
+    'ConcurrencyLimitedBackend',
+    'ResponseCache',
+    'CacheMissError',
+    'CacheStats',
+    'make_cache_key',
+    'RateLimitedBackend',
+    'TokenBucket',
+    'LLMDispatchError',
+    'StagedBatchBackend',
+    'fulfill_batch'
+]
@@ -0,0 +1,298 @@
+import asyncio
+import hashlib
+import re
+import time
+from collections import deque
+from contextlib import aclosing
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, List, Mapping, Optional, Union
+
+import httpx
+import openai
+
+from core.llm.client import LLMClient, is_async_client
+from core.llm.tokens import count_tokens
+
+
+@dataclass
+class Completion:
+    content: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    model: str = ""
+    # "length" si la respuesta se cortó por max_tokens
+    finish_reason: str = ""
+
+
+class LLMBackend(ABC):
+    """Interfaz mínima que necesitan los agentes para hablar con un modelo."""
+
+    # Recibe las cabeceras de límite de tasa de cada respuesta (ver RateLimitedBackend)
+    rate_limit_listener: Optional[Callable[[Mapping[str, str]], None]] = None
+
+    @abstractmethod
+    async def complete(self, model: str, messages: List[Dict[str, str]], **params) -> Completion:
+        ...
+
+    @abstractmethod
+    def stream(self, model: str, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        ...
+
+
+class OpenAIBackend(LLMBackend):
+    """Backend sobre un cliente de OpenAI, asíncrono o síncrono (este último en hilos)."""
+
+    def __init__(self, client: LLMClient):
+        self.client = client
+        self._client_is_async = is_async_client(client)
+
+    async def complete(self, model: str, messages: List[Dict[str, str]], **params) -> Completion:
+        if self._client_is_async:
+            raw = await self.client.chat.completions.with_raw_response.create(
+                model=model, messages=messages, **params
+            )
+            self._report_headers(raw)
+            response = await raw.parse()
+        else:
+            raw = await asyncio.to_thread(
+                self.client.chat.completions.with_raw_response.create, model=model, messages=messages, **params
+            )
+            self._report_headers(raw)
+            response = raw.parse()
+        usage = getattr(response, "usage", None)
+        return Completion(
+            content=response.choices[0].message.content,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            model=getattr(response, "model", model) or model,
+            finish_reason=response.choices[0].finish_reason or ""
+        )
+
+    async def stream(self, model: str, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        if self._client_is_async:
+            raw = await self.client.chat.completions.with_raw_response.create(
+                model=model, messages=messages, stream=True, **params
+            )
+            self._report_headers(raw)
+            stream = await raw.parse()
+            try:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+            finally:
+                # Si el consumidor deja de leer antes del final, la conexión vuelve al pool
+                await stream.close()
+            return
+        
+        # Cliente síncrono: cada fragmento se lee en un hilo para no bloquear el event loop
+        raw = await asyncio.to_thread(
+            self.client.chat.completions.with_raw_response.create,
+            model=model, messages=messages, stream=True, **params
+        )
+        self._report_headers(raw)
+        stream = raw.parse()
+        chunks = iter(stream)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            await asyncio.to_thread(stream.close)
+
+    def _report_headers(self, raw):
+        if self.rate_limit_listener:
+            self.rate_limit_listener(raw.headers)
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    Backend local y determinista para pruebas y benchmarks, sin red.
+
+    Simula una latencia inicial más una velocidad de generación en tokens por segundo, y
+    responde con un esquema de capítulos que _parse_chapter_outline entiende, con texto de
+    capítulo o con aportes breves según el prompt recibido. Con ``requests_per_minute``
+    simula el límite de tasa del proveedor (aplicado por segundo, con cabeceras
+    ``x-ratelimit-*`` y errores 429).
+    """
+
+    def __init__(self, latency: float = 0.0, tokens_per_second: float = 0.0, chapters: int = 3,
+                 chapter_words: int = 300, contribution_words: int = 60, requests_per_minute: float = 0.0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.chapters = chapters
+        self.chapter_words = chapter_words
+        self.contribution_words = contribution_words
+        self.requests_per_minute = requests_per_minute
+        self.calls = 0
+        self.rate_limited_calls = 0
+        self._recent_calls = deque()
+
+    async def complete(self, model: str, messages: List[Dict[str, str]], **params) -> Completion:
+        self._check_rate_limit()
+        self.calls += 1
+        content = self._respond(messages)
+        tokens = count_tokens(content, model)
+        finish_reason = "stop"
+        max_tokens = params.get("max_tokens")
+        if max_tokens and tokens > max_tokens:
+            # Como el proveedor: la respuesta se corta al llegar a max_tokens
+            words = content.split(' ')
+            words = words[:max(1, len(words) * max_tokens // tokens)]
+            while len(words) > 1 and count_tokens(' '.join(words), model) > max_tokens:
+                words.pop()
+            content, tokens, finish_reason = ' '.join(words), max_tokens, "length"
+        await asyncio.sleep(self.latency + self._generation_time(tokens))
+        return Completion(
+            content=content,
+            prompt_tokens=sum(count_tokens(m["content"], model) for m in messages),
+            completion_tokens=tokens,
+            model=model,
+            finish_reason=finish_reason
+        )
+
+    async def stream(self, model: str, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        self._check_rate_limit()
+        self.calls += 1
+        content = self._respond(messages)
+        await asyncio.sleep(self.latency)
+        words = content.split(' ')
+        per_word = self._generation_time(count_tokens(content, model)) / len(words)
+        for index, word in enumerate(words):
+            if per_word:
+                await asyncio.sleep(per_word)
+            yield word if index == len(words) - 1 else word + ' '
+
+    def _check_rate_limit(self):
+        if not self.requests_per_minute:
+            return
+        # Ventana deslizante de un segundo, como los límites cuantizados del proveedor
+        per_second = max(1, int(self.requests_per_minute / 60))
+        now = time.monotonic()
+        while self._recent_calls and now - self._recent_calls[0] >= 1.0:
+            self._recent_calls.popleft()
+        if len(self._recent_calls) >= per_second:
+            self.rate_limited_calls += 1
+            retry_after = 1.0 - (now - self._recent_calls[0])
+            response = httpx.Response(
+                429, headers={"retry-after": f"{retry_after:.3f}"},
+                request=httpx.Request("POST", "https://fake.local/v1/chat/completions")
+            )
+            raise openai.RateLimitError("Rate limit reached (simulado)", response=response, body=None)
+        self._recent_calls.append(now)
+        if self.rate_limit_listener:
+            self.rate_limit_listener({
+                "x-ratelimit-limit-requests": str(self.requests_per_minute),
+                "x-ratelimit-remaining-requests": str(per_second - len(self._recent_calls))
+            })
+
+    def _generation_time(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _respond(self, messages: List[Dict[str, str]]) -> str:
+        prompt = messages[-1]["content"]
+        seed = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+        if "esquema detallado de capítulos" in prompt:
+            return self._outline(prompt)
+        if "lista de beats" in prompt:
+            match = re.search(r"exactamente (\d+) partes", prompt)
+            parts = int(match.group(1)) if match else 3
+            return '\n'.join(f"Parte {n}: Momento {n} del capítulo" for n in range(1, parts + 1))
+        if "Desarrolla el capítulo completo" in prompt or "Desarrolla la parte" in prompt:
+            # Respeta la extensión pedida (~6 caracteres por palabra) si el prompt la indica
+            match = re.search(r"aproximadamente (\d+) caracteres", prompt)
+            words = int(match.group(1)) // 6 if match else self.chapter_words
+            return _filler(f"Capítulo {seed}.", max(1, words))
+        if '"Puntuación: N"' in prompt:
+            # Puntuación determinista entre 4 y 9 según el candidato evaluado
+            return f"Puntuación: {int(seed, 16) % 6 + 4}\nValoración simulada."
+        if "nombre seguido de dos puntos" in prompt:
+            # Una sección "Nombre: descripción" por ubicación pedida
+            match = re.search(r"Ubicaciones:(.*)", prompt)
+            names = [n.strip() for n in match.group(1).split(',') if n.strip()] if match else []
+            per_name = max(1, self.contribution_words // max(1, len(names)))
+            return '\n'.join(f"{name}: {_filler(f'Aporte {seed}.', per_name)}" for name in names) or \
+                _filler(f"Aporte {seed}.", self.contribution_words)
+        if '"Perfil:"' in prompt:
+            return f"Perfil: Personaje {seed}.\n" + _filler(f"Aporte {seed}.", self.contribution_words)
+        return _filler(f"Aporte {seed}.", self.contribution_words)
+
+    def _outline(self, prompt: str) -> str:
+        match = re.search(r"Personajes disponibles:(.*)", prompt)
+        names = [n.strip() for n in match.group(1).split(',') if n.strip()] if match else []
+        names = names or ["Protagonista"]
+        blocks = []
+        for number in range(1, self.chapters + 1):
+            characters = '\n'.join(f"- {name}" for name in names)
+            blocks.append(
+                f"Capítulo {number}: Parte {number}\n"
+                f"Resumen: Sucede la parte {number} de la historia.\n"
+                f"Eventos clave:\n- Evento principal {number}\n- Evento secundario {number}\n"
+                f"Personajes involucrados:\n{characters}\n"
+                f"Ubicaciones:\n- Lugar {number}\n- Lugar {number + 1}\n"
+            )
+        return '\n'.join(blocks)
+
+
+class ConcurrencyLimitedBackend(LLMBackend):
+    """
+    Limita las peticiones en vuelo de todos los orquestadores que comparten este backend.
+
+    Un stream ocupa su plaza hasta que termina de leerse.
+    """
+
+    def __init__(self, backend: LLMBackend, max_in_flight: int):
+        self.backend = backend
+        self.max_in_flight = max(1, max_in_flight)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def complete(self, model: str, messages: List[Dict[str, str]], **params) -> Completion:
+        async with self._semaphore:
+            self._acquired()
+            try:
+                return await self.backend.complete(model, messages, **params)
+            finally:
+                self.in_flight -= 1
+
+    async def stream(self, model: str, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        async with self._semaphore:
+            self._acquired()
+            try:
+                # Cerrar el stream envuelto aunque el consumidor se detenga antes del final
+                async with aclosing(self.backend.stream(model, messages, **params)) as deltas:
+                    async for delta in deltas:
+                        yield delta
+            finally:
+                self.in_flight -= 1
+
+    @property
+    def rate_limit_listener(self):
+        return self.backend.rate_limit_listener
+
+    @rate_limit_listener.setter
+    def rate_limit_listener(self, listener):
+        # Las cabeceras las produce el backend envuelto
+        self.backend.rate_limit_listener = listener
+
+    def _acquired(self):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+
+def _filler(prefix: str, words: int) -> str:
+    body = ("la historia avanza entre sombras y revelaciones " * (words // 6 + 1)).split(' ')[:words]
+    return prefix + ' ' + ' '.join(body)
+
+
+def as_backend(client: Union[LLMBackend, LLMClient]) -> LLMBackend:
+    """Acepta un backend o un cliente de OpenAI y devuelve siempre un LLMBackend."""
+    if isinstance(client, LLMBackend):
+        return client
+    return OpenAIBackend(client)
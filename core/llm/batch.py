@@ -0,0 +1,214 @@
+import asyncio
+import glob
+import json
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+from core.llm.backends import Completion, LLMBackend
+from core.llm.cache import make_cache_key
+from core.llm.rate_limit import LLMDispatchError
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# Historia (job) a la que pertenece la llamada en curso; las tareas la heredan al crearse
+_current_job: ContextVar[Optional[str]] = ContextVar("staged_batch_job", default=None)
+
+
+class StagedBatchBackend(LLMBackend):
+    """
+    Backend que no llama al modelo: acumula las peticiones para escribirlas en un archivo
+    de la Batch API y las resuelve al ingerir el archivo de resultados.
+
+    Cada llamada sin resultado queda en espera. Cada historia se ejecuta dentro de ``job``;
+    cuando todas las historias en curso esperan solo peticiones sin resultado
+    (``wait_until_blocked``), lo pendiente es una etapa completa del pipeline para todas
+    ellas: el esquema, luego geografía y personajes, luego el Narrador. El ``custom_id`` de
+    cada petición es el hash de (modelo, mensajes, parámetros), así una nueva ejecución
+    rehace las etapas ya resueltas desde los resultados y llega a la siguiente.
+    """
+
+    def __init__(self):
+        self.results: Dict[str, Completion] = {}
+        self._pending: Dict[str, Tuple[Dict, asyncio.Future]] = {}
+        self._jobs: Set[str] = set()
+        # Peticiones que espera cada historia en curso
+        self._waits: Dict[str, List[asyncio.Future]] = {}
+        self._changed: Optional[asyncio.Event] = None
+
+    @contextmanager
+    def job(self, job_id: str) -> Iterator[None]:
+        """Marca las llamadas hechas dentro del bloque (y de sus tareas) como de la historia ``job_id``."""
+        token = _current_job.set(job_id)
+        self._jobs.add(job_id)
+        self._notify()
+        try:
+            yield
+        finally:
+            self._jobs.discard(job_id)
+            _current_job.reset(token)
+            self._notify()
+
+    async def complete(self, model: str, messages: List[Dict[str, str]], **params) -> Completion:
+        custom_id = make_cache_key(model, messages, **params)
+        result = self.results.get(custom_id)
+        if result is not None:
+            return result
+        if custom_id in self._pending:
+            # Petición idéntica de otra historia: comparte la misma línea del lote
+            future = self._pending[custom_id][1]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": dict(params, model=model, messages=messages)
+            }
+            self._pending[custom_id] = (request, future)
+        waits = self._waits.setdefault(_current_job.get(), [])
+        waits.append(future)
+        self._notify()
+        try:
+            return await asyncio.shield(future)
+        finally:
+            waits.remove(future)
+            self._notify()
+
+    async def stream(self, model: str, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        # La Batch API no hace streaming: el texto llega de una vez
+        yield (await self.complete(model, messages, **params)).content
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _blocked(self) -> bool:
+        """True si cada historia en curso espera al menos una petición y ninguna ya resuelta."""
+        if not self._jobs:
+            return False
+        for job_id in self._jobs:
+            waits = self._waits.get(job_id)
+            if not waits or any(future.done() for future in waits):
+                return False
+        return True
+
+    async def wait_until_blocked(self, task: asyncio.Task):
+        """Espera a que ``task`` termine o a que todas sus historias solo esperen peticiones del lote."""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        while not task.done() and not self._blocked():
+            self._changed.clear()
+            changed = asyncio.ensure_future(self._changed.wait())
+            try:
+                await asyncio.wait({task, changed}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                changed.cancel()
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    def export(self, path: str) -> int:
+        """Escribe las peticiones pendientes en ``path`` (formato JSONL de la Batch API)."""
+        with open(path, "w", encoding="utf-8") as output:
+            for request, _ in self._pending.values():
+                output.write(json.dumps(request, ensure_ascii=False) + "\n")
+        return len(self._pending)
+
+    def ingest(self, path: str) -> int:
+        """Carga un archivo de resultados de la Batch API y despierta a quienes los esperaban."""
+        loaded = 0
+        with open(path, encoding="utf-8") as source:
+            for line in source:
+                if not line.strip():
+                    continue
+                line_data = json.loads(line)
+                custom_id = line_data["custom_id"]
+                response = line_data.get("response") or {}
+                body = response.get("body") or {}
+                error = line_data.get("error") or body.get("error")
+                if response.get("status_code") == 200 and not error:
+                    self._resolve(custom_id, _completion_from_body(body))
+                    loaded += 1
+                elif custom_id in self._pending:
+                    # El error puede venir como objeto {"message": ...} o como texto
+                    message = error.get("message") if isinstance(error, dict) else error
+                    message = str(message or f"HTTP {response.get('status_code')}")
+                    _, future = self._pending.pop(custom_id)
+                    if not future.done():
+                        future.set_exception(LLMDispatchError(f"Petición {custom_id} del lote falló: {message}"))
+        return loaded
+
+    def load_results(self, batch_dir: str) -> int:
+        """Ingiere todos los ``results-*.jsonl`` de ``batch_dir``, en orden."""
+        return sum(self.ingest(path) for path in sorted(glob.glob(os.path.join(batch_dir, "results-*.jsonl"))))
+
+    def _resolve(self, custom_id: str, completion: Completion):
+        self.results[custom_id] = completion
+        entry = self._pending.pop(custom_id, None)
+        if entry is not None:
+            if not entry[1].done():
+                entry[1].set_result(completion)
+
+
+def _completion_from_body(body: Dict) -> Completion:
+    usage = body.get("usage") or {}
+    return Completion(
+        content=body["choices"][0]["message"]["content"],
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        model=body.get("model", ""),
+        finish_reason=body["choices"][0].get("finish_reason") or ""
+    )
+
+
+def next_stage_paths(batch_dir: str) -> Tuple[str, str]:
+    """Rutas (peticiones, resultados) de la próxima etapa dentro de ``batch_dir``."""
+    stage = 1
+    for path in glob.glob(os.path.join(batch_dir, "requests-*.jsonl")):
+        match = re.search(r"requests-(\d+)\.jsonl$", path)
+        if match:
+            stage = max(stage, int(match.group(1)) + 1)
+    return (os.path.join(batch_dir, f"requests-{stage:04d}.jsonl"),
+            os.path.join(batch_dir, f"results-{stage:04d}.jsonl"))
+
+
+async def fulfill_batch(requests_path: str, results_path: str, backend: LLMBackend,
+                        max_in_flight: int = 32) -> int:
+    """
+    Sustituto local de la Batch API: resuelve cada petición de ``requests_path`` con
+    ``backend`` y escribe los resultados en el mismo formato que devuelve el proveedor.
+    """
+    with open(requests_path, encoding="utf-8") as source:
+        requests = [json.loads(line) for line in source if line.strip()]
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def run(request: Dict) -> Dict:
+        body = dict(request["body"])
+        model, messages = body.pop("model"), body.pop("messages")
+        async with semaphore:
+            completion = await backend.complete(model, messages, **body)
+        return {
+            "id": f"batch_req_{request['custom_id'][:16]}",
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "model": completion.model or model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": completion.content},
+                                 "finish_reason": completion.finish_reason or "stop"}],
+                    "usage": {"prompt_tokens": completion.prompt_tokens,
+                              "completion_tokens": completion.completion_tokens}
+                }
+            },
+            "error": None
+        }
+
+    results = await asyncio.gather(*(run(request) for request in requests))
+    with open(results_path, "w", encoding="utf-8") as output:
+        for result in results:
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return len(results)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+class CacheMissError(LookupError):
+    """Se pidió una respuesta que no está en caché estando en modo replay (sin red)."""
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], **params) -> str:
+    """Hash estable de (modelo, mensajes, parámetros) que identifica una respuesta."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _DiskTier:
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, value: str) -> int:
+        size = len(value.encode('utf-8'))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+            (key, value, size, time.time())
+        )
+        return self._evict()
+
+    def _evict(self) -> int:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        evicted = 0
+        while total > self.max_bytes:
+            row = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            total -= row[1]
+            evicted += 1
+        return evicted
+
+    def close(self):
+        self._conn.close()
+
+
+class ResponseCache:
+    """
+    Caché de respuestas del LLM direccionada por contenido.
+
+    Un primer nivel LRU en memoria y, opcionalmente, un segundo nivel SQLite en disco; ambos
+    se recortan por tamaño en bytes. En modo ``replay`` un fallo de caché lanza
+    CacheMissError en lugar de llamar a la API.
+    """
+
+    def __init__(self, max_memory_bytes: int = 32 * 1024 * 1024, disk_path: Optional[str] = None,
+                 max_disk_bytes: int = 512 * 1024 * 1024, replay: bool = False):
+        self.max_memory_bytes = max_memory_bytes
+        self.replay = replay
+        self.stats = CacheStats()
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = _DiskTier(disk_path, max_disk_bytes) if disk_path else None
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.stats.hits += 1
+                self.stats.memory_hits += 1
+                return value
+            if self._disk is not None:
+                value = self._disk.get(key)
+                if value is not None:
+                    # Promover al nivel en memoria
+                    self._store_in_memory(key, value)
+                    self.stats.hits += 1
+                    self.stats.disk_hits += 1
+                    return value
+            self.stats.misses += 1
+        if self.replay:
+            raise CacheMissError(key)
+        return None
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._store_in_memory(key, value)
+            if self._disk is not None:
+                self.stats.evictions += self._disk.put(key, value)
+
+    def _store_in_memory(self, key: str, value: str):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous.encode('utf-8'))
+        size = len(value.encode('utf-8'))
+        if size > self.max_memory_bytes:
+            return
+        self._memory[key] = value
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.encode('utf-8'))
+            self.stats.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
@@ -0,0 +1,52 @@
+import inspect
+from typing import Optional, Union
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+LLMClient = Union[AsyncOpenAI, OpenAI]
+
+# Límites por defecto del pool HTTP compartido por todos los agentes
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE = 10
+DEFAULT_TIMEOUT = 120.0
+
+
+def _build_limits(max_connections: int, max_keepalive: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(max_keepalive, max_connections)
+    )
+
+
+def create_async_client(api_key: Optional[str] = None,
+                        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                        max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+                        timeout: float = DEFAULT_TIMEOUT) -> AsyncOpenAI:
+    """Crea un cliente asíncrono con un pool de conexiones acotado.
+
+    El cliente debe usarse siempre desde el mismo event loop (ver ``BackgroundEventLoop``).
+    """
+    http_client = httpx.AsyncClient(
+        limits=_build_limits(max_connections, max_keepalive),
+        timeout=timeout
+    )
+    return AsyncOpenAI(api_key=api_key, http_client=http_client)
+
+
+def create_sync_client(api_key: Optional[str] = None,
+                       max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                       max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+                       timeout: float = DEFAULT_TIMEOUT) -> OpenAI:
+    """Crea un cliente síncrono con el mismo pool acotado, para entornos sin event loop propio."""
+    http_client = httpx.Client(
+        limits=_build_limits(max_connections, max_keepalive),
+        timeout=timeout
+    )
+    return OpenAI(api_key=api_key, http_client=http_client)
+
+
+def is_async_client(client) -> bool:
+    """Indica si ``client.chat.completions.create`` devuelve una corrutina."""
+    create = client.chat.completions.create
+    return inspect.iscoroutinefunction(create) or isinstance(client, AsyncOpenAI)
@@ -0,0 +1,40 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+
+class BackgroundEventLoop:
+    """Event loop dedicado que vive en su propio hilo.
+
+    Flask atiende cada request en un hilo distinto; en lugar de crear un loop por
+    request (``async_to_sync``), todas las corrutinas del orquestador se envían a este
+    loop, de modo que el cliente asíncrono y su pool de conexiones se comparten.
+    """
+
+    def __init__(self, name: str = "story-builder-loop"):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def _run_forever(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Programa la corrutina en el loop y devuelve un ``concurrent.futures.Future``."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Ejecuta la corrutina en el loop y bloquea el hilo llamador hasta obtener el resultado."""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("run() no puede llamarse desde el propio hilo del event loop")
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
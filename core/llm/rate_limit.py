@@ -0,0 +1,297 @@
+import asyncio
+import random
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Mapping, Optional
+
+import openai
+
+from core.llm.backends import Completion, LLMBackend
+from core.llm.cache import make_cache_key
+from core.llm.tokens import count_tokens
+
+# Errores transitorios del proveedor que vale la pena reintentar
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    asyncio.TimeoutError
+)
+
+
+class LLMDispatchError(Exception):
+    """El LLM no respondió dentro del plazo o se agotaron los reintentos."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Cubo de fichas que se rellena a ``per_minute`` fichas por minuto (0 = sin límite).
+
+    La capacidad equivale a ``burst_seconds`` de consumo: los proveedores aplican sus
+    límites por minuto en ventanas más cortas. Las esperas se atienden en orden de llegada.
+    """
+
+    def __init__(self, per_minute: float = 0.0, burst_seconds: float = 1.0):
+        self.burst_seconds = burst_seconds
+        self.per_minute = 0.0
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.set_rate(per_minute)
+
+    @property
+    def limited(self) -> bool:
+        return self.per_minute > 0
+
+    def set_rate(self, per_minute: float):
+        self._refill()
+        was_limited = self.limited
+        self.per_minute = max(0.0, per_minute)
+        self.capacity = max(1.0, self.per_minute * self.burst_seconds / 60)
+        self.tokens = min(self.tokens, self.capacity) if was_limited else self.capacity
+
+    def cap_remaining(self, remaining: float):
+        """Ajusta las fichas a lo que el proveedor dice que queda disponible."""
+        if self.limited:
+            self._refill()
+            self.tokens = min(self.tokens, remaining)
+
+    def adjust(self, delta: float):
+        """Devuelve (delta > 0) o cobra (delta < 0) la diferencia entre lo estimado y lo consumido."""
+        if self.limited:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + delta)
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Espera hasta disponer de ``amount`` fichas; devuelve los segundos esperados."""
+        if not self.limited:
+            return 0.0
+        start = time.monotonic()
+        async with self._lock:
+            while self.limited:
+                self._refill()
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= needed
+                    break
+                await asyncio.sleep((needed - self.tokens) * 60 / self.per_minute)
+        return time.monotonic() - start
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.limited:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+
+@dataclass
+class _PendingCall:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class RateLimitedBackend(LLMBackend):
+    """
+    Capa de despacho compartida por todas las sesiones delante de un backend.
+
+    - Limita peticiones y tokens por minuto con cubos de fichas. Los límites se ajustan a
+      las cabeceras ``x-ratelimit-*`` del proveedor, se reducen a la mitad ante un 429 y
+      se recuperan poco a poco después.
+    - Reintenta los errores transitorios con backoff exponencial con jitter (o el
+      ``retry-after`` del proveedor), dentro de un plazo total por llamada.
+    - Une las llamadas idénticas que están en vuelo en una sola petición.
+
+    Un stream solo se reintenta si todavía no entregó texto. ``attempt_timeout`` es la
+    espera máxima entre fragmentos de un stream, y el plazo total solo corre hasta su primer
+    fragmento. Una respuesta completa (sin streaming) no deja ver su avance, así que por
+    defecto solo la limita el plazo total y, si se indica, ``completion_timeout``.
+    """
+
+    def __init__(self, backend: LLMBackend, requests_per_minute: float = 0.0, tokens_per_minute: float = 0.0,
+                 max_retries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 deadline: float = 120.0, attempt_timeout: float = 60.0,
+                 completion_timeout: Optional[float] = None,
+                 expected_completion_tokens: int = 500, metrics=None):
+        self.backend = backend
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        # Límites objetivo: los configurados o los que anuncia el proveedor
+        self._request_limit = requests_per_minute
+        self._token_limit = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.completion_timeout = completion_timeout
+        self.expected_completion_tokens = expected_completion_tokens
+        self.metrics = metrics
+        self._in_flight: Dict[str, _PendingCall] = {}
+        backend.rate_limit_listener = self.observe_headers
+
+    async def complete(self, model: str, messages: List[Dict[str, str]], **params) -> Completion:
+        deadline = params.pop("deadline", self.deadline)
+        key = make_cache_key(model, messages, **params)
+        pending = self._in_flight.get(key)
+        if pending is None:
+            task = asyncio.ensure_future(self._complete(model, messages, params, deadline))
+            pending = _PendingCall(task)
+            self._in_flight[key] = pending
+            task.add_done_callback(lambda _: self._forget(key, pending))
+        elif self.metrics:
+            self.metrics.inc("llm_coalesced_total")
+
+        pending.waiters += 1
+        try:
+            return await asyncio.shield(pending.task)
+        except asyncio.CancelledError:
+            # Solo se cancela la petición compartida si nadie más la espera
+            if pending.waiters == 1:
+                pending.task.cancel()
+            raise
+        finally:
+            pending.waiters -= 1
+
+    async def stream(self, model: str, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        deadline = params.pop("deadline", self.deadline)
+        expires = time.monotonic() + deadline
+        estimate = self._estimate_tokens(messages, params)
+        attempt = 0
+        while True:
+            await self._acquire(estimate, expires)
+            chars = 0
+            try:
+                # aclosing: si el consumidor se detiene o vence el plazo, el stream del
+                # proveedor se cierra en el momento y su conexión vuelve al pool
+                async with aclosing(self.backend.stream(model, messages, **params)) as deltas:
+                    iterator = deltas.__aiter__()
+                    while True:
+                        # El plazo total cubre la espera de cupo, los reintentos y el primer
+                        # fragmento; después solo la espera entre fragmentos, para no cortar un
+                        # capítulo largo que sigue llegando
+                        timeout = self.attempt_timeout if chars else self._attempt_timeout(expires, self.attempt_timeout)
+                        try:
+                            delta = await asyncio.wait_for(iterator.__anext__(), timeout)
+                        except StopAsyncIteration:
+                            break
+                        chars += len(delta)
+                        yield delta
+            except RETRYABLE_ERRORS as e:
+                if chars:
+                    # El texto parcial ya se entregó: reintentar lo duplicaría
+                    raise LLMDispatchError(f"El stream se interrumpió: {e}") from e
+                attempt += 1
+                await self._backoff(e, attempt, expires)
+                continue
+            self._on_success(estimate, estimate - self._completion_estimate(params) + chars / 4)
+            return
+
+    def observe_headers(self, headers: Mapping[str, str]):
+        """Adapta los cubos a las cabeceras de límite de tasa de la última respuesta."""
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = _header_number(headers, f"x-ratelimit-limit-{kind}")
+            if limit:
+                configured = self._request_limit if kind == "requests" else self._token_limit
+                target = min(configured, limit) if configured else limit
+                if kind == "requests":
+                    self._request_limit = target
+                else:
+                    self._token_limit = target
+                if not bucket.limited or bucket.per_minute > target:
+                    bucket.set_rate(target)
+            remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is not None:
+                bucket.cap_remaining(remaining)
+
+    async def _complete(self, model: str, messages: List[Dict[str, str]], params: Dict,
+                        deadline: float) -> Completion:
+        expires = time.monotonic() + deadline
+        estimate = self._estimate_tokens(messages, params)
+        attempt = 0
+        while True:
+            await self._acquire(estimate, expires)
+            try:
+                completion = await asyncio.wait_for(
+                    self.backend.complete(model, messages, **params),
+                    self._attempt_timeout(expires, self.completion_timeout)
+                )
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                await self._backoff(e, attempt, expires)
+                continue
+            used = completion.prompt_tokens + completion.completion_tokens
+            self._on_success(estimate, used or estimate)
+            return completion
+
+    async def _acquire(self, estimate: int, expires: float):
+        remaining = expires - time.monotonic()
+        try:
+            waited = await asyncio.wait_for(self.requests.acquire(1), remaining)
+            waited += await asyncio.wait_for(self.tokens.acquire(estimate), expires - time.monotonic())
+        except asyncio.TimeoutError:
+            raise LLMDispatchError("Se agotó el plazo esperando cupo del límite de tasa",
+                                   retry_after=60 / self.requests.per_minute if self.requests.limited else None)
+        if self.metrics and waited:
+            self.metrics.observe("llm_rate_limit_wait_seconds", waited)
+
+    async def _backoff(self, error: Exception, attempt: int, expires: float):
+        reason = type(error).__name__
+        if self.metrics:
+            self.metrics.inc("llm_retries_total", reason=reason)
+        if isinstance(error, openai.RateLimitError):
+            # Disminución multiplicativa; _on_success la recupera de forma aditiva
+            for bucket in (self.requests, self.tokens):
+                if bucket.limited:
+                    bucket.set_rate(max(1.0, bucket.per_minute / 2))
+        delay = self._retry_delay(error, attempt)
+        if attempt > self.max_retries or time.monotonic() + delay >= expires:
+            raise LLMDispatchError(f"El LLM no respondió tras {attempt} intentos: {str(error) or reason}",
+                                   retry_after=delay) from error
+        await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        jitter = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        response = getattr(error, "response", None)
+        retry_after = _header_number(response.headers, "retry-after") if response is not None else None
+        if retry_after is not None:
+            return min(self.max_delay, retry_after + random.uniform(0, self.base_delay))
+        return jitter
+
+    def _on_success(self, estimate: float, used: float):
+        self.tokens.adjust(estimate - used)
+        for bucket, target in ((self.requests, self._request_limit), (self.tokens, self._token_limit)):
+            if target and bucket.limited and bucket.per_minute < target:
+                bucket.set_rate(min(target, bucket.per_minute + target * 0.05))
+
+    def _attempt_timeout(self, expires: float, timeout: Optional[float]) -> float:
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise LLMDispatchError("Se agotó el plazo de la llamada al LLM")
+        return remaining if timeout is None else min(remaining, timeout)
+
+    def _estimate_tokens(self, messages: List[Dict[str, str]], params: Dict) -> int:
+        prompt = sum(count_tokens(message["content"]) for message in messages)
+        return prompt + self._completion_estimate(params)
+
+    def _completion_estimate(self, params: Dict) -> int:
+        return params.get("max_tokens") or self.expected_completion_tokens
+
+    def _forget(self, key: str, pending: _PendingCall):
+        if self._in_flight.get(key) is pending:
+            del self._in_flight[key]
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name) if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
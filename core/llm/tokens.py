@@ -0,0 +1,54 @@
+"""
+Conteo de tokens para los presupuestos de contexto y de rate limit.
+
+Con tiktoken (en requirements.txt) se cuenta con el tokenizador del modelo. Sin él, o si
+no puede descargar el vocabulario, se estima por caracteres: es una aproximación, y
+``CHARS_PER_TOKEN`` es conservador para que el español (más tokens por carácter que el
+inglés) no se quede por debajo del presupuesto.
+"""
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # sin tiktoken se usa la aproximación por caracteres
+    tiktoken = None
+
+# Caracteres por token en la aproximación; el español con cl100k ronda 3-3.5
+CHARS_PER_TOKEN = 3
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken descarga el vocabulario la primera vez; sin red se usa la aproximación
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-3.5-turbo") -> str:
+    """Recorta el texto a ``max_tokens`` conservando el principio y el final."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _encoding(model)
+    half = max(1, (max_tokens - 1) // 2)
+    if encoding is None:
+        head, tail = text[:half * CHARS_PER_TOKEN], text[-half * CHARS_PER_TOKEN:]
+    else:
+        tokens = encoding.encode(text)
+        head, tail = encoding.decode(tokens[:half]), encoding.decode(tokens[-half:])
+    return f"{head} […] {tail}"
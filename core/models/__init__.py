@@ -1,3 +1,13 @@
 from core.models.data_models import Message, Chapter, StoryState, ChapterOutline
+from core.models.history import TextStore, TextFork, ChatHistory, ChapterList
+from core.models.serialization import (
+    message_to_dict, message_from_dict, chapter_to_dict, chapter_from_dict,
+    outline_to_dict, outline_from_dict
+)
 
-__all__ = ['Message', 'Chapter', 'StoryState', 'ChapterOutline'] 
\ No newline at end of file
+__all__ = [
+    'Message', 'Chapter', 'StoryState', 'ChapterOutline',
+    'TextStore', 'TextFork', 'ChatHistory', 'ChapterList',
+    'message_to_dict', 'message_from_dict', 'chapter_to_dict', 'chapter_from_dict',
+    'outline_to_dict', 'outline_from_dict'
+]
@@ -24,6 +24,8 @@ class StoryState:
     chapters: List[Chapter] = None
     is_complete: bool = False
     total_chars: int = 0
+    # Extensión pedida para toda la historia (character_count)
+    target_chars: int = 0
 
     def __post_init__(self):
         if self.chapters is None:
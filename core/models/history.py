@@ -0,0 +1,272 @@
+import hashlib
+import mmap
+import sys
+import tempfile
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple, Union, overload
+
+from core.models.data_models import Chapter, Message
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class TextStore:
+    """
+    Textos largos (capítulos, aportes de los agentes) guardados una sola vez y referenciados
+    por id: el mismo capítulo en el chat y en la lista de capítulos ocupa un único registro.
+
+    Los textos se guardan en UTF-8, comprimidos si superan ``compress_min_chars``. Con
+    ``spill_dir`` se escriben en un archivo temporal de ese directorio y se leen por mmap,
+    así no ocupan memoria del proceso.
+    """
+
+    def __init__(self, spill_dir: Optional[str] = None, compress_min_chars: int = 512):
+        self.compress_min_chars = compress_min_chars
+        self._ids: Dict[bytes, int] = {}
+        # Por id: los bytes del texto, o (offset, longitud) dentro del archivo
+        self._entries: List[Union[bytes, tuple]] = []
+        self._compressed: bytearray = bytearray()
+        self._file = tempfile.TemporaryFile(dir=spill_dir) if spill_dir else None
+        self._file_size = 0
+        self._resident = 0
+        self._map: Optional[mmap.mmap] = None
+
+    def _encode(self, text: str) -> Tuple[bytes, bytes, bool]:
+        """(digest, bytes a guardar, comprimido) de un texto."""
+        data = text.encode("utf-8")
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        compressed = len(text) >= self.compress_min_chars
+        if compressed:
+            data = zlib.compress(data, 1)
+        return digest, data, compressed
+
+    def put(self, text: str) -> int:
+        digest, data, compressed = self._encode(text)
+        text_id = self._ids.get(digest)
+        if text_id is not None:
+            return text_id
+        if self._file is not None:
+            self._file.seek(self._file_size)
+            self._file.write(data)
+            entry = (self._file_size, len(data))
+            self._file_size += len(data)
+        else:
+            entry = data
+            self._resident += len(data)
+        text_id = len(self._entries)
+        self._entries.append(entry)
+        self._compressed.append(compressed)
+        self._ids[digest] = text_id
+        return text_id
+
+    def get(self, text_id: int) -> str:
+        entry = self._entries[text_id]
+        if isinstance(entry, tuple):
+            offset, length = entry
+            data = self._mapped()[offset:offset + length]
+        else:
+            data = entry
+        return _decode(data, self._compressed[text_id])
+
+    def fork(self) -> "TextFork":
+        """Almacén para un historial privado que lee los textos de este."""
+        return TextFork(self)
+
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None or len(self._map) < self._file_size:
+            # El archivo creció desde el último mapeo
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), self._file_size, access=mmap.ACCESS_READ)
+        return self._map
+
+    def resident_bytes(self) -> int:
+        """Memoria aproximada de los textos que no están en el archivo."""
+        return self._resident
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TextFork:
+    """
+    Textos de un historial privado (p. ej. el de un capítulo precalculado). Lee los del
+    TextStore base y guarda los nuevos aparte, en memoria y con ids negativos: si el
+    historial se descarta, sus textos se liberan con él en lugar de quedar en el base.
+    """
+
+    def __init__(self, base: TextStore, entries: Optional[List[Tuple[bytes, bool]]] = None,
+                 ids: Optional[Dict[bytes, int]] = None):
+        self.base = base
+        self._entries: List[Tuple[bytes, bool]] = list(entries or [])
+        self._ids: Dict[bytes, int] = dict(ids or {})
+
+    def put(self, text: str) -> int:
+        digest, data, compressed = self.base._encode(text)
+        text_id = self.base._ids.get(digest, self._ids.get(digest))
+        if text_id is not None:
+            return text_id
+        self._entries.append((data, compressed))
+        text_id = -len(self._entries)
+        self._ids[digest] = text_id
+        return text_id
+
+    def get(self, text_id: int) -> str:
+        if text_id >= 0:
+            return self.base.get(text_id)
+        return _decode(*self._entries[-text_id - 1])
+
+    def fork(self) -> "TextFork":
+        # Comparte los bytes ya guardados; los ids de este fork siguen valiendo en el nuevo
+        return TextFork(self.base, self._entries, self._ids)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _decode(data: bytes, compressed: bool) -> str:
+    if compressed:
+        data = zlib.decompress(data)
+    return data.decode("utf-8")
+
+
+class MessageRecord:
+    __slots__ = ("agent_name", "speaking_to", "micros", "text_id")
+
+    def __init__(self, agent_name: str, speaking_to: str, micros: int, text_id: int):
+        self.agent_name = agent_name
+        self.speaking_to = speaking_to
+        self.micros = micros
+        self.text_id = text_id
+
+
+class ChatHistory:
+    """
+    Historial del chat como registros compactos: nombres internados, la fecha en
+    microsegundos y el texto en un TextStore. Se usa como una lista de Message; cada
+    Message se construye solo al leerlo, así un slice de los últimos mensajes no toca
+    el resto del historial.
+    """
+
+    def __init__(self, texts: Union[TextStore, TextFork], records: Optional[List[MessageRecord]] = None):
+        self.texts = texts
+        self._records: List[MessageRecord] = records if records is not None else []
+
+    def append(self, message: Message):
+        self._records.append(MessageRecord(
+            sys.intern(message.agent_name),
+            sys.intern(message.speaking_to),
+            (message.timestamp - _EPOCH) // _MICROSECOND,
+            self.texts.put(message.content)
+        ))
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def copy(self) -> "ChatHistory":
+        """
+        Copia para un historial privado: lee los textos ya guardados y guarda los nuevos en
+        un TextFork propio, que se libera junto con la copia.
+        """
+        return ChatHistory(self.texts.fork(), list(self._records))
+
+    def clear(self):
+        self._records.clear()
+
+    def _materialize(self, record: MessageRecord) -> Message:
+        return Message(
+            agent_name=record.agent_name,
+            content=self.texts.get(record.text_id),
+            timestamp=_EPOCH + timedelta(microseconds=record.micros),
+            speaking_to=record.speaking_to
+        )
+
+    @overload
+    def __getitem__(self, index: int) -> Message: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Message]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._materialize(record) for record in self._records[index]]
+        return self._materialize(self._records[index])
+
+    def __iter__(self) -> Iterator[Message]:
+        for record in self._records:
+            yield self._materialize(record)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __bool__(self) -> bool:
+        return bool(self._records)
+
+
+class ChapterRecord:
+    __slots__ = ("number", "title", "text_id", "character_count", "feedback")
+
+    def __init__(self, number: int, title: str, text_id: int, character_count: int,
+                 feedback: Optional[List[str]]):
+        self.number = number
+        self.title = title
+        self.text_id = text_id
+        self.character_count = character_count
+        self.feedback = feedback
+
+
+class ChapterList:
+    """
+    Capítulos de la historia con el texto en un TextStore compartido con el chat. Cada
+    lectura devuelve un Chapter nuevo: para cambiarlo hay que volver a asignarlo.
+    """
+
+    def __init__(self, texts: TextStore, chapters=()):
+        self.texts = texts
+        self._records: List[ChapterRecord] = []
+        for chapter in chapters:
+            self.append(chapter)
+
+    def _record(self, chapter: Chapter) -> ChapterRecord:
+        return ChapterRecord(chapter.number, chapter.title, self.texts.put(chapter.content),
+                             chapter.character_count, chapter.feedback)
+
+    def _materialize(self, record: ChapterRecord) -> Chapter:
+        return Chapter(
+            number=record.number,
+            title=record.title,
+            content=self.texts.get(record.text_id),
+            character_count=record.character_count,
+            feedback=record.feedback
+        )
+
+    def append(self, chapter: Chapter):
+        self._records.append(self._record(chapter))
+
+    def __setitem__(self, index: int, chapter: Chapter):
+        self._records[index] = self._record(chapter)
+
+    def __getitem__(self, index: int) -> Chapter:
+        return self._materialize(self._records[index])
+
+    def __iter__(self) -> Iterator[Chapter]:
+        for record in self._records:
+            yield self._materialize(record)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __bool__(self) -> bool:
+        return bool(self._records)
@@ -0,0 +1,36 @@
+from dataclasses import asdict
+from datetime import datetime
+from typing import Dict
+
+from core.models.data_models import Message, Chapter, ChapterOutline
+
+
+def message_to_dict(message: Message) -> Dict:
+    data = asdict(message)
+    data["timestamp"] = message.timestamp.isoformat()
+    return data
+
+
+def message_from_dict(data: Dict) -> Message:
+    return Message(
+        agent_name=data["agent_name"],
+        content=data["content"],
+        timestamp=datetime.fromisoformat(data["timestamp"]),
+        speaking_to=data.get("speaking_to", "todos")
+    )
+
+
+def chapter_to_dict(chapter: Chapter) -> Dict:
+    return asdict(chapter)
+
+
+def chapter_from_dict(data: Dict) -> Chapter:
+    return Chapter(**data)
+
+
+def outline_to_dict(outline: ChapterOutline) -> Dict:
+    return asdict(outline)
+
+
+def outline_from_dict(data: Dict) -> ChapterOutline:
+    return ChapterOutline(**data)
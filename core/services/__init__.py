@@ -0,0 +1,16 @@
+from core.services.session_registry import SessionRegistry, StorySession
+from core.services.chat_hub import ChatHub, ChatEvent, ChatSubscription
+from core.services.metrics import Metrics, StoryTrace, estimate_cost
+from core.services.story_store import StoryStore
+
+__all__ = [
+    'SessionRegistry',
+    'StorySession',
+    'ChatHub',
+    'ChatEvent',
+    'ChatSubscription',
+    'Metrics',
+    'StoryTrace',
+    'estimate_cost',
+    'StoryStore'
+]
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from core.services.metrics import Metrics
+
+# Fragmentos del capítulo en streaming y avance de los segmentos: no se guardan en el
+# buffer (un capítulo largo lo vaciaría de mensajes del chat); al reconectarse, el cliente
+# recibe en su lugar un "chapter_snapshot" con el texto hasta el momento
+TRANSIENT_EVENT_TYPES = {"chapter_delta", "chapter_progress"}
+
+
+@dataclass
+class ChatEvent:
+    id: int
+    data: Dict
+    published_at: float = field(default_factory=time.monotonic)
+
+    def to_sse(self) -> str:
+        return f"id: {self.id}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class ChatSubscription:
+    """
+    Suscripción de un cliente SSE a las actualizaciones de una sesión.
+
+    Los eventos se acumulan en una cola propia y acotada; quien consume se despierta en
+    cuanto llega uno nuevo. Si un cliente lento llena su cola la suscripción se cierra y
+    el navegador se reconecta con ``Last-Event-ID``, recuperando lo perdido del buffer.
+    ``get`` bloquea el hilo (WSGI); ``get_async`` espera sin bloquear el event loop (ASGI).
+    """
+
+    def __init__(self, session_id: str, max_pending: int, metrics: Optional[Metrics] = None):
+        self.session_id = session_id
+        self.max_pending = max_pending
+        self.metrics = metrics
+        self.closed = False
+        self._pending: deque = deque()
+        self._condition = threading.Condition()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def _push(self, event: ChatEvent) -> bool:
+        with self._condition:
+            if self.closed:
+                return False
+            if len(self._pending) >= self.max_pending:
+                # Contrapresión: no se acumula memoria por un consumidor que no avanza
+                self.closed = True
+                if self.metrics:
+                    self.metrics.inc("chat_slow_subscribers_dropped_total")
+                self._notify()
+                return False
+            self._pending.append(event)
+            self._notify()
+            return True
+
+    def _notify(self):
+        self._condition.notify_all()
+        if self._wakeup is not None:
+            # publish puede llamarse desde otro hilo
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def get(self, timeout: Optional[float] = None) -> List[ChatEvent]:
+        """Espera hasta ``timeout`` segundos y devuelve los eventos pendientes (lista vacía si no hubo)."""
+        with self._condition:
+            if not self._pending and not self.closed:
+                self._condition.wait(timeout)
+        return self._drain()
+
+    async def get_async(self, timeout: Optional[float] = None) -> List[ChatEvent]:
+        """Como ``get``, pero sin bloquear el event loop mientras espera."""
+        if self._wakeup is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+        with self._condition:
+            ready = bool(self._pending) or self.closed
+            if not ready:
+                self._wakeup.clear()
+        if not ready:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._drain()
+
+    def _drain(self) -> List[ChatEvent]:
+        with self._condition:
+            events = list(self._pending)
+            self._pending.clear()
+        if self.metrics and events:
+            now = time.monotonic()
+            for event in events:
+                self.metrics.observe("chat_delivery_seconds", now - event.published_at)
+        return events
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._notify()
+
+
+class _SessionChannel:
+    def __init__(self, buffer_size: int):
+        self.events: deque = deque(maxlen=buffer_size)
+        self.next_id = 1
+        self.subscribers: Set[ChatSubscription] = set()
+        # Último capítulo emitido en streaming y último avance de segmentos
+        self.chapter: Optional[Dict] = None
+        self.progress: Optional[ChatEvent] = None
+
+    def record(self, event: ChatEvent):
+        data = event.data
+        event_type = data.get("type")
+        if event_type not in TRANSIENT_EVENT_TYPES:
+            self.events.append(event)
+        if event_type == "chapter_start":
+            self.chapter = {"number": data["chapter_number"], "title": data["chapter_title"],
+                            "parts": [], "end_id": None}
+        elif event_type == "chapter_progress":
+            self.progress = event
+        elif self.chapter is not None and data.get("chapter_number") == self.chapter["number"]:
+            if event_type == "chapter_delta":
+                self.chapter["parts"].append(data["delta"])
+            elif event_type == "chapter_end":
+                self.chapter["end_id"] = event.id
+
+    def resume_events(self, last_event_id: int) -> List[ChatEvent]:
+        """Eventos posteriores a ``last_event_id`` que siguen en el buffer, más el estado del capítulo."""
+        events = [event for event in self.events if event.id > last_event_id]
+        chapter = self.chapter
+        if chapter is not None and (chapter["end_id"] is None or chapter["end_id"] > last_event_id):
+            content = "".join(chapter["parts"])
+            chapter["parts"] = [content]
+            events.append(ChatEvent(self.next_id - 1, {
+                "type": "chapter_snapshot",
+                "chapter_number": chapter["number"],
+                "chapter_title": chapter["title"],
+                "content": content,
+                "complete": chapter["end_id"] is not None
+            }))
+        if self.progress is not None and self.progress.id > last_event_id:
+            events.append(self.progress)
+        return events
+
+
+class ChatHub:
+    """
+    Difunde cada actualización del chat a todos los suscriptores de su sesión.
+
+    Solo hay canal para las sesiones abiertas con ``open_session`` (las del registro de
+    sesiones) hasta su ``close_session``; en las demás no se guarda nada.
+    """
+
+    def __init__(self, buffer_size: int = 256, max_pending: int = 512, metrics: Optional[Metrics] = None):
+        self.buffer_size = buffer_size
+        self.max_pending = max_pending
+        self.metrics = metrics
+        self._channels: Dict[str, _SessionChannel] = {}
+        self._lock = threading.Lock()
+
+    def open_session(self, session_id: str):
+        with self._lock:
+            if session_id not in self._channels:
+                self._channels[session_id] = _SessionChannel(self.buffer_size)
+
+    def publish(self, session_id: str, data: Dict) -> Optional[int]:
+        """
+        Guarda el evento en el buffer circular de la sesión y lo entrega a cada suscriptor.
+        Los de TRANSIENT_EVENT_TYPES solo se entregan; ver _SessionChannel.resume_events.
+        Devuelve None si la sesión ya se cerró.
+        """
+        with self._lock:
+            channel = self._channels.get(session_id)
+            if channel is None:
+                return None
+            event = ChatEvent(channel.next_id, data)
+            channel.next_id += 1
+            channel.record(event)
+            subscribers = list(channel.subscribers)
+        if self.metrics:
+            self.metrics.inc("chat_events_published_total")
+        for subscription in subscribers:
+            if not subscription._push(event):
+                self.unsubscribe(subscription)
+        return event.id
+
+    def subscribe(self, session_id: str, last_event_id: Optional[int] = None) -> ChatSubscription:
+        """
+        Crea una suscripción. Si se indica ``last_event_id`` se reenvían primero los eventos
+        posteriores que sigan en el buffer y el texto del capítulo en streaming. Si la
+        sesión no está abierta, la suscripción nace cerrada.
+        """
+        subscription = ChatSubscription(session_id, self.max_pending, self.metrics)
+        with self._lock:
+            channel = self._channels.get(session_id)
+            if channel is None:
+                subscription.closed = True
+                return subscription
+            if last_event_id is not None:
+                # La reposición no cuenta para el límite de la cola: el buffer ya está acotado
+                subscription._pending.extend(channel.resume_events(last_event_id))
+            channel.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ChatSubscription):
+        subscription.close()
+        with self._lock:
+            channel = self._channels.get(subscription.session_id)
+            if channel:
+                channel.subscribers.discard(subscription)
+
+    def close_session(self, session_id: str):
+        """Cierra todas las suscripciones de la sesión y descarta su buffer."""
+        with self._lock:
+            channel = self._channels.pop(session_id, None)
+        if channel:
+            for subscription in list(channel.subscribers):
+                subscription.close()
+
+    def subscriber_count(self, session_id: Optional[str] = None) -> int:
+        """Suscriptores de una sesión, o de todas si no se indica ninguna."""
+        if session_id is None:
+            return sum(len(channel.subscribers) for channel in list(self._channels.values()))
+        channel = self._channels.get(session_id)
+        return len(channel.subscribers) if channel else 0
@@ -0,0 +1,216 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Límites de los histogramas de latencia, en segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Precio en USD por cada 1000 tokens (entrada, salida)
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1000
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Registro de métricas en proceso (contadores, histogramas y gauges) con salida en
+    formato de texto de Prometheus.
+    """
+
+    def __init__(self, prefix: str = "story_"):
+        self.prefix = prefix
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = _Histogram(DEFAULT_BUCKETS)
+            series[key].observe(value)
+
+    def register_gauge(self, name: str, callback: Callable[[], float], help_text: str = ""):
+        """Gauge cuyo valor se obtiene al renderizar (p. ej. sesiones activas)."""
+        self._gauges[name] = callback
+        if help_text:
+            self._help[name] = help_text
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name: str, **labels) -> float:
+        return self._counters.get(name, {}).get(_label_key(labels), 0.0)
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full = f"{self.prefix}{name}"
+                self._header(lines, name, full, "counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                full = f"{self.prefix}{name}"
+                self._header(lines, name, full, "histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{full}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+                    lines.append(f"{full}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{full}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{full}_count{_format_labels(key)} {histogram.count}")
+        for name, callback in sorted(self._gauges.items()):
+            full = f"{self.prefix}{name}"
+            self._header(lines, name, full, "gauge")
+            lines.append(f"{full} {float(callback())}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: List[str], name: str, full: str, kind: str):
+        if name in self._help:
+            lines.append(f"# HELP {full} {self._help[name]}")
+        lines.append(f"# TYPE {full} {kind}")
+
+
+class StoryTrace:
+    """
+    Traza de una historia: registra cada span y el uso de tokens por rol de agente, y
+    reenvía todo al registro global de métricas si lo hay.
+    """
+
+    def __init__(self, metrics: Optional[Metrics] = None, max_spans: int = 2000):
+        self.metrics = metrics
+        self.max_spans = max_spans
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.roles: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - start, **labels)
+
+    def record_span(self, name: str, duration: float, **labels):
+        """Registra un span ya medido (p. ej. la suma de varios tramos discontinuos)."""
+        if len(self.spans) < self.max_spans:
+            self.spans.append({
+                "name": name,
+                "labels": labels,
+                "start": time.perf_counter() - duration - self.started_at,
+                "duration": duration
+            })
+        if self.metrics:
+            self.metrics.observe(f"{name}_seconds", duration, **labels)
+
+    def count(self, name: str, value: float = 1.0, **labels):
+        """Contador propio de la historia, reenviado también a las métricas globales."""
+        key = name + "".join(f";{k}={v}" for k, v in sorted(labels.items()))
+        self.counters[key] = self.counters.get(key, 0) + value
+        if self.metrics:
+            self.metrics.inc(name, value, **labels)
+
+    def observe(self, name: str, value: float, **labels):
+        if self.metrics:
+            self.metrics.observe(name, value, **labels)
+
+    def record_call(self, role: str, model: str, duration: float, prompt_tokens: int = 0,
+                    completion_tokens: int = 0, cached: bool = False):
+        cost = 0.0 if cached else estimate_cost(model, prompt_tokens, completion_tokens)
+        if len(self.spans) < self.max_spans:
+            self.spans.append({
+                "name": "agent_request",
+                "labels": {"role": role, "cached": cached},
+                "start": time.perf_counter() - duration - self.started_at,
+                "duration": duration
+            })
+        totals = self.roles.setdefault(role, {
+            "calls": 0, "cached_calls": 0, "seconds": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0
+        })
+        totals["calls"] += 1
+        totals["cached_calls"] += 1 if cached else 0
+        totals["seconds"] += duration
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        totals["cost_usd"] += cost
+        if self.metrics:
+            self.metrics.inc("agent_calls_total", role=role, cached=str(cached).lower())
+            if not cached:
+                self.metrics.inc("agent_tokens_total", prompt_tokens, role=role, kind="prompt")
+                self.metrics.inc("agent_tokens_total", completion_tokens, role=role, kind="completion")
+                self.metrics.inc("agent_cost_usd_total", cost, role=role, model=model)
+
+    def to_dict(self) -> Dict:
+        return {
+            "elapsed": time.perf_counter() - self.started_at,
+            "roles": self.roles,
+            "counters": self.counters,
+            "spans": self.spans
+        }
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+if TYPE_CHECKING:
+    from core.agents.orchestrator import StoryOrchestrator
+
+
+@dataclass
+class StorySession:
+    session_id: str
+    orchestrator: "StoryOrchestrator"
+    last_access: float = field(default_factory=time.monotonic)
+    # Serializa las operaciones de una misma sesión (se vincula al event loop en el primer uso)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class SessionRegistry:
+    """
+    Registro de orquestadores por sesión, con expulsión LRU, TTL y tope de memoria.
+
+    Todos los orquestadores se crean con ``factory``, que normalmente comparte un único
+    cliente LLM. ``on_create`` recibe cada sesión nueva (p. ej. para rehidratarla desde
+    StoryStore) y ``on_evict`` cada sesión expulsada para liberar sus recursos. Las
+    sesiones con una operación en curso (``lock`` tomado) no se expulsan.
+    """
+
+    def __init__(self, factory: Callable[[], "StoryOrchestrator"], max_sessions: int = 100,
+                 ttl_seconds: float = 3600.0, max_memory_bytes: Optional[int] = None,
+                 on_evict: Optional[Callable[[StorySession], None]] = None,
+                 on_create: Optional[Callable[[StorySession], None]] = None):
+        self._factory = factory
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self._on_evict = on_evict
+        self._on_create = on_create
+        self._sessions: "OrderedDict[str, StorySession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> StorySession:
+        """Devuelve la sesión (creándola si no existe) y la marca como la más reciente."""
+        with self._lock:
+            evicted = self._evict_expired()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = StorySession(session_id, self._factory())
+                if self._on_create:
+                    # Bajo el candado: nadie usa la sesión antes de que termine de prepararse
+                    self._on_create(session)
+                self._sessions[session_id] = session
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_access = time.monotonic()
+            evicted += self._evict_over_capacity(keep=session_id)
+        self._notify(evicted)
+        return session
+
+    def peek(self, session_id: str) -> Optional[StorySession]:
+        """Devuelve la sesión si existe, sin crearla ni refrescar su uso."""
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def remove(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        self._notify([session] if session else [])
+
+    def enforce_limits(self, keep: Optional[str] = None):
+        """Aplica TTL y topes; útil tras operaciones que hacen crecer la sesión ``keep``."""
+        with self._lock:
+            evicted = self._evict_expired() + self._evict_over_capacity(keep)
+        self._notify(evicted)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def memory_usage(self) -> int:
+        return sum(s.orchestrator.estimate_memory_bytes() for s in list(self._sessions.values()))
+
+    def _evict_expired(self) -> List[StorySession]:
+        if not self.ttl_seconds:
+            return []
+        deadline = time.monotonic() - self.ttl_seconds
+        expired = [sid for sid, s in self._sessions.items() if s.last_access < deadline and not _busy(s)]
+        return [self._sessions.pop(sid) for sid in expired]
+
+    def _evict_over_capacity(self, keep: Optional[str] = None) -> List[StorySession]:
+        sizes = {}
+        if self.max_memory_bytes is not None:
+            sizes = {sid: s.orchestrator.estimate_memory_bytes() for sid, s in self._sessions.items()}
+        memory = sum(sizes.values())
+        evicted = []
+        # De la sesión menos usada recientemente a la más reciente
+        for session_id in list(self._sessions):
+            over_memory = self.max_memory_bytes is not None and memory > self.max_memory_bytes
+            if len(self._sessions) <= self.max_sessions and not over_memory:
+                break
+            session = self._sessions[session_id]
+            if session_id == keep or _busy(session):
+                continue
+            memory -= sizes.get(session_id, 0)
+            evicted.append(self._sessions.pop(session_id))
+        return evicted
+
+    def _notify(self, evicted: List[StorySession]):
+        if self._on_evict:
+            for session in evicted:
+                self._on_evict(session)
+
+
+def _busy(session: StorySession) -> bool:
+    # Con una petición en curso, cerrar el orquestador rompería la historia a medio generar;
+    # la sesión se vuelve a considerar en la siguiente pasada
+    return session.lock.locked()
@@ -0,0 +1,308 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, Optional
+
+
+def empty_state() -> Dict:
+    return {
+        "character_names": [],
+        "narration_style": "descriptivo",
+        "model_overrides": None,
+        "chat_history": [],
+        "chapters": [],
+        "records": {},
+        "current_chapter": 0,
+        "total_chapters": 0,
+        "total_chars": 0,
+        "target_chars": 0,
+        "is_complete": False,
+        "pending": [],
+        "summaries": {},
+        "guidance": {}
+    }
+
+
+def apply_event(state: Dict, event: Dict) -> Dict:
+    """Aplica un evento del journal al estado (mismo formato que StoryOrchestrator.export_state)."""
+    event_type = event.get("type")
+    if event_type == "story_started":
+        state.clear()
+        state.update(empty_state())
+        state["character_names"] = list(event["character_names"])
+        state["narration_style"] = event["narration_style"]
+        state["model_overrides"] = event.get("model_overrides")
+    elif event_type == "message":
+        state["chat_history"].append(event["message"])
+    elif event_type == "chapter":
+        index = event["index"]
+        if index < len(state["chapters"]):
+            state["chapters"][index] = event["chapter"]
+        else:
+            state["chapters"].append(event["chapter"])
+        if event.get("outline"):
+            state["records"][str(event["chapter"]["number"])] = {
+                "outline": event["outline"],
+                "contributions": event.get("contributions", {})
+            }
+    elif event_type == "progress":
+        for key in ("current_chapter", "total_chapters", "total_chars", "is_complete",
+                    "pending", "summaries", "guidance"):
+            state[key] = event[key]
+        # Journals anteriores a target_chars no lo traen
+        state["target_chars"] = event.get("target_chars", 0)
+    return state
+
+
+class StoryStore:
+    """
+    Persistencia de las historias por sesión: un journal JSONL de solo anexado más una
+    instantánea periódica.
+
+    Cada cambio del orquestador se anexa como una línea; ``load`` parte de la última
+    instantánea y aplica solo los eventos posteriores, así retomar una historia larga no
+    obliga a releer todo su historial. Cada ``snapshot_every`` eventos se compacta.
+
+    Los eventos de ``journal`` se escriben en un hilo propio, en orden: el event loop de
+    las historias solo los serializa y los encola. ``load``, ``compact`` y ``delete``
+    esperan a que se escriba lo encolado, solo si la sesión tiene eventos en cola.
+
+    Con ``retention_seconds``, ``sweep`` borra las historias sin cambios en ese tiempo que
+    no estén abiertas; se ejecuta al expulsar sesiones, como mucho cada ``sweep_every``.
+    """
+
+    def __init__(self, root_dir: str, snapshot_every: int = 200, fsync: bool = False,
+                 retention_seconds: float = 0.0, sweep_every: float = 3600.0):
+        self.root_dir = root_dir
+        self.snapshot_every = max(1, snapshot_every)
+        self.fsync = fsync
+        self.retention_seconds = retention_seconds
+        self.sweep_every = sweep_every
+        os.makedirs(root_dir, exist_ok=True)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._event_counts: Dict[str, int] = {}
+        # Eventos encolados y aún sin escribir, por sesión
+        self._pending: Dict[str, int] = {}
+        self._locks_guard = threading.Lock()
+        self._last_sweep = time.monotonic()
+        # Escrituras pendientes del hilo escritor; None lo detiene
+        self._queue: "queue.Queue[Optional[Callable[[], None]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_guard = threading.Lock()
+        # Último error de escritura en segundo plano; flush() lo relanza
+        self.last_error: Optional[Exception] = None
+
+    def journal(self, session_id: str) -> Callable[[Dict], None]:
+        """Función para StoryOrchestrator.set_journal que encola los eventos de la sesión."""
+        return lambda event: self.submit(session_id, event)
+
+    def submit(self, session_id: str, event: Dict):
+        """Encola el evento para el hilo escritor; se serializa ahora, antes de que cambie."""
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._locks_guard:
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._enqueue(partial(self._append_pending, session_id, event.get("type"), line))
+
+    def release(self, session_id: str):
+        """Olvida el lock y el contador de la sesión (p. ej. al expulsarla de memoria)."""
+        # Por la cola, para que sea después de escribir sus eventos pendientes
+        self._enqueue(partial(self._forget, session_id))
+        if self.retention_seconds and time.monotonic() - self._last_sweep >= self.sweep_every:
+            self._last_sweep = time.monotonic()
+            self._enqueue(self.sweep)
+
+    def sweep(self) -> int:
+        """Borra las historias de sesiones cerradas sin cambios en ``retention_seconds``."""
+        if not self.retention_seconds:
+            return 0
+        cutoff = time.time() - self.retention_seconds
+        with self._locks_guard:
+            open_sessions = {os.path.basename(self._base_path(session_id))
+                             for session_id in set(self._locks) | set(self._pending)}
+        newest: Dict[str, float] = {}
+        for entry in os.scandir(self.root_dir):
+            match = re.match(r"(.+)\.(journal\.jsonl|snapshot\.json(\.tmp)?)$", entry.name)
+            if match and entry.is_file():
+                base = match.group(1)
+                newest[base] = max(newest.get(base, 0.0), entry.stat().st_mtime)
+        removed = 0
+        for base, mtime in newest.items():
+            if mtime >= cutoff or base in open_sessions:
+                continue
+            for suffix in (".journal.jsonl", ".snapshot.json", ".snapshot.json.tmp"):
+                path = os.path.join(self.root_dir, base + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+            removed += 1
+        return removed
+
+    def flush(self):
+        """Espera a que se escriban los eventos ya encolados y relanza el último error de escritura."""
+        self._wait_written()
+        error, self.last_error = self.last_error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Escribe lo pendiente y detiene el hilo escritor."""
+        with self._writer_guard:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+
+    def _enqueue(self, task: Callable[[], None]):
+        with self._writer_guard:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="story-store-writer", daemon=True)
+                self._writer.start()
+        self._queue.put(task)
+
+    def _wait_written(self, session_id: Optional[str] = None):
+        # Solo lo encolado hasta ahora: otras sesiones pueden seguir encolando mientras tanto.
+        # Con session_id no se espera si esa sesión no tiene nada en cola
+        if session_id is not None:
+            with self._locks_guard:
+                if not self._pending.get(session_id):
+                    return
+        with self._writer_guard:
+            if self._writer is None:
+                return
+        written = threading.Event()
+        self._enqueue(written.set)
+        written.wait()
+
+    def _write_loop(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                task()
+            except Exception as e:
+                self.last_error = e
+            finally:
+                self._queue.task_done()
+
+    def append(self, session_id: str, event: Dict):
+        """Anexa el evento en el momento, sin pasar por el hilo escritor."""
+        self._append_line(session_id, event.get("type"), json.dumps(event, ensure_ascii=False) + "\n")
+
+    def _append_pending(self, session_id: str, event_type: Optional[str], line: str):
+        try:
+            self._append_line(session_id, event_type, line)
+        finally:
+            with self._locks_guard:
+                left = self._pending.get(session_id, 0) - 1
+                if left > 0:
+                    self._pending[session_id] = left
+                else:
+                    self._pending.pop(session_id, None)
+
+    def _append_line(self, session_id: str, event_type: Optional[str], line: str):
+        with self._lock_for(session_id):
+            if event_type == "story_started":
+                # Una historia nueva reemplaza por completo a la anterior
+                self._discard(session_id)
+            with open(self._journal_path(session_id), "a", encoding="utf-8") as journal:
+                journal.write(line)
+                if self.fsync:
+                    journal.flush()
+                    os.fsync(journal.fileno())
+            count = self._event_count(session_id) + 1
+            self._event_counts[session_id] = count
+            if count >= self.snapshot_every:
+                self._compact(session_id)
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        """Estado guardado de la sesión, o None si no tiene historia."""
+        self._wait_written(session_id)
+        with self._lock_for(session_id):
+            state, _ = self._load(session_id)
+            return state
+
+    def compact(self, session_id: str) -> Optional[Dict]:
+        """Escribe una instantánea con el estado actual y vacía el journal."""
+        self._wait_written(session_id)
+        with self._lock_for(session_id):
+            return self._compact(session_id)
+
+    def delete(self, session_id: str):
+        self._wait_written(session_id)
+        with self._lock_for(session_id):
+            self._discard(session_id)
+        self._forget(session_id)
+
+    def _load(self, session_id: str):
+        state = None
+        snapshot_path = self._snapshot_path(session_id)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding="utf-8") as snapshot:
+                state = json.load(snapshot)
+        events = 0
+        journal_path = self._journal_path(session_id)
+        if os.path.exists(journal_path):
+            with open(journal_path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # Línea incompleta por una caída durante la escritura
+                        continue
+                    if state is None:
+                        state = empty_state()
+                    apply_event(state, event)
+                    events += 1
+        return state, events
+
+    def _compact(self, session_id: str) -> Optional[Dict]:
+        state, _ = self._load(session_id)
+        if state is None:
+            return None
+        snapshot_path = self._snapshot_path(session_id)
+        tmp_path = snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as snapshot:
+            json.dump(state, snapshot, ensure_ascii=False)
+            if self.fsync:
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+        # La instantánea queda completa antes de vaciar el journal
+        os.replace(tmp_path, snapshot_path)
+        open(self._journal_path(session_id), "w").close()
+        self._event_counts[session_id] = 0
+        return state
+
+    def _discard(self, session_id: str):
+        for path in (self._snapshot_path(session_id), self._journal_path(session_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        self._event_counts[session_id] = 0
+
+    def _event_count(self, session_id: str) -> int:
+        if session_id not in self._event_counts:
+            _, events = self._load(session_id)
+            self._event_counts[session_id] = events
+        return self._event_counts[session_id]
+
+    def _forget(self, session_id: str):
+        with self._locks_guard:
+            self._locks.pop(session_id, None)
+            self._event_counts.pop(session_id, None)
+
+    def _lock_for(self, session_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    def _base_path(self, session_id: str) -> str:
+        safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", session_id)
+        return os.path.join(self.root_dir, safe_id)
+
+    def _journal_path(self, session_id: str) -> str:
+        return self._base_path(session_id) + ".journal.jsonl"
+
+    def _snapshot_path(self, session_id: str) -> str:
+        return self._base_path(session_id) + ".snapshot.json"
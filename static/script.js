@@ -3,6 +3,10 @@ let storyInProgress = false;
 let currentChapter = 1;
 let totalChapters = 1;
 let eventSource = null;
+// Capítulo que se está recibiendo en streaming: {number, length, textNode, complete}
+let streamingChapter = null;
+// Último mensaje del chat ya mostrado; las respuestas del servidor traen solo los posteriores
+let lastMessageSeq = 0;
 
 // Manejo de personajes
 document.getElementById('add-character').addEventListener('click', function() {
@@ -33,59 +37,189 @@ function formatTimestamp(isoString) {
     return date.toLocaleTimeString();
 }
 
-// Renderizar chat de agentes
+// Renderizar chat de agentes: se añaden solo los mensajes nuevos, sin tocar los ya pintados
 function renderAgentChat(chatHistory) {
     const chatContainer = document.getElementById('agentChat');
     
+    if (!Array.isArray(chatHistory) || chatHistory.length === 0) {
+        return;
+    }
+    
     // Limpiar el mensaje inicial si existe
-    if (chatContainer.querySelector('.text-muted')) {
-        chatContainer.innerHTML = '';
+    const placeholder = chatContainer.querySelector(':scope > .text-muted');
+    if (placeholder) {
+        placeholder.remove();
     }
     
-    // Si es un nuevo mensaje, añadirlo al final
-    if (Array.isArray(chatHistory) && chatHistory.length > 0) {
-        chatHistory.forEach(message => {
-            const messageDiv = document.createElement('div');
-            messageDiv.className = 'agent-message';
-            
-            const headerContent = message.speaking_to === "todos" ? 
-                `${message.agent}` : 
-                `${message.agent} ${message.speaking_to}`;
-            
-            messageDiv.innerHTML = `
-                <div class="agent-header">
-                    <span class="agent-name">${headerContent}</span>
-                    <span class="timestamp">${formatTimestamp(message.timestamp)}</span>
-                </div>
-                <div class="message-content">${message.content}</div>
-            `;
-            
-            // Agregar animación de entrada
-            messageDiv.style.opacity = '0';
-            chatContainer.appendChild(messageDiv);
-            
-            // Animar la entrada del mensaje
-            requestAnimationFrame(() => {
-                messageDiv.style.transition = 'opacity 0.3s ease-in';
-                messageDiv.style.opacity = '1';
-            });
-        });
+    const fragment = document.createDocumentFragment();
+    const added = [];
+    chatHistory.forEach(message => {
+        // Tras una reconexión SSE o en la respuesta HTTP pueden llegar mensajes repetidos
+        if (message.seq !== undefined) {
+            if (message.seq <= lastMessageSeq) {
+                return;
+            }
+            lastMessageSeq = message.seq;
+        }
+        
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'agent-message';
+        
+        const header = document.createElement('div');
+        header.className = 'agent-header';
+        const name = document.createElement('span');
+        name.className = 'agent-name';
+        name.textContent = message.speaking_to === "todos" ?
+            `${message.agent}` :
+            `${message.agent} ${message.speaking_to}`;
+        const timestamp = document.createElement('span');
+        timestamp.className = 'timestamp';
+        timestamp.textContent = formatTimestamp(message.timestamp);
+        header.append(name, timestamp);
         
-        // Scroll suave al último mensaje
-        chatContainer.scrollTo({
-            top: chatContainer.scrollHeight,
-            behavior: 'smooth'
+        const content = document.createElement('div');
+        content.className = 'message-content';
+        content.textContent = message.content;
+        messageDiv.append(header, content);
+        
+        // Agregar animación de entrada
+        messageDiv.style.opacity = '0';
+        fragment.appendChild(messageDiv);
+        added.push(messageDiv);
+    });
+    
+    if (added.length === 0) {
+        return;
+    }
+    chatContainer.appendChild(fragment);
+    
+    // Animar la entrada de los mensajes
+    requestAnimationFrame(() => {
+        added.forEach(messageDiv => {
+            messageDiv.style.transition = 'opacity 0.3s ease-in';
+            messageDiv.style.opacity = '1';
         });
+    });
+    
+    // Scroll suave al último mensaje
+    chatContainer.scrollTo({
+        top: chatContainer.scrollHeight,
+        behavior: 'smooth'
+    });
+}
+
+// Sección de un capítulo dentro de la historia; se crea al final si aún no existe
+function chapterSection(number, title) {
+    const storyOutput = document.getElementById('storyOutput');
+    let section = storyOutput.querySelector(`section[data-chapter="${number}"]`);
+    if (!section) {
+        const placeholder = storyOutput.querySelector(':scope > .text-muted');
+        if (placeholder) {
+            placeholder.remove();
+        }
+        section = document.createElement('section');
+        section.className = 'chapter';
+        section.dataset.chapter = number;
+        const heading = document.createElement('h3');
+        const body = document.createElement('div');
+        body.className = 'chapter-stream';
+        section.append(heading, body);
+        storyOutput.appendChild(section);
+    }
+    section.querySelector('h3').textContent = `Capítulo ${number}: ${title}`;
+    return section;
+}
+
+// Pintar un capítulo completo que no llegó por streaming
+function renderChapter(data) {
+    const section = chapterSection(data.chapter_number, data.chapter_title);
+    section.querySelector('.chapter-stream').textContent = data.content;
+    
+    // Animar solo el capítulo nuevo
+    section.style.opacity = '0';
+    requestAnimationFrame(() => {
+        section.style.transition = 'opacity 0.5s ease-in';
+        section.style.opacity = '1';
+    });
+    section.scrollIntoView({ behavior: 'smooth', block: 'start' });
+}
+
+// Reemplazar el texto de un capítulo ya mostrado, p. ej. tras revisarlo con el feedback
+function replaceChapter(data) {
+    const section = chapterSection(data.chapter_number, data.chapter_title);
+    section.querySelector('.chapter-stream').textContent = data.content;
+}
+
+function chapterWasStreamed(number) {
+    return streamingChapter && streamingChapter.complete && streamingChapter.number === number;
+}
+
+function appendStoryNote(className, lines) {
+    const note = document.createElement('div');
+    note.className = className;
+    lines.forEach(([tag, text]) => {
+        const element = document.createElement(tag);
+        element.textContent = text;
+        note.appendChild(element);
+    });
+    document.getElementById('storyOutput').appendChild(note);
+}
+
+// Mostrar un capítulo a medida que el Narrador lo escribe
+function startChapterStream(update) {
+    const section = chapterSection(update.chapter_number, update.chapter_title);
+    const body = section.querySelector('.chapter-stream');
+    const textNode = document.createTextNode('');
+    // Si el capítulo se vuelve a narrar (p. ej. tras un feedback), se reemplaza su texto
+    body.replaceChildren(textNode);
+    section.style.opacity = '1';
+    
+    streamingChapter = { number: update.chapter_number, length: 0, textNode: textNode, complete: false };
+}
+
+function appendChapterDelta(update) {
+    if (!streamingChapter || streamingChapter.number !== update.chapter_number) {
+        return;
+    }
+    // Ignorar la parte ya recibida si el servidor repite fragmentos tras una reconexión
+    const skip = streamingChapter.length - update.offset;
+    if (skip >= update.delta.length) {
+        return;
+    }
+    const text = skip > 0 ? update.delta.slice(skip) : update.delta;
+    streamingChapter.textNode.appendData(text);
+    streamingChapter.length += text.length;
+}
+
+// Reconexión: el servidor envía el texto del capítulo hasta el momento en lugar de sus fragmentos
+function restoreChapterStream(update) {
+    startChapterStream(update);
+    streamingChapter.textNode.appendData(update.content);
+    streamingChapter.length = update.content.length;
+    if (update.complete) {
+        finishChapterStream({ chapter_number: update.chapter_number, character_count: update.content.length });
+    }
+}
+
+function finishChapterStream(update) {
+    if (streamingChapter && streamingChapter.number === update.chapter_number) {
+        streamingChapter.complete = true;
+        document.getElementById('char-count').textContent = update.character_count;
     }
 }
 
 // Iniciar la conexión SSE
+// Se resuelve cuando la conexión está abierta (o falló), para no perder los primeros mensajes
 function startEventSource() {
     if (eventSource) {
         eventSource.close();
     }
     
     eventSource = new EventSource('/chat_updates');
+    const opened = new Promise(resolve => {
+        eventSource.addEventListener('open', resolve, {once: true});
+        eventSource.addEventListener('error', resolve, {once: true});
+    });
     
     eventSource.onmessage = function(event) {
         const data = JSON.parse(event.data);
@@ -93,6 +227,29 @@ function startEventSource() {
             return;
         }
         
+        if (data.type === 'chapter_start') {
+            startChapterStream(data);
+            return;
+        }
+        if (data.type === 'chapter_delta') {
+            appendChapterDelta(data);
+            return;
+        }
+        if (data.type === 'chapter_end') {
+            finishChapterStream(data);
+            return;
+        }
+        if (data.type === 'chapter_snapshot') {
+            restoreChapterStream(data);
+            return;
+        }
+        if (data.type === 'chapter_progress') {
+            // Capítulo largo narrado en segmentos: avance respecto de la extensión pedida
+            document.getElementById('char-count').textContent =
+                `${data.story_chars} / ${data.story_target_chars}`;
+            return;
+        }
+        
         if (data.chat_history) {
             renderAgentChat(data.chat_history);
         }
@@ -104,6 +261,7 @@ function startEventSource() {
             setTimeout(startEventSource, 1000);
         }
     };
+    return opened;
 }
 
 // Manejar la navegación de capítulos
@@ -122,46 +280,50 @@ async function handleNextChapter() {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                feedback: feedbackText
+                feedback: feedbackText,
+                since_message: lastMessageSeq
             })
         });
         
         const data = await response.json();
-        
-        if (data.is_complete) {
-            document.getElementById('chapter-navigation').classList.add('d-none');
-            document.getElementById('storyOutput').innerHTML += `
-                <div class="mt-4 text-center">
-                    <h4>¡Historia Completada!</h4>
-                    <p>Has llegado al final de todos los capítulos.</p>
-                    <p>Total de caracteres: ${data.total_chars}</p>
-                </div>`;
+        if (!response.ok || data.error) {
+            appendStoryNote('text-danger', [['p', `Error al cargar el siguiente capítulo: ${data.error || response.status}`]]);
             return;
         }
         
-        currentChapter = data.chapter_number;
-        document.getElementById('current-chapter').textContent = currentChapter;
+        // Mensajes que no llegaron por SSE (si los hay)
+        renderAgentChat(data.chat_history);
         
-        // Animar la transición del capítulo
-        const storyOutput = document.getElementById('storyOutput');
-        storyOutput.style.opacity = '0';
+        if (data.revised_chapter) {
+            replaceChapter(data.revised_chapter);
+        }
         
-        setTimeout(() => {
-            storyOutput.innerHTML = `
-                <h3>Capítulo ${data.chapter_number}: ${data.chapter_title}</h3>
-                ${data.content}
-            `;
-            storyOutput.style.transition = 'opacity 0.5s ease-in';
-            storyOutput.style.opacity = '1';
-        }, 300);
+        // El último capítulo llega junto con is_complete: se pinta antes de la nota final
+        if (data.content) {
+            currentChapter = data.chapter_number;
+            document.getElementById('current-chapter').textContent = currentChapter;
+            
+            // Si el capítulo ya se mostró en streaming no hace falta volver a pintarlo
+            if (!chapterWasStreamed(data.chapter_number)) {
+                renderChapter(data);
+            }
+            
+            document.getElementById('char-count').textContent = data.character_count;
+            document.getElementById('chapter-feedback-text').value = '';
+        }
         
-        document.getElementById('char-count').textContent = data.character_count;
-        document.getElementById('chapter-feedback-text').value = '';
+        if (data.is_complete) {
+            document.getElementById('chapter-navigation').classList.add('d-none');
+            appendStoryNote('mt-4 text-center', [
+                ['h4', '¡Historia Completada!'],
+                ['p', 'Has llegado al final de todos los capítulos.'],
+                ['p', `Total de caracteres: ${data.total_chars}`]
+            ]);
+        }
         
     } catch (error) {
         console.error('Error al cargar el siguiente capítulo:', error);
-        document.getElementById('storyOutput').innerHTML += `
-            <p class="text-danger">Error al cargar el siguiente capítulo: ${error}</p>`;
+        appendStoryNote('text-danger', [['p', `Error al cargar el siguiente capítulo: ${error}`]]);
     } finally {
         loadingElement.classList.add('d-none');
         nextChapterButton.disabled = false;
@@ -188,7 +350,9 @@ document.getElementById('storyForm').addEventListener('submit', async function(e
     const submitButton = this.querySelector('button[type="submit"]');
     
     loadingElement.classList.remove('d-none');
-    storyOutput.innerHTML = '';
+    storyOutput.replaceChildren();
+    streamingChapter = null;
+    lastMessageSeq = 0;
     document.getElementById('agentChat').innerHTML = `
         <p class="text-muted">Iniciando generación de historia...</p>
     `;
@@ -203,8 +367,8 @@ document.getElementById('storyForm').addEventListener('submit', async function(e
         .filter(name => name !== '');
     
     try {
-        // Iniciar la conexión SSE para actualizaciones en vivo
-        startEventSource();
+        // Iniciar la conexión SSE para actualizaciones en vivo: el chat llega solo por ahí
+        await startEventSource();
         
         const response = await fetch('/generate_story', {
             method: 'POST',
@@ -222,14 +386,10 @@ document.getElementById('storyForm').addEventListener('submit', async function(e
         const data = await response.json();
         
         if (response.ok) {
-            // Animar la aparición de la historia
-            storyOutput.style.opacity = '0';
-            storyOutput.textContent = data.final_story;
-            
-            requestAnimationFrame(() => {
-                storyOutput.style.transition = 'opacity 0.5s ease-in';
-                storyOutput.style.opacity = '1';
-            });
+            renderAgentChat(data.chat_history);
+            if (!chapterWasStreamed(data.chapter_number)) {
+                renderChapter(data);
+            }
             
             document.getElementById('char-count').textContent = data.total_chars;
             
@@ -241,10 +401,10 @@ document.getElementById('storyForm').addEventListener('submit', async function(e
                 document.getElementById('chapter-navigation').classList.remove('d-none');
             }
         } else {
-            storyOutput.innerHTML = `<p class="text-danger">Error: ${data.error}</p>`;
+            appendStoryNote('text-danger', [['p', `Error: ${data.error}`]]);
         }
     } catch (error) {
-        storyOutput.innerHTML = `<p class="text-danger">Error al conectar con el servidor: ${error}</p>`;
+        appendStoryNote('text-danger', [['p', `Error al conectar con el servidor: ${error}`]]);
     } finally {
         loadingElement.classList.add('d-none');
         submitButton.disabled = false;
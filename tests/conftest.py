@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Con `pytest` a secas la raíz del repo no está en sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
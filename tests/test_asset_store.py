@@ -0,0 +1,72 @@
+import asyncio
+
+from core.agents.asset_store import CHARACTER, LOCATION, AssetDraft, AssetStore
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+
+
+def test_draft_changes_reach_the_store_only_on_commit():
+    store = AssetStore()
+    store.put(LOCATION, "Cueva", "Oscura", chapter=1)
+    first = AssetDraft(store)
+    first.put(LOCATION, "Lago", "Helado", chapter=2)
+    first.touch(store.get(LOCATION, "cueva"), 2)
+    second = AssetDraft(store, [first])
+
+    # El borrador siguiente ve lo del anterior; el almacén todavía no
+    assert second.split(LOCATION, ["Lago", "Bosque"]) == (["Lago"], ["Bosque"])
+    assert store.get(LOCATION, "Lago") is None
+    assert store.get(LOCATION, "Cueva").chapters == [1]
+
+    first.commit()
+    assert store.get(LOCATION, "lago").description == "Helado"
+    assert store.get(LOCATION, "Cueva").chapters == [1, 2]
+
+
+def test_store_drops_least_recently_used_assets():
+    store = AssetStore(max_assets=2)
+    store.put(CHARACTER, "Ana", "Exploradora")
+    store.put(CHARACTER, "Luis", "Guía")
+    store.get(CHARACTER, "Ana")
+    store.put(CHARACTER, "Marta", "Farera")
+    assert store.get(CHARACTER, "Luis") is None
+    assert len(store) == 2
+
+
+def locations(store):
+    return {asset.name for asset in store._assets.values() if asset.kind == LOCATION}
+
+
+def test_speculative_chapter_assets_wait_until_it_is_delivered():
+    async def run():
+        orchestrator = StoryOrchestrator(FakeLLMBackend(chapters=3, chapter_words=80), prefetch_depth=1)
+        orchestrator.add_character_agent("Ana")
+        await orchestrator.generate_story("Una expedición a una cueva", 1500, "descriptivo", ["Ana"])
+        while not orchestrator._prefetcher.is_ready(2):
+            await asyncio.sleep(0.005)
+        # El capítulo 2 (Lugar 2 y Lugar 3) ya está precalculado, pero no entregado
+        before = locations(orchestrator.assets)
+        await orchestrator.get_next_chapter()
+        after = locations(orchestrator.assets)
+        orchestrator.close()
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert "Lugar 3" not in before
+    assert "Lugar 3" in after
+
+
+def test_discarded_speculative_chapter_leaves_the_store_unchanged():
+    async def run():
+        assets = AssetStore()
+        orchestrator = StoryOrchestrator(FakeLLMBackend(chapters=3, chapter_words=80), prefetch_depth=2,
+                                         asset_store=assets)
+        orchestrator.add_character_agent("Ana")
+        await orchestrator.generate_story("Una expedición a una cueva", 1500, "descriptivo", ["Ana"])
+        while not orchestrator._prefetcher.is_ready(3):
+            await asyncio.sleep(0.005)
+        orchestrator.reset_state()
+        orchestrator.close()
+        return locations(assets)
+
+    assert "Lugar 4" not in asyncio.run(run())
@@ -0,0 +1,114 @@
+import asyncio
+
+from core.services.chat_hub import ChatHub
+
+
+def message(n):
+    return {"chat_history": [{"content": f"mensaje {n}"}]}
+
+
+def test_every_subscriber_of_the_session_receives_each_event():
+    hub = ChatHub()
+    hub.open_session("a")
+    hub.open_session("b")
+    first, second, other = hub.subscribe("a"), hub.subscribe("a"), hub.subscribe("b")
+    hub.publish("a", message(1))
+    assert [e.data for e in first.get(timeout=0)] == [message(1)]
+    assert [e.data for e in second.get(timeout=0)] == [message(1)]
+    assert other.get(timeout=0) == []
+
+
+def test_reconnect_with_last_event_id_replays_only_missed_events():
+    hub = ChatHub()
+    hub.open_session("a")
+    ids = [hub.publish("a", message(n)) for n in range(5)]
+    subscription = hub.subscribe("a", last_event_id=ids[2])
+    assert [e.id for e in subscription.get(timeout=0)] == ids[3:]
+
+
+def test_replay_is_limited_to_the_buffer():
+    hub = ChatHub(buffer_size=3)
+    hub.open_session("a")
+    ids = [hub.publish("a", message(n)) for n in range(6)]
+    subscription = hub.subscribe("a", last_event_id=0)
+    assert [e.id for e in subscription.get(timeout=0)] == ids[-3:]
+
+
+def test_slow_subscriber_is_dropped_instead_of_buffering_forever():
+    hub = ChatHub(max_pending=2)
+    hub.open_session("a")
+    slow, fast = hub.subscribe("a"), hub.subscribe("a")
+    for n in range(3):
+        hub.publish("a", message(n))
+        fast.get(timeout=0)
+    assert slow.closed
+    assert not fast.closed
+    assert hub.subscriber_count("a") == 1
+
+
+def test_unknown_or_closed_sessions_keep_no_state():
+    hub = ChatHub()
+    assert hub.publish("desconocida", message(1)) is None
+    assert hub.subscribe("desconocida").closed
+    hub.open_session("a")
+    subscription = hub.subscribe("a")
+    hub.close_session("a")
+    assert subscription.closed
+    assert hub.publish("a", message(1)) is None
+
+
+def test_get_async_wakes_up_on_publish_from_another_thread():
+    hub = ChatHub()
+    hub.open_session("a")
+    subscription = hub.subscribe("a")
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        waiting = asyncio.create_task(subscription.get_async(timeout=5))
+        await asyncio.sleep(0.01)
+        await loop.run_in_executor(None, hub.publish, "a", message(1))
+        return await asyncio.wait_for(waiting, 1)
+
+    assert [e.data for e in asyncio.run(run())] == [message(1)]
+
+
+def stream_chapter(hub, session_id, number, parts, end=True):
+    hub.publish(session_id, {"type": "chapter_start", "chapter_number": number, "chapter_title": "Inicio"})
+    offset = 0
+    for part in parts:
+        hub.publish(session_id, {"type": "chapter_delta", "chapter_number": number, "offset": offset, "delta": part})
+        offset += len(part)
+    if end:
+        return hub.publish(session_id, {"type": "chapter_end", "chapter_number": number, "character_count": offset})
+
+
+def test_chapter_deltas_do_not_push_chat_out_of_the_buffer():
+    hub = ChatHub(buffer_size=4)
+    hub.open_session("a")
+    chat_id = hub.publish("a", message(1))
+    stream_chapter(hub, "a", 1, [f"parte {n} " for n in range(50)])
+    replayed = hub.subscribe("a", last_event_id=0).get(timeout=0)
+    assert chat_id in [e.id for e in replayed]
+    assert not any(e.data.get("type") == "chapter_delta" for e in replayed)
+
+
+def test_reconnect_mid_chapter_gets_a_snapshot_of_the_text_so_far():
+    hub = ChatHub()
+    hub.open_session("a")
+    stream_chapter(hub, "a", 2, ["Había ", "una ", "vez"], end=False)
+    replayed = hub.subscribe("a", last_event_id=1).get(timeout=0)
+    snapshot = replayed[-1].data
+    assert snapshot["type"] == "chapter_snapshot"
+    assert snapshot["content"] == "Había una vez"
+    assert snapshot["complete"] is False
+
+
+def test_no_snapshot_after_the_client_saw_the_chapter_end():
+    hub = ChatHub()
+    hub.open_session("a")
+    end_id = stream_chapter(hub, "a", 1, ["Había ", "una ", "vez"])
+    assert hub.subscribe("a", last_event_id=end_id).get(timeout=0) == []
+    # Quien se perdió el final recibe el capítulo completo
+    snapshot = hub.subscribe("a", last_event_id=end_id - 1).get(timeout=0)[-1].data
+    assert snapshot["complete"] is True
+    assert snapshot["content"] == "Había una vez"
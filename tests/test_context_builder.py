@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from core.agents.base_agent import StoryAgent
+from core.agents.context_builder import ContextBuilder
+from core.llm.backends import FakeLLMBackend
+from core.llm.tokens import count_tokens, truncate_to_tokens
+from core.models.data_models import ChapterOutline, Message
+
+START = datetime(2024, 5, 1, 12, 0)
+
+
+def agent(role="narrador", name="Narrador"):
+    return StoryAgent(name, role, FakeLLMBackend())
+
+
+def chat(count, words=40):
+    return [Message(agent_name=f"Agente{n}", content=f"mensaje {n} " + "palabra " * words,
+                    timestamp=START + timedelta(seconds=n)) for n in range(count)]
+
+
+def outline(number):
+    return ChapterOutline(number=number, title=f"Título {number}", summary=f"Resumen {number}",
+                          key_events=[f"Evento {number}"], characters_involved=[], locations=[])
+
+
+def history_tokens(messages):
+    # Sin el prompt de sistema del agente (el primero) ni el contexto actual (el último)
+    return sum(count_tokens(m["content"]) for m in messages[1:-1])
+
+
+def test_history_stays_within_the_role_budget():
+    builder = ContextBuilder(budgets={"narrador": 300})
+    messages = builder.build(agent(), "Escribe el capítulo", chat(30))
+    assert history_tokens(messages) <= 300
+    assert messages[-1] == {"role": "user", "content": "Escribe el capítulo"}
+
+
+def test_recent_messages_are_kept_in_chronological_order():
+    builder = ContextBuilder(budgets={"narrador": 2000}, recent_window=5)
+    messages = builder.build(agent(), "contexto", chat(10, words=5))
+    numbers = [int(m["content"].split("mensaje ")[1].split()[0]) for m in messages[1:-1]]
+    assert numbers == [5, 6, 7, 8, 9]
+
+
+def test_long_messages_are_truncated():
+    builder = ContextBuilder(budgets={"narrador": 2000}, max_message_tokens=50)
+    messages = builder.build(agent(), "contexto", chat(1, words=1000))
+    assert "[…]" in messages[1]["content"]
+    assert count_tokens(messages[1]["content"]) < 80
+
+
+def test_summaries_prefer_the_latest_chapters_when_they_do_not_fit():
+    builder = ContextBuilder(budgets={"narrador": 200}, summary_share=0.5)
+    for number in range(1, 8):
+        builder.update_chapter_summary(outline(number), "texto del capítulo " * 50)
+    summary = builder.build(agent(), "contexto", [])[1]["content"]
+    assert summary.startswith("Resumen de capítulos anteriores:")
+    assert "Capítulo 7:" in summary
+    assert "Capítulo 1:" not in summary
+    assert count_tokens(summary) <= 100
+
+
+def test_truncate_keeps_the_beginning_and_the_end():
+    text = "inicio " + "medio " * 500 + "final"
+    truncated = truncate_to_tokens(text, 20)
+    assert truncated.startswith("inicio")
+    assert truncated.endswith("final")
+    assert truncate_to_tokens("corto", 20) == "corto"
+    assert truncate_to_tokens(text, 0) == ""
@@ -0,0 +1,66 @@
+import asyncio
+
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+
+NAMES = ["Ana", "Luis"]
+
+
+async def started_story(prefetch_depth=0):
+    backend = FakeLLMBackend(chapters=3, chapter_words=80)
+    orchestrator = StoryOrchestrator(backend, prefetch_depth=prefetch_depth)
+    for name in NAMES:
+        orchestrator.add_character_agent(name)
+    await orchestrator.generate_story("Una expedición a una cueva", 1500, "descriptivo", NAMES)
+    return orchestrator, backend
+
+
+def test_feedback_on_a_location_reruns_only_geografo_and_narrador():
+    async def run():
+        orchestrator, backend = await started_story()
+        before_text = orchestrator.story_state.chapters[0].content
+        calls = backend.calls
+        revision = await orchestrator.process_chapter_feedback("Describe mejor el Lugar 1")
+        calls = backend.calls - calls
+        orchestrator.close()
+        return revision, calls, before_text
+
+    revision, calls, before_text = asyncio.run(run())
+    assert revision["rerun_agents"] == ["geografo", "narrador"]
+    assert set(revision["reused_agents"]) == {"personaje_ana", "personaje_luis"}
+    # Geógrafo y Narrador, sin volver a llamar a los personajes
+    assert calls == 2
+    assert revision["revised_chapter"]["chapter_number"] == 1
+    assert revision["revised_chapter"]["content"] != before_text
+
+
+def test_feedback_on_a_character_is_passed_to_later_chapters_with_them():
+    async def run():
+        orchestrator, _ = await started_story()
+        revision = await orchestrator.process_chapter_feedback("Ana debería dudar más")
+        guidance = orchestrator._feedback_guidance
+        orchestrator.close()
+        return revision, guidance
+
+    revision, guidance = asyncio.run(run())
+    assert "personaje_ana" in revision["rerun_agents"]
+    assert "personaje_luis" in revision["reused_agents"]
+    assert revision["affected_chapters"] == [2, 3]
+    assert guidance[2]["personaje_ana"] == ["Ana debería dudar más"]
+
+
+def test_revision_discards_prefetch_even_for_unaffected_chapters():
+    async def run():
+        orchestrator, _ = await started_story(prefetch_depth=1)
+        while not orchestrator._prefetcher.is_ready(2):
+            await asyncio.sleep(0.005)
+        feedback = "Cambia el evento principal"
+        revision = await orchestrator.process_chapter_feedback(feedback)
+        result = await orchestrator.get_next_chapter(feedback, feedback_applied=True)
+        orchestrator.close()
+        return revision, result
+
+    revision, result = asyncio.run(run())
+    # El capítulo 2 no depende del feedback, pero se había escrito a partir del texto anterior
+    assert revision["affected_chapters"] == []
+    assert result["prefetched"] is False
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime
+
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+from core.models import Chapter, ChapterList, ChatHistory, Message, TextStore
+
+LONG_TEXT = "la historia avanza entre sombras y revelaciones " * 40
+
+
+def message(content, agent="Narrador"):
+    return Message(agent_name=agent, content=content, timestamp=datetime(2024, 5, 1, 12, 30, 15, 123456),
+                   speaking_to="todos")
+
+
+def test_text_store_dedupes_and_compresses_long_texts():
+    texts = TextStore(compress_min_chars=512)
+    first = texts.put(LONG_TEXT)
+    assert texts.put(LONG_TEXT) == first
+    assert len(texts) == 1
+    assert texts.get(first) == LONG_TEXT
+    assert texts.resident_bytes() < len(LONG_TEXT.encode("utf-8")) / 4
+    short = texts.put("hola, ¿qué tal?")
+    assert texts.get(short) == "hola, ¿qué tal?"
+
+
+def test_spilled_texts_are_read_back_from_the_file(tmp_path):
+    texts = TextStore(spill_dir=str(tmp_path))
+    ids = [texts.put(f"{LONG_TEXT} {n}") for n in range(5)]
+    assert texts.resident_bytes() == 0
+    assert [texts.get(text_id) for text_id in ids] == [f"{LONG_TEXT} {n}" for n in range(5)]
+    # Lo escrito después del primer mapeo también se lee
+    late = texts.put("añadido al final")
+    assert texts.get(late) == "añadido al final"
+    texts.close()
+
+
+def test_chat_and_chapters_share_one_record_per_text():
+    texts = TextStore()
+    chat = ChatHistory(texts)
+    chapters = ChapterList(texts)
+    chat.append(message(LONG_TEXT))
+    chapters.append(Chapter(number=1, title="Inicio", content=LONG_TEXT, character_count=len(LONG_TEXT)))
+    assert len(texts) == 1
+    assert chat[0] == message(LONG_TEXT)
+    assert chapters[0].content == LONG_TEXT
+
+
+def test_history_copy_keeps_new_texts_out_of_the_base_store():
+    texts = TextStore()
+    chat = ChatHistory(texts)
+    chat.append(message("compartido"))
+    private = chat.copy()
+    private.append(message("solo en la copia"))
+    private.append(message("compartido"))
+
+    assert len(texts) == 1
+    assert len(chat) == 1
+    assert [m.content for m in private] == ["compartido", "solo en la copia", "compartido"]
+    # Una copia de la copia sigue leyendo los textos privados
+    nested = private.copy()
+    assert nested[1].content == "solo en la copia"
+
+
+def test_discarded_prefetch_leaves_no_texts_behind():
+    async def run():
+        orchestrator = StoryOrchestrator(FakeLLMBackend(chapters=4, chapter_words=80), prefetch_depth=2)
+        orchestrator.add_character_agent("Ana")
+        await orchestrator.generate_story("Una expedición a una cueva", 2000, "descriptivo", ["Ana"])
+        # Un feedback descarta los capítulos ya precalculados
+        await orchestrator.get_next_chapter(feedback="Más diálogo")
+        referenced = {record.text_id for record in orchestrator.chat_history._records}
+        referenced |= {record.text_id for record in orchestrator.story_state.chapters._records}
+        stored = len(orchestrator.texts)
+        orchestrator.close()
+        return referenced, stored
+
+    referenced, stored = asyncio.run(run())
+    assert all(text_id >= 0 for text_id in referenced)
+    assert stored == len(referenced)
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from core.agents.base_agent import StoryAgent
+from core.agents.model_router import LatencyTracker, ModelRoute, ModelRouter
+from core.llm.backends import FakeLLMBackend
+from core.services.metrics import Metrics, StoryTrace
+
+ROUTES = {
+    "narrador": ModelRoute("lento", fallback_model="rapido", latency_slo=2.0, completion_slo=20.0)
+}
+
+
+def record(router, model, seconds, samples=5, stream=False):
+    for _ in range(samples):
+        router.record_latency(model, seconds, stream=stream)
+
+
+def test_streaming_slo_breach_switches_to_fallback():
+    metrics = Metrics()
+    router = ModelRouter(ROUTES, LatencyTracker(min_samples=5), metrics)
+    record(router, "lento", 3.0, stream=True)
+    assert router.select("narrador", stream=True)[0] == "rapido"
+    assert metrics.counter_value("model_fallback_total", role="narrador", model="lento") == 1
+
+
+def test_slow_completions_do_not_trip_the_first_token_slo():
+    router = ModelRouter(ROUTES, LatencyTracker(min_samples=5))
+    # Una respuesta completa de 10 s está dentro de completion_slo aunque supere latency_slo
+    record(router, "lento", 10.0)
+    assert router.select("narrador", stream=True)[0] == "lento"
+    assert router.select("narrador")[0] == "lento"
+    record(router, "lento", 30.0)
+    assert router.select("narrador")[0] == "rapido"
+    assert router.select("narrador", stream=True)[0] == "lento"
+
+
+def test_needs_min_samples_and_uses_p90():
+    router = ModelRouter(ROUTES, LatencyTracker(min_samples=5))
+    record(router, "lento", 3.0, samples=4, stream=True)
+    assert router.select("narrador", stream=True)[0] == "lento"
+    # Un solo valor alto entre diez no mueve el p90
+    router = ModelRouter(ROUTES, LatencyTracker(min_samples=5))
+    record(router, "lento", 1.0, samples=9, stream=True)
+    record(router, "lento", 9.0, samples=1, stream=True)
+    assert router.select("narrador", stream=True)[0] == "lento"
+
+
+def test_primary_model_is_retried_after_cooldown():
+    router = ModelRouter(ROUTES, LatencyTracker(min_samples=5, cooldown=0.05))
+    record(router, "lento", 3.0, stream=True)
+    assert router.select("narrador", stream=True)[0] == "rapido"
+    time.sleep(0.06)
+    assert router.select("narrador", stream=True)[0] == "lento"
+
+
+def test_story_views_share_latencies_but_not_overrides():
+    router = ModelRouter(ROUTES, LatencyTracker(min_samples=5))
+    story = router.for_story()
+    story.set_overrides({"narrador": {"temperature": 0.2}})
+    record(router, "lento", 3.0, stream=True)
+    assert story.select("narrador", stream=True) == ("rapido", {"temperature": 0.2})
+    assert router.select("narrador", stream=True) == ("rapido", {})
+
+
+def test_default_routes_do_not_cap_any_role():
+    router = ModelRouter()
+    for role in ("narrador", "planeador", "arbitro", "geografo", "personaje"):
+        assert "max_tokens" not in router.select(role)[1]
+
+
+def test_truncated_responses_are_counted():
+    router = ModelRouter()
+    router.set_overrides({"geografo": {"max_tokens": 10}})
+    trace = StoryTrace()
+    agent = StoryAgent("Geógrafo", "geografo", FakeLLMBackend(contribution_words=60), trace=trace, router=router)
+    asyncio.run(agent.generate_response("Describe el bosque", []))
+    assert trace.counters["agent_truncated_total;model=gpt-4o-mini;role=geografo"] == 1
+
+
+def test_overrides_for_unknown_roles_or_fields_are_rejected():
+    router = ModelRouter()
+    with pytest.raises(ValueError, match="narador"):
+        router.set_overrides({"narador": {"model": "gpt-4o-mini"}})
+    with pytest.raises(ValueError, match="modelo"):
+        router.validate_overrides({"narrador": {"modelo": "gpt-4o-mini"}})
+    router.set_overrides({"personaje": {"temperature": 0.5}})
+    assert router.select("personaje")[1]["temperature"] == 0.5
@@ -0,0 +1,108 @@
+import asyncio
+
+from core.agents.orchestrator import StoryOrchestrator
+from core.agents.outline_parser import OutlineParser
+from core.llm.backends import FakeLLMBackend
+
+OUTLINE = """Este es el esquema:
+
+Capítulo 1: La cueva
+Resumen: Ana y Luis entran en la cueva.
+Siguen el río subterráneo.
+Eventos clave:
+- Encuentran un mapa
+- Se apaga la linterna
+Personajes involucrados:
+- Ana
+- Luis
+Ubicaciones:
+- Cueva del Eco
+
+Capítulo 2: El lago
+Resumen: Llegan a un lago helado.
+Eventos clave:
+- Cruzan el lago
+Personajes involucrados:
+- Ana
+Ubicaciones:
+- Lago helado
+- Orilla norte
+
+Capítulo 3: La salida
+Resumen: Encuentran la salida.
+"""
+
+
+def parse_in_chunks(text, size):
+    parser = OutlineParser()
+    chapters = []
+    for start in range(0, len(text), size):
+        chapters.extend(parser.feed(text[start:start + size]))
+    return chapters + parser.close()
+
+
+def test_chunked_feed_matches_whole_text():
+    whole = parse_in_chunks(OUTLINE, len(OUTLINE))
+    for size in (1, 3, 17, 64):
+        assert parse_in_chunks(OUTLINE, size) == whole
+    assert [chapter.number for chapter in whole] == [1, 2, 3]
+
+
+def test_chapter_is_emitted_as_soon_as_the_next_one_starts():
+    parser = OutlineParser()
+    first_block = OUTLINE[:OUTLINE.index("Capítulo 2")]
+    assert parser.feed(first_block) == []
+    emitted = parser.feed("Capítulo 2: El lago\n")
+    assert [chapter.title for chapter in emitted] == ["La cueva"]
+    chapter = emitted[0]
+    assert chapter.summary == "Ana y Luis entran en la cueva. Siguen el río subterráneo."
+    assert chapter.key_events == ["Encuentran un mapa", "Se apaga la linterna"]
+    assert chapter.characters_involved == ["Ana", "Luis"]
+    assert chapter.locations == ["Cueva del Eco"]
+
+
+def test_close_emits_the_last_chapter_with_defaults_once():
+    parser = OutlineParser()
+    parser.feed(OUTLINE)
+    last = parser.close()
+    assert [chapter.title for chapter in last] == ["La salida"]
+    assert last[0].locations == ["Ubicación principal"]
+    assert last[0].key_events == ["Desarrollo de la trama principal"]
+    assert parser.close() == []
+
+
+def test_text_before_the_first_chapter_is_ignored():
+    parser = OutlineParser()
+    assert parser.feed("Introducción sin capítulo\n- suelto\n") == []
+    assert parser.close() == []
+
+
+def test_first_chapter_starts_while_the_planner_is_still_writing():
+    class LoggingBackend(FakeLLMBackend):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.log = []
+
+        async def complete(self, model, messages, **params):
+            self.log.append("llamada")
+            return await super().complete(model, messages, **params)
+
+        async def stream(self, model, messages, **params):
+            outline = "esquema detallado de capítulos" in messages[-1]["content"]
+            if not outline:
+                self.log.append("llamada")
+            async for delta in super().stream(model, messages, **params):
+                yield delta
+            if outline:
+                self.log.append("fin del esquema")
+
+    backend = LoggingBackend(chapters=4, chapter_words=40, tokens_per_second=1500)
+
+    async def run():
+        orchestrator = StoryOrchestrator(backend, prefetch_depth=0)
+        orchestrator.add_character_agent("Ana")
+        await orchestrator.generate_story("Una expedición a una cueva", 1000, "descriptivo", ["Ana"])
+        orchestrator.close()
+
+    asyncio.run(run())
+    assert "llamada" in backend.log[:backend.log.index("fin del esquema")]
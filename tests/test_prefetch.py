@@ -0,0 +1,91 @@
+import asyncio
+
+from core.agents.orchestrator import StoryOrchestrator
+from core.agents.prefetch import ChapterPrefetcher
+from core.llm.backends import FakeLLMBackend
+from core.models.data_models import Chapter, ChapterOutline
+
+NAMES = ["Ana", "Luis"]
+
+
+def new_orchestrator(prefetch_depth, chapters=3):
+    orchestrator = StoryOrchestrator(FakeLLMBackend(chapters=chapters, chapter_words=80),
+                                     prefetch_depth=prefetch_depth)
+    for name in NAMES:
+        orchestrator.add_character_agent(name)
+    return orchestrator
+
+
+async def wait_ready(orchestrator, chapter_number):
+    while not orchestrator._prefetcher.is_ready(chapter_number):
+        await asyncio.sleep(0.005)
+
+
+def test_prefetched_story_matches_serial_story():
+    async def run(depth):
+        orchestrator = new_orchestrator(depth)
+        await orchestrator.generate_story("Una expedición a una cueva", 1500, "descriptivo", NAMES)
+        results = []
+        while True:
+            result = await orchestrator.get_next_chapter()
+            results.append(result.get("prefetched"))
+            if result["is_complete"]:
+                break
+        orchestrator.close()
+        chapters = [c.content for c in orchestrator.story_state.chapters]
+        return chapters, [m.content for m in orchestrator.chat_history], results
+
+    serial_chapters, serial_chat, _ = asyncio.run(run(0))
+    chapters, chat, prefetched = asyncio.run(run(2))
+    assert chapters == serial_chapters
+    assert chat == serial_chat
+    assert all(prefetched)
+
+
+def test_speculative_messages_are_published_only_when_taken():
+    async def run():
+        orchestrator = new_orchestrator(1)
+        await orchestrator.generate_story("Una expedición a una cueva", 1500, "descriptivo", NAMES)
+        await wait_ready(orchestrator, 2)
+        before = len(orchestrator.chat_history)
+        result = await orchestrator.get_next_chapter()
+        orchestrator.close()
+        return before, len(orchestrator.chat_history), result
+
+    before, after, result = asyncio.run(run())
+    assert result["prefetched"]
+    assert after > before
+
+
+def test_feedback_discards_prefetched_chapters():
+    async def run():
+        orchestrator = new_orchestrator(2)
+        await orchestrator.generate_story("Una expedición a una cueva", 1500, "descriptivo", NAMES)
+        await wait_ready(orchestrator, 3)
+        result = await orchestrator.get_next_chapter(feedback="Más diálogo")
+        orchestrator.close()
+        return result
+
+    assert asyncio.run(run())["prefetched"] is False
+
+
+def test_invalidate_from_chapter_keeps_earlier_chapters():
+    async def develop(outline, history):
+        await asyncio.sleep(0.01)
+        history.append(outline.title)
+        return Chapter(number=outline.number, title=outline.title, content=outline.title,
+                       character_count=len(outline.title))
+
+    async def run():
+        prefetcher = ChapterPrefetcher(develop, depth=2)
+        outlines = [ChapterOutline(number=n, title=f"Capítulo {n}", summary="", key_events=[],
+                                   characters_involved=[], locations=[]) for n in (2, 3)]
+        prefetcher.schedule(outlines, [])
+        prefetcher.invalidate(from_chapter=3)
+        taken = await prefetcher.take(2)
+        return taken, await prefetcher.take(3)
+
+    (chapter, messages), discarded = asyncio.run(run())
+    assert chapter.number == 2
+    assert messages == ["Capítulo 2"]
+    assert discarded is None
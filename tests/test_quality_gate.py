@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from core.agents.orchestrator import StoryOrchestrator, _parse_score
+from core.llm.backends import FakeLLMBackend
+
+
+class SlowAlternativesBackend(FakeLLMBackend):
+    """Las versiones alternativas del Narrador tardan mucho más que la primera."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.finished_alternatives = 0
+
+    async def complete(self, model, messages, **params):
+        if "Propuesta alternativa" in messages[-1]["content"]:
+            await asyncio.sleep(2.0)
+            self.finished_alternatives += 1
+        return await super().complete(model, messages, **params)
+
+
+async def story(backend, threshold):
+    orchestrator = StoryOrchestrator(backend, prefetch_depth=0, narrator_candidates=3,
+                                     quality_threshold=threshold)
+    orchestrator.add_character_agent("Ana")
+    await orchestrator.generate_story("Una expedición a una cueva", 1000, "descriptivo", ["Ana"])
+    orchestrator.close()
+    return orchestrator
+
+
+def test_first_candidate_over_the_threshold_cancels_the_rest():
+    backend = SlowAlternativesBackend(chapters=2, chapter_words=60)
+    start = time.perf_counter()
+    orchestrator = asyncio.run(story(backend, threshold=0))
+    counters = orchestrator.trace.counters
+    assert time.perf_counter() - start < 1.5
+    assert backend.finished_alternatives == 0
+    assert counters["narrator_candidates_cancelled_total"] == 2
+    assert counters["quality_gate_total;result=accepted"] == 1
+
+
+def test_best_scored_candidate_is_used_when_none_reaches_the_threshold():
+    backend = FakeLLMBackend(chapters=2, chapter_words=60)
+    orchestrator = asyncio.run(story(backend, threshold=11))
+    counters = orchestrator.trace.counters
+    assert counters["quality_gate_total;result=best_effort"] == 1
+    assert counters["narrator_candidates_cancelled_total"] == 0
+    # Las otras dos versiones terminaron y no se usaron
+    assert counters["narrator_wasted_tokens_total"] > 0
+    assert orchestrator.story_state.chapters[0].content
+
+
+def test_parse_score():
+    assert _parse_score("Puntuación: 8\nBien escrito.") == 8.0
+    assert _parse_score("**Puntuacion**: 7,5") == 7.5
+    assert _parse_score("Le doy un 9 de 10") == 0.0
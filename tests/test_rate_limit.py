@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from core.llm.backends import FakeLLMBackend
+from core.llm.rate_limit import LLMDispatchError, RateLimitedBackend
+from core.services.metrics import Metrics
+
+
+def prompt(n):
+    return [{"role": "user", "content": f"Pregunta {n}"}]
+
+
+def test_429s_are_retried_until_every_call_succeeds():
+    fake = FakeLLMBackend(requests_per_minute=600)  # 10 por segundo
+    metrics = Metrics()
+    backend = RateLimitedBackend(fake, base_delay=0.05, deadline=10.0, metrics=metrics)
+
+    async def run():
+        return await asyncio.gather(*(backend.complete("gpt-4o-mini", prompt(n)) for n in range(14)))
+
+    completions = asyncio.run(run())
+    assert len(completions) == 14
+    assert all(completion.content for completion in completions)
+    assert fake.rate_limited_calls > 0
+    assert metrics.counter_value("llm_retries_total", reason="RateLimitError") == fake.rate_limited_calls
+
+
+def test_429_halves_the_request_rate_learned_from_headers():
+    fake = FakeLLMBackend(requests_per_minute=600)
+    backend = RateLimitedBackend(fake, base_delay=0.05, deadline=10.0)
+
+    async def run():
+        await asyncio.gather(*(backend.complete("gpt-4o-mini", prompt(n)) for n in range(14)))
+
+    asyncio.run(run())
+    # Las cabeceras fijan el objetivo; tras el 429 el cubo baja y se recupera de a poco
+    assert backend._request_limit == 600
+    assert backend.requests.limited
+    assert backend.requests.per_minute < 600
+
+
+def test_gives_up_after_max_retries_with_retry_after():
+    fake = FakeLLMBackend(requests_per_minute=60)  # 1 por segundo
+    backend = RateLimitedBackend(fake, max_retries=0, deadline=10.0)
+
+    async def run():
+        # Antes de conocer el límite las dos llegan al proveedor y una recibe un 429
+        await asyncio.gather(backend.complete("gpt-4o-mini", prompt(0)),
+                             backend.complete("gpt-4o-mini", prompt(1)))
+
+    with pytest.raises(LLMDispatchError) as error:
+        asyncio.run(run())
+    assert error.value.retry_after is not None
+    assert fake.rate_limited_calls == 1
+
+
+def test_identical_calls_in_flight_are_coalesced():
+    fake = FakeLLMBackend(latency=0.05)
+    metrics = Metrics()
+    backend = RateLimitedBackend(fake, metrics=metrics)
+
+    async def run():
+        return await asyncio.gather(*(backend.complete("gpt-4o-mini", prompt(0)) for _ in range(5)))
+
+    completions = asyncio.run(run())
+    assert fake.calls == 1
+    assert len({completion.content for completion in completions}) == 1
+    assert metrics.counter_value("llm_coalesced_total") == 4
+
+
+async def collect(backend, **params):
+    return ''.join([delta async for delta in backend.stream("gpt-4o-mini", prompt(0), **params)])
+
+
+def test_stream_still_producing_text_outlives_the_call_deadline():
+    # ~80 tokens a 200 tokens/s: unos 0.4 s de texto con pausas cortas entre fragmentos
+    fake = FakeLLMBackend(tokens_per_second=200, contribution_words=60)
+    backend = RateLimitedBackend(fake, deadline=0.15, attempt_timeout=0.1)
+    text = asyncio.run(collect(backend))
+    assert len(text.split()) > 60
+
+
+def test_stream_without_first_fragment_hits_the_deadline():
+    fake = FakeLLMBackend(latency=0.5)
+    backend = RateLimitedBackend(fake, deadline=0.2, attempt_timeout=0.1, base_delay=0.01)
+    with pytest.raises(LLMDispatchError):
+        asyncio.run(collect(backend))
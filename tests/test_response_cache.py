@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+from core.llm.cache import CacheMissError, ResponseCache, make_cache_key
+
+
+def test_key_depends_on_content_not_parameter_order():
+    messages = [{"role": "user", "content": "Hola"}]
+    assert make_cache_key("m", messages, temperature=0.5, max_tokens=10) == \
+        make_cache_key("m", messages, max_tokens=10, temperature=0.5)
+    assert make_cache_key("m", messages) != make_cache_key("otro", messages)
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    cache = ResponseCache(max_memory_bytes=10)
+    cache.put("a", "12345")
+    cache.put("b", "12345")
+    assert cache.get("a") == "12345"
+    cache.put("c", "12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345"
+    assert cache.stats.evictions == 1
+
+
+def test_disk_tier_survives_restart_and_promotes_to_memory(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(disk_path=path)
+    cache.put("clave", "respuesta")
+    cache.close()
+
+    reopened = ResponseCache(disk_path=path)
+    assert reopened.get("clave") == "respuesta"
+    assert reopened.stats.disk_hits == 1
+    assert reopened.get("clave") == "respuesta"
+    assert reopened.stats.memory_hits == 1
+    reopened.close()
+
+
+def test_disk_tier_evicts_least_recently_accessed(tmp_path):
+    cache = ResponseCache(max_memory_bytes=0, disk_path=str(tmp_path / "cache.sqlite"), max_disk_bytes=10)
+    cache.put("a", "12345")
+    time.sleep(0.01)
+    cache.put("b", "12345")
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", "12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345"
+    cache.close()
+
+
+def test_replay_mode_raises_on_miss():
+    cache = ResponseCache(replay=True)
+    cache.put("conocida", "texto")
+    assert cache.get("conocida") == "texto"
+    with pytest.raises(CacheMissError):
+        cache.get("nueva")
+
+
+def test_repeated_story_is_served_from_the_cache():
+    cache = ResponseCache()
+
+    async def run():
+        backend = FakeLLMBackend(chapters=2, chapter_words=80)
+        orchestrator = StoryOrchestrator(backend, prefetch_depth=0, cache=cache)
+        orchestrator.add_character_agent("Ana")
+        await orchestrator.generate_story("Una expedición a una cueva", 1000, "descriptivo", ["Ana"])
+        orchestrator.close()
+        return backend.calls, orchestrator.story_state.chapters[0].content
+
+    first_calls, first_chapter = asyncio.run(run())
+    second_calls, second_chapter = asyncio.run(run())
+    assert first_calls > 0
+    assert second_calls == 0
+    assert second_chapter == first_chapter
@@ -0,0 +1,50 @@
+import asyncio
+import math
+
+from core.agents.orchestrator import SEGMENT_SEPARATOR, StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+
+
+async def story(segment_chars, character_count, max_segments=12, stream_callback=None):
+    orchestrator = StoryOrchestrator(FakeLLMBackend(chapters=2), prefetch_depth=0,
+                                     segment_chars=segment_chars, max_segments=max_segments)
+    if stream_callback:
+        orchestrator.set_stream_callback(stream_callback)
+    orchestrator.add_character_agent("Ana")
+    await orchestrator.generate_story("Una expedición a una cueva", character_count, "descriptivo", ["Ana"])
+    await orchestrator.get_next_chapter()
+    orchestrator.close()
+    return orchestrator
+
+
+def test_long_chapter_is_narrated_in_segments_of_the_requested_size():
+    orchestrator = asyncio.run(story(segment_chars=500, character_count=4000))
+    # Con el esquema completo cada capítulo apunta a 4000 / 2 caracteres
+    chapter = orchestrator.story_state.chapters[1]
+    segments = chapter.content.split(SEGMENT_SEPARATOR)
+    assert len(segments) == math.ceil(2000 / 500)
+    assert all(segment.startswith("Capítulo") for segment in segments)
+    # El Narrador respeta ~500 caracteres por segmento (~6 por palabra)
+    assert all(abs(len(segment.split()) - 500 // 6) <= 2 for segment in segments)
+
+
+def test_segment_count_is_capped():
+    orchestrator = asyncio.run(story(segment_chars=100, character_count=4000, max_segments=3))
+    assert len(orchestrator.story_state.chapters[1].content.split(SEGMENT_SEPARATOR)) == 3
+
+
+def test_short_chapter_is_narrated_at_once():
+    orchestrator = asyncio.run(story(segment_chars=5000, character_count=4000))
+    assert SEGMENT_SEPARATOR not in orchestrator.story_state.chapters[1].content
+
+
+def test_streamed_segments_arrive_in_order_and_report_progress():
+    events = []
+    orchestrator = asyncio.run(story(segment_chars=500, character_count=4000, stream_callback=events.append))
+    chapter = orchestrator.story_state.chapters[1]
+    streamed = "".join(e["delta"] for e in events
+                       if e["type"] == "chapter_delta" and e["chapter_number"] == chapter.number)
+    assert streamed == chapter.content
+    progress = [e for e in events if e["type"] == "chapter_progress" and e["chapter_number"] == chapter.number]
+    assert progress[-1]["segments_done"] == progress[-1]["segments"] == 4
+    assert progress[-1]["chars"] <= len(chapter.content)
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from core.services.session_registry import SessionRegistry
+
+
+class SizedOrchestrator:
+    def __init__(self, size=100):
+        self.size = size
+        self.estimates = 0
+
+    def estimate_memory_bytes(self):
+        self.estimates += 1
+        return self.size
+
+
+def test_evicts_least_recently_used_over_max_sessions():
+    evicted = []
+    registry = SessionRegistry(SizedOrchestrator, max_sessions=2, on_evict=lambda s: evicted.append(s.session_id))
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")
+    assert evicted == ["b"]
+    assert "a" in registry and "c" in registry
+
+
+def test_session_with_request_in_flight_is_not_evicted():
+    evicted = []
+    registry = SessionRegistry(SizedOrchestrator, max_sessions=1, ttl_seconds=0.05,
+                               on_evict=lambda s: evicted.append(s.session_id))
+
+    async def run():
+        busy = registry.get("a")
+        async with busy.lock:
+            registry.get("b")
+            assert evicted == []
+            time.sleep(0.06)
+            # Ni el TTL ni el tope expulsan la sesión mientras su petición sigue en curso
+            registry.enforce_limits(keep="b")
+            assert "a" in registry
+        registry.enforce_limits()
+        assert "a" not in registry
+
+    asyncio.run(run())
+    assert "a" in evicted
+
+
+def test_memory_limit_estimates_each_session_once_per_pass():
+    registry = SessionRegistry(SizedOrchestrator, max_sessions=100, max_memory_bytes=250)
+    sessions = [registry.get(name) for name in ("a", "b", "c", "d")]
+    assert len(registry) == 2
+    estimates = [session.orchestrator.estimates for session in sessions]
+    registry.enforce_limits()
+    after = [session.orchestrator.estimates for session in sessions]
+    assert [b - a for a, b in zip(estimates, after)][2:] == [1, 1]
@@ -0,0 +1,116 @@
+import asyncio
+import glob
+import json
+import os
+
+import pytest
+
+from batch_generate import BatchRunner
+from core.llm.backends import FakeLLMBackend
+from core.llm import LLMDispatchError
+from core.llm.batch import StagedBatchBackend, fulfill_batch
+from core.services.story_store import StoryStore
+
+SPECS = [
+    {"id": "cueva", "idea": "Una expedición a una cueva", "character_names": ["Ana", "Luis"], "length": 1500},
+    {"id": "faro", "idea": "El último farero", "character_names": ["Marta"], "length": 1500},
+]
+
+
+def run_stage(tmp_path, batch_dir, output, fulfill=None):
+    staging = StagedBatchBackend()
+    runner = BatchRunner(staging, StoryStore(str(tmp_path / "state")), str(output),
+                         max_stories=len(SPECS), prefetch_depth=0, resume=False)
+    try:
+        return asyncio.run(runner.run_staged(SPECS, staging, str(batch_dir), fulfill))
+    finally:
+        runner.store.close()
+
+
+def chapters_by_story(output):
+    with open(output, encoding="utf-8") as source:
+        results = [json.loads(line) for line in source]
+    assert all(result["status"] == "ok" for result in results)
+    return {result["id"]: [chapter["content"] for chapter in result["chapters"]] for result in results}
+
+
+def test_rerunning_stage_by_stage_matches_in_process_run(tmp_path):
+    in_process = tmp_path / "in_process.jsonl"
+    assert run_stage(tmp_path, tmp_path / "lotes-a", in_process, FakeLLMBackend(chapters=2)) is None
+
+    staged = tmp_path / "staged.jsonl"
+    batch_dir = tmp_path / "lotes-b"
+    stages = 0
+    while True:
+        requests_path = run_stage(tmp_path, batch_dir, staged)
+        if requests_path is None:
+            break
+        stages += 1
+        assert stages < 20
+        # El proveedor resuelve el lote entre ejecuciones
+        results_path = requests_path.replace("requests-", "results-")
+        asyncio.run(fulfill_batch(requests_path, results_path, FakeLLMBackend(chapters=2)))
+
+    # Esquema, fan-out y Narrador de cada capítulo: más de una etapa
+    assert stages > 2
+    assert chapters_by_story(staged) == chapters_by_story(in_process)
+    assert len(glob.glob(os.path.join(batch_dir, "results-*.jsonl"))) == stages
+
+
+def test_each_stage_holds_only_unresolved_unique_requests(tmp_path):
+    batch_dir = tmp_path / "lotes"
+    output = tmp_path / "salida.jsonl"
+    seen = set()
+    for _ in range(3):
+        requests_path = run_stage(tmp_path, batch_dir, output)
+        with open(requests_path, encoding="utf-8") as source:
+            ids = [json.loads(line)["custom_id"] for line in source]
+        assert ids
+        assert len(ids) == len(set(ids))
+        # Lo ya resuelto en etapas anteriores no se vuelve a pedir
+        assert not seen & set(ids)
+        seen.update(ids)
+        asyncio.run(fulfill_batch(requests_path, requests_path.replace("requests-", "results-"),
+                                  FakeLLMBackend(chapters=2)))
+
+
+def test_failed_batch_line_is_requested_again_next_stage(tmp_path):
+    batch_dir = tmp_path / "lotes"
+    output = tmp_path / "salida.jsonl"
+    requests_path = run_stage(tmp_path, batch_dir, output)
+    with open(requests_path, encoding="utf-8") as source:
+        requests = [json.loads(line) for line in source]
+    # Cada historia pide primero su propio esquema
+    assert len(requests) == len(SPECS)
+    failed, ok = requests
+    results_path = requests_path.replace("requests-", "results-")
+    with open(requests_path, "w", encoding="utf-8") as rewritten:
+        rewritten.write(json.dumps(ok) + "\n")
+    asyncio.run(fulfill_batch(requests_path, results_path, FakeLLMBackend(chapters=2)))
+    with open(results_path, "a", encoding="utf-8") as results:
+        results.write(json.dumps({"custom_id": failed["custom_id"], "response": {"status_code": 500, "body": {}},
+                                  "error": {"message": "fallo simulado"}}) + "\n")
+
+    next_requests = run_stage(tmp_path, batch_dir, output)
+    with open(next_requests, encoding="utf-8") as source:
+        ids = {json.loads(line)["custom_id"] for line in source}
+    assert failed["custom_id"] in ids
+    assert ok["custom_id"] not in ids
+
+
+# El proveedor puede devolver el error como objeto o como texto
+@pytest.mark.parametrize("error", [{"message": "fallo simulado"}, "fallo simulado"])
+def test_failed_result_fails_the_waiting_call(tmp_path, error):
+    async def scenario():
+        staging = StagedBatchBackend()
+        call = asyncio.ensure_future(staging.complete("m", [{"role": "user", "content": "hola"}]))
+        await asyncio.sleep(0)
+        (custom_id,) = staging._pending
+        results_path = tmp_path / "results-0001.jsonl"
+        results_path.write_text(json.dumps({"custom_id": custom_id, "response": {"status_code": 500, "body": {}},
+                                            "error": error}) + "\n", encoding="utf-8")
+        assert staging.ingest(str(results_path)) == 0
+        with pytest.raises(LLMDispatchError, match="fallo simulado"):
+            await call
+
+    asyncio.run(scenario())
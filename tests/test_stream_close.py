@@ -0,0 +1,59 @@
+import asyncio
+from contextlib import aclosing
+
+from core.llm.backends import ConcurrencyLimitedBackend, FakeLLMBackend
+from core.llm.rate_limit import RateLimitedBackend
+
+
+class ClosingFakeBackend(FakeLLMBackend):
+    """FakeLLMBackend que anota cuándo se cierra cada stream."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.open_streams = 0
+
+    async def stream(self, model, messages, **params):
+        self.open_streams += 1
+        try:
+            async for delta in super().stream(model, messages, **params):
+                yield delta
+        finally:
+            self.open_streams -= 1
+
+
+def prompt():
+    return [{"role": "user", "content": "Cuenta algo"}]
+
+
+def test_consumer_stopping_early_closes_the_upstream_stream():
+    fake = ClosingFakeBackend(tokens_per_second=500, contribution_words=200)
+    backend = RateLimitedBackend(ConcurrencyLimitedBackend(fake, 2))
+
+    async def run():
+        async with aclosing(backend.stream("gpt-4o-mini", prompt())) as deltas:
+            async for _ in deltas:
+                break
+        # Sin esperar al recolector de basura
+        return fake.open_streams
+
+    assert asyncio.run(run()) == 0
+
+
+def test_cancelled_consumer_closes_the_upstream_stream_and_frees_its_slot():
+    fake = ClosingFakeBackend(tokens_per_second=100, contribution_words=200)
+    limited = ConcurrencyLimitedBackend(fake, 1)
+    backend = RateLimitedBackend(limited)
+
+    async def consume():
+        async for _ in backend.stream("gpt-4o-mini", prompt()):
+            pass
+
+    async def run():
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        assert fake.open_streams == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return fake.open_streams, limited.in_flight
+
+    assert asyncio.run(run()) == (0, 0)
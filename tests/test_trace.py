@@ -0,0 +1,25 @@
+import asyncio
+
+from core.agents.orchestrator import StoryOrchestrator
+from core.llm.backends import FakeLLMBackend
+from core.services.metrics import Metrics
+
+
+def test_streamed_calls_report_tokens_and_cost():
+    metrics = Metrics()
+
+    async def run():
+        orchestrator = StoryOrchestrator(FakeLLMBackend(chapters=2, chapter_words=80), prefetch_depth=0,
+                                         metrics=metrics)
+        orchestrator.add_character_agent("Ana")
+        await orchestrator.generate_story("Una expedición a una cueva", 1000, "descriptivo", ["Ana"])
+        orchestrator.close()
+        return orchestrator.trace.roles
+
+    roles = asyncio.run(run())
+    # El esquema y el capítulo del Narrador llegan en streaming
+    for role in ("planeador", "narrador"):
+        assert roles[role]["prompt_tokens"] > 0
+        assert roles[role]["completion_tokens"] > 0
+        assert roles[role]["cost_usd"] > 0
+        assert metrics.counter_value("agent_tokens_total", role=role, kind="completion") > 0